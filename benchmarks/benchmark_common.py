@@ -0,0 +1,198 @@
+import json
+import os
+import platform
+import sys
+import time
+
+# Shared helpers for the benchmark scripts. Each benchmark produces a
+# dictionary of results keyed by benchmark name; each result is a dictionary
+# with keys value, unit and tolerance (the fractional increase over the
+# baseline that counts as a regression: timings are noisy, so they get a
+# generous tolerance, while counts of BLE round trips and connections are
+# deterministic and get none)
+
+# Tolerance for timings
+TIME_TOLERANCE = 0.25
+
+# Tolerance for timings of microbenchmarks (calls of a few microseconds vary
+# much more from run to run, so only flag a doubling)
+MICROBENCHMARK_TOLERANCE = 1.0
+
+# Tolerance for counts
+COUNT_TOLERANCE = 0.0
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# Function for making sure the package is imported from this checkout (rather
+# than an installed copy) when a benchmark script is run directly
+def add_package_path():
+    package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if package_path not in sys.path:
+        sys.path.insert(0, package_path)
+    return package_path
+
+def time_result(
+    value,
+    tolerance = TIME_TOLERANCE):
+    return {
+        'value': value,
+        'unit': 's',
+        'tolerance': tolerance}
+
+def count_result(value):
+    return {
+        'value': value,
+        'unit': 'count',
+        'tolerance': COUNT_TOLERANCE}
+
+# Function for timing a function call. The function is called in loops of
+# number calls (chosen so that a loop takes at least min_time seconds if
+# number is None) and the fastest of repeat loops is used. Returns seconds per
+# call
+def time_function(
+    function,
+    number = None,
+    repeat = 5,
+    min_time = 0.2):
+    if number is None:
+        number = 1
+        while True:
+            start_time = time.perf_counter()
+            for call_index in range(number):
+                function()
+            if time.perf_counter() - start_time >= min_time:
+                break
+            number *= 2
+    best_time = None
+    for repeat_index in range(repeat):
+        start_time = time.perf_counter()
+        for call_index in range(number):
+            function()
+        loop_time = time.perf_counter() - start_time
+        if best_time is None or loop_time < best_time:
+            best_time = loop_time
+    return best_time/number
+
+def get_machine_description():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'processor': platform.processor()}
+
+def load_baselines(path = None):
+    if path is None:
+        path = BASELINES_PATH
+    if not os.path.exists(path):
+        return {'machine': None, 'results': {}}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+# Function for saving results as the new baselines. If result_prefixes (a
+# list of prefixes of the names of the benchmarks that were run) is specified,
+# existing baselines whose names start with one of them are dropped (so that
+# benchmarks that were removed or renamed do not keep their old baselines).
+# Other existing baselines are kept
+def save_baselines(
+    results,
+    path = None,
+    result_prefixes = None):
+    if path is None:
+        path = BASELINES_PATH
+    baselines = load_baselines(path)
+    baselines['machine'] = get_machine_description()
+    if result_prefixes is not None:
+        baselines['results'] = {
+            name: value for name, value in baselines['results'].items()
+            if not any(name.startswith(result_prefix) for result_prefix in result_prefixes)}
+    baselines['results'].update(results)
+    baselines['results'] = dict(sorted(baselines['results'].items()))
+    with open(path, 'w') as file:
+        json.dump(baselines, file, indent=2)
+        file.write('\n')
+
+# Function for comparing results with baselines. Returns a list of
+# dictionaries (one per benchmark with a baseline) with keys name, value,
+# baseline, change (fractional), regression and missing. If result_prefixes
+# (a list of prefixes of the names of the benchmarks that were run) is
+# specified, every baseline whose name starts with one of them but which has
+# no result (e.g., because a module failed to import) is also included, with
+# value and change None, and counts as a regression
+def compare_with_baselines(
+    results,
+    baselines,
+    result_prefixes = None):
+    comparisons = []
+    for name, result in results.items():
+        baseline_result = baselines['results'].get(name)
+        if baseline_result is None:
+            continue
+        value = result['value']
+        baseline_value = baseline_result['value']
+        if baseline_value == 0:
+            change = 0.0 if value == 0 else float('inf')
+        else:
+            change = (value - baseline_value)/baseline_value
+        comparisons.append({
+            'name': name,
+            'value': value,
+            'baseline': baseline_value,
+            'change': change,
+            'regression': change > result['tolerance'],
+            'missing': False})
+    if result_prefixes is not None:
+        for name, baseline_result in baselines['results'].items():
+            if name in results or not name.startswith(tuple(result_prefixes)):
+                continue
+            comparisons.append({
+                'name': name,
+                'value': None,
+                'baseline': baseline_result['value'],
+                'change': None,
+                'regression': True,
+                'missing': True})
+    return comparisons
+
+def format_value(
+    value,
+    unit):
+    if unit == 's':
+        if value < 1e-3:
+            return '{:.2f} us'.format(value*1e6)
+        if value < 1.0:
+            return '{:.2f} ms'.format(value*1e3)
+        return '{:.2f} s'.format(value)
+    return '{}'.format(value)
+
+# Function for printing results (with the change from the baseline, where
+# there is one), followed by any missing results (see compare_with_baselines)
+def print_results(
+    results,
+    baselines = None,
+    result_prefixes = None):
+    comparisons = {}
+    if baselines is not None:
+        comparisons = {comparison['name']: comparison for comparison in compare_with_baselines(results, baselines, result_prefixes)}
+    missing_comparisons = [comparison for comparison in comparisons.values() if comparison['missing']]
+    name_width = max([len(name) for name in list(results.keys()) + [comparison['name'] for comparison in missing_comparisons]] + [10])
+    for name, result in results.items():
+        line = '{:<{}}  {:>12}'.format(
+            name,
+            name_width,
+            format_value(result['value'], result['unit']))
+        comparison = comparisons.get(name)
+        if comparison is not None:
+            line += '  {:+7.1%} vs {:>12}'.format(
+                comparison['change'],
+                format_value(comparison['baseline'], result['unit']))
+            if comparison['regression']:
+                line += '  REGRESSION'
+        print(line)
+    for comparison in missing_comparisons:
+        print('{:<{}}  {:>12}  {:>7} vs {:>12}  REGRESSION'.format(
+            comparison['name'],
+            name_width,
+            'missing',
+            '',
+            format_value(comparison['baseline'], baselines['results'][comparison['name']]['unit'])))
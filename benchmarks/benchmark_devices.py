@@ -0,0 +1,206 @@
+import benchmark_common
+import argparse
+import logging
+import time
+
+benchmark_common.add_package_path()
+
+import decawave_ble
+import decawave_ble.configure_devices
+import decawave_ble.simulator
+from decawave_ble.config import ConfigurationDatabase
+
+# End-to-end benchmarks of reading and configuring a fleet of devices against
+# the simulated transport (see decawave_ble.simulator), so that the effect of
+# changes to concurrency, caching and retries can be measured without radios.
+# For each run, the wall time and the numbers of connections opened and BLE
+# round trips (service discoveries, reads and writes) are reported
+
+# Prefixes of the names of the results of this suite (see run_benchmarks.py)
+RESULT_PREFIXES = ['get_data_multiple_devices.', 'configure_devices_from_database.']
+
+# Default simulated GATT latency (seconds). BLE connection intervals are
+# typically tens of milliseconds, so a round trip takes about this long
+DEFAULT_LATENCY = 0.02
+
+# Default simulated connection latency (seconds)
+DEFAULT_CONNECT_LATENCY = 0.1
+
+# Class to represent a configuration database held in memory (a dictionary of
+# target data keyed by device name)
+class ConfigurationDatabaseMemory(ConfigurationDatabase):
+    def __init__(self, configuration):
+        self.configuration = configuration
+
+    def load_configuration(self):
+        return self.configuration
+
+# Function for building a target configuration for every node in a simulated
+# network which differs from its current configuration (anchors are moved and
+# made initiators, tags get new update rates)
+def get_target_configuration(simulated_network):
+    configuration = {}
+    for node in simulated_network.get_nodes():
+        network_id = node.get_network_id()
+        if node.is_anchor():
+            position = node.get_position()
+            configuration[node.device_name] = {
+                'device_type_name': 'Anchor',
+                'uwb_mode_name': 'Active',
+                'initiator': True,
+                'network_id': network_id,
+                'x_position': int(position[0]) + 10,
+                'y_position': int(position[1]) + 10,
+                'z_position': int(position[2]),
+                'quality': 100}
+        else:
+            configuration[node.device_name] = {
+                'device_type_name': 'Tag',
+                'uwb_mode_name': 'Active',
+                'network_id': network_id,
+                'moving_update_rate': 200,
+                'stationary_update_rate': 5000}
+    return configuration
+
+# Function for running a function against a simulated transport and recording
+# its wall time and transport statistics under prefix
+def measure_run(
+    results,
+    prefix,
+    simulated_transport,
+    function):
+    simulated_transport.reset_statistics()
+    start_time = time.perf_counter()
+    function()
+    wall_time = time.perf_counter() - start_time
+    statistics = simulated_transport.get_statistics()
+    results['{}.wall_time'.format(prefix)] = benchmark_common.time_result(wall_time)
+    results['{}.connections'.format(prefix)] = benchmark_common.count_result(statistics['connections'])
+    results['{}.round_trips'.format(prefix)] = benchmark_common.count_result(
+        statistics['discoveries'] +
+        statistics['reads'] +
+        statistics['writes'])
+    results['{}.reads'.format(prefix)] = benchmark_common.count_result(statistics['reads'])
+    results['{}.writes'.format(prefix)] = benchmark_common.count_result(statistics['writes'])
+
+def run_benchmarks(
+    num_anchors = 4,
+    num_tags = 46,
+    latency = DEFAULT_LATENCY,
+    connect_latency = DEFAULT_CONNECT_LATENCY,
+    max_connections_per_interface = None):
+    results = {}
+    simulated_network = decawave_ble.simulator.create_simulated_network(
+        num_anchors = num_anchors,
+        num_tags = num_tags,
+        seed = 0)
+    simulated_transport = decawave_ble.simulator.SimulatedTransport(
+        simulated_network,
+        latency = latency,
+        connect_latency = connect_latency,
+        discovery_time = 0.1,
+        seed = 0)
+    previous_transport = decawave_ble.set_transport(simulated_transport)
+    try:
+        device_names = [node.device_name for node in simulated_network.get_nodes()]
+        decawave_devices = decawave_ble.scan_for_decawave_devices(
+            timeout = 1.0,
+            device_names = device_names)
+        prefix = 'get_data_multiple_devices.{}_devices'.format(len(decawave_devices))
+        measure_run(
+            results,
+            prefix + '.sequential',
+            simulated_transport,
+            lambda: decawave_ble.get_data_multiple_devices(decawave_devices))
+        measure_run(
+            results,
+            prefix + '.concurrent',
+            simulated_transport,
+            lambda: decawave_ble.get_data_multiple_devices(
+                decawave_devices,
+                concurrent = True,
+                max_connections_per_interface = max_connections_per_interface,
+                interfaces = [0]))
+        measure_run(
+            results,
+            prefix + '.concurrent_location_data',
+            simulated_transport,
+            lambda: decawave_ble.get_data_multiple_devices(
+                decawave_devices,
+                concurrent = True,
+                max_connections_per_interface = max_connections_per_interface,
+                interfaces = [0],
+                fields = ['location_data']))
+        configuration_database = ConfigurationDatabaseMemory(get_target_configuration(simulated_network))
+        prefix = 'configure_devices_from_database.{}_devices'.format(len(decawave_devices))
+        measure_run(
+            results,
+            prefix + '.changed',
+            simulated_transport,
+            lambda: decawave_ble.configure_devices.configure_devices_from_database(
+                configuration_database,
+                concurrent = True,
+                max_connections_per_interface = max_connections_per_interface,
+                interfaces = [0],
+                scan_timeout = 1.0))
+        measure_run(
+            results,
+            prefix + '.unchanged',
+            simulated_transport,
+            lambda: decawave_ble.configure_devices.configure_devices_from_database(
+                configuration_database,
+                concurrent = True,
+                max_connections_per_interface = max_connections_per_interface,
+                interfaces = [0],
+                scan_timeout = 1.0))
+    finally:
+        decawave_ble.set_transport(previous_transport)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reading and configuring devices against a simulated transport.')
+    parser.add_argument(
+        '-a',
+        '--anchors',
+        type = int,
+        default = 4,
+        help = 'number of simulated anchors (default 4)'
+    )
+    parser.add_argument(
+        '-t',
+        '--tags',
+        type = int,
+        default = 46,
+        help = 'number of simulated tags (default 46)'
+    )
+    parser.add_argument(
+        '--latency',
+        type = float,
+        default = DEFAULT_LATENCY,
+        help = 'simulated latency of each BLE round trip in seconds (default {})'.format(DEFAULT_LATENCY)
+    )
+    parser.add_argument(
+        '--connect-latency',
+        type = float,
+        default = DEFAULT_CONNECT_LATENCY,
+        help = 'simulated connection latency in seconds (default {})'.format(DEFAULT_CONNECT_LATENCY)
+    )
+    parser.add_argument(
+        '-m',
+        '--max-connections',
+        type = int,
+        help = 'maximum number of simultaneous connections when working concurrently'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    benchmark_common.print_results(
+        run_benchmarks(
+            num_anchors = args.anchors,
+            num_tags = args.tags,
+            latency = args.latency,
+            connect_latency = args.connect_latency,
+            max_connections_per_interface = args.max_connections),
+        benchmark_common.load_baselines())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import benchmark_common
+import argparse
+import os
+import subprocess
+import sys
+
+# Benchmarks of the time taken to import the package and each configuration
+# backend in a fresh interpreter (as paid by every CLI invocation). Each
+# module is imported in a new process repeat times and the fastest import is
+# reported. Modules which fail to import have no result, which counts as a
+# regression if they have a baseline (see benchmark_common)
+
+# Prefixes of the names of the results of this suite (see run_benchmarks.py)
+RESULT_PREFIXES = ['import.']
+
+IMPORT_MODULES = [
+    'decawave_ble',
+    'decawave_ble.codecs',
+    'decawave_ble.records',
+    'decawave_ble.config',
+    'decawave_ble.config.csv',
+    'decawave_ble.config.csvs3',
+    'decawave_ble.tools.read_device_data_local',
+    'decawave_ble.tools.configure_devices_local']
+
+IMPORT_SCRIPT = '''
+import time
+start_time = time.perf_counter()
+import {}
+print(time.perf_counter() - start_time)
+'''
+
+# Function for measuring the time taken to import a module in a fresh
+# interpreter. Returns seconds, or None if the module cannot be imported
+def time_import(
+    module_name,
+    repeat = 5):
+    package_path = benchmark_common.add_package_path()
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([package_path] + [path for path in environment.get('PYTHONPATH', '').split(os.pathsep) if path != ''])
+    best_time = None
+    for repeat_index in range(repeat):
+        completed_process = subprocess.run(
+            [sys.executable, '-c', IMPORT_SCRIPT.format(module_name)],
+            env=environment,
+            capture_output=True,
+            text=True)
+        if completed_process.returncode != 0:
+            return None
+        import_time = float(completed_process.stdout.strip().splitlines()[-1])
+        if best_time is None or import_time < best_time:
+            best_time = import_time
+    return best_time
+
+def run_benchmarks(repeat = 5):
+    results = {}
+    for module_name in IMPORT_MODULES:
+        import_time = time_import(module_name, repeat)
+        if import_time is None:
+            print('Failed to import {}; no result'.format(module_name))
+            continue
+        results['import.{}'.format(module_name)] = benchmark_common.time_result(import_time)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the time taken to import the package and its configuration backends.')
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type = int,
+        default = 5,
+        help = 'number of imports per module (the fastest is reported; default 5)'
+    )
+    args = parser.parse_args()
+    benchmark_common.print_results(
+        run_benchmarks(repeat = args.repeat),
+        benchmark_common.load_baselines())
+
+if __name__ == '__main__':
+    main()
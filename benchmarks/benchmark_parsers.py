@@ -0,0 +1,186 @@
+import benchmark_common
+import argparse
+import random
+
+benchmark_common.add_package_path()
+
+import decawave_ble.codecs as codecs
+import decawave_ble.records as records
+
+# Microbenchmarks of the parse_*_bytes and pack_*_bytes functions in
+# decawave_ble.codecs (and the record parsers in decawave_ble.records) on
+# realistic payloads, including the largest location data and proxy
+# positions frames (MAX_DISTANCE_COUNT distances, MAX_PROXY_POSITION_COUNT
+# proxy positions). Results are seconds per call
+
+# Largest number of distances in a location data frame (a tag ranges to at
+# most 15 anchors)
+MAX_DISTANCE_COUNT = 15
+
+# Largest number of proxy positions in a proxy positions frame
+MAX_PROXY_POSITION_COUNT = 15
+
+# Prefixes of the names of the results of this suite (see run_benchmarks.py)
+RESULT_PREFIXES = ['parse.', 'pack.', 'parse_record.', 'parse_batch.']
+
+# Number of frames decoded per call in the batch benchmarks
+BATCH_SIZE = 1000
+
+def get_position_data(random_generator):
+    return {
+        'x_position': random_generator.randint(-20000, 20000),
+        'y_position': random_generator.randint(-20000, 20000),
+        'z_position': random_generator.randint(0, 3000),
+        'quality': random_generator.randint(0, 100)}
+
+def get_distance_data(
+    random_generator,
+    distance_count):
+    return [
+        {
+            'node_id': random_generator.randint(0, 0xffff),
+            'distance': random_generator.randint(0, 30000),
+            'quality': random_generator.randint(0, 100)}
+        for distance_index in range(distance_count)]
+
+# Function for building the data (as returned by the parse functions) for each
+# payload benchmarked. Returns a dictionary keyed by payload name of tuples
+# (parse_function, pack_function, data)
+def get_payloads(seed = 0):
+    random_generator = random.Random(seed)
+    position_data = get_position_data(random_generator)
+    proxy_positions_data = []
+    for proxy_position_index in range(MAX_PROXY_POSITION_COUNT):
+        proxy_position_data = get_position_data(random_generator)
+        proxy_position_data['node_id'] = random_generator.randint(0, 0xffff)
+        proxy_positions_data.append(proxy_position_data)
+    return {
+        'operation_mode': (
+            codecs.parse_operation_mode_bytes,
+            codecs.pack_operation_mode_bytes,
+            codecs.parse_operation_mode_bytes(bytes([0b10111000, 0x20]))),
+        'location_data_mode': (
+            codecs.parse_location_data_mode_bytes,
+            codecs.pack_location_data_mode_bytes,
+            codecs.parse_location_data_mode_bytes(bytes([2]))),
+        'location_data_position': (
+            codecs.parse_location_data_bytes,
+            codecs.pack_location_data_bytes,
+            {
+                'location_data_content': 0,
+                'location_data_content_name': codecs.LOCATION_DATA_CONTENT_NAMES[0],
+                'position_data': position_data,
+                'distance_data': None}),
+        'location_data_4_distances': (
+            codecs.parse_location_data_bytes,
+            codecs.pack_location_data_bytes,
+            {
+                'location_data_content': 2,
+                'location_data_content_name': codecs.LOCATION_DATA_CONTENT_NAMES[2],
+                'position_data': position_data,
+                'distance_data': get_distance_data(random_generator, 4)}),
+        'location_data_max_distances': (
+            codecs.parse_location_data_bytes,
+            codecs.pack_location_data_bytes,
+            {
+                'location_data_content': 2,
+                'location_data_content_name': codecs.LOCATION_DATA_CONTENT_NAMES[2],
+                'position_data': position_data,
+                'distance_data': get_distance_data(random_generator, MAX_DISTANCE_COUNT)}),
+        'network_id': (
+            codecs.parse_network_id_bytes,
+            codecs.pack_network_id_bytes,
+            0x1234),
+        'proxy_positions_max': (
+            codecs.parse_proxy_positions_bytes,
+            codecs.pack_proxy_positions_bytes,
+            proxy_positions_data),
+        'device_info': (
+            codecs.parse_device_info_bytes,
+            codecs.pack_device_info_bytes,
+            {
+                'node_id': 0xdeca0000000012ab,
+                'hw_version': 0x2a,
+                'fw1_version': 0x01030000,
+                'fw2_version': 0x01030000,
+                'fw1_checksum': 0x12345678,
+                'fw2_checksum': 0x9abcdef0,
+                'bridge': False,
+                'unknown': 0}),
+        'anchor_list_max': (
+            codecs.parse_anchor_list_bytes,
+            codecs.pack_anchor_list_bytes,
+            [random_generator.randint(0, 0xffff) for anchor_index in range(30)]),
+        'update_rate': (
+            codecs.parse_update_rate_bytes,
+            codecs.pack_update_rate_bytes,
+            {
+                'moving_update_rate': 100,
+                'stationary_update_rate': 10000})}
+
+# Record parsers (see decawave_ble.records) benchmarked on the same payloads
+RECORD_PARSE_FUNCTIONS = {
+    'operation_mode': records.parse_operation_mode_record,
+    'location_data_mode': records.parse_location_data_mode_record,
+    'location_data_position': records.parse_location_data_record,
+    'location_data_4_distances': records.parse_location_data_record,
+    'location_data_max_distances': records.parse_location_data_record,
+    'proxy_positions_max': records.parse_proxy_positions_record,
+    'device_info': records.parse_device_info_record,
+    'anchor_list_max': records.parse_anchor_list_record,
+    'update_rate': records.parse_update_rate_record}
+
+def run_benchmarks(
+    repeat = 5,
+    min_time = 0.2):
+    results = {}
+    payloads = get_payloads()
+    for payload_name, (parse_function, pack_function, data) in payloads.items():
+        payload_bytes = pack_function(data)
+        if parse_function(payload_bytes) != data:
+            raise ValueError('Payload {} does not round trip'.format(payload_name))
+        results['parse.{}'.format(payload_name)] = benchmark_common.time_result(benchmark_common.time_function(
+            lambda: parse_function(payload_bytes),
+            repeat = repeat,
+            min_time = min_time),
+            benchmark_common.MICROBENCHMARK_TOLERANCE)
+        results['pack.{}'.format(payload_name)] = benchmark_common.time_result(benchmark_common.time_function(
+            lambda: pack_function(data),
+            repeat = repeat,
+            min_time = min_time),
+            benchmark_common.MICROBENCHMARK_TOLERANCE)
+        record_parse_function = RECORD_PARSE_FUNCTIONS.get(payload_name)
+        if record_parse_function is not None:
+            results['parse_record.{}'.format(payload_name)] = benchmark_common.time_result(benchmark_common.time_function(
+                lambda: record_parse_function(payload_bytes),
+                repeat = repeat,
+                min_time = min_time),
+                benchmark_common.MICROBENCHMARK_TOLERANCE)
+    try:
+        import decawave_ble.batch
+    except ImportError:
+        print('NumPy not installed; skipping batch benchmarks')
+    else:
+        location_data_frames = [codecs.pack_location_data_bytes(payloads['location_data_4_distances'][2])]*BATCH_SIZE
+        results['parse_batch.location_data_4_distances_x{}'.format(BATCH_SIZE)] = benchmark_common.time_result(benchmark_common.time_function(
+            lambda: decawave_ble.batch.parse_location_data_frames(location_data_frames),
+            repeat = repeat,
+            min_time = min_time))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Decawave characteristic parsers and packers.')
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type = int,
+        default = 5,
+        help = 'number of timing loops per benchmark (the fastest is reported; default 5)'
+    )
+    args = parser.parse_args()
+    benchmark_common.print_results(
+        run_benchmarks(repeat = args.repeat),
+        benchmark_common.load_baselines())
+
+if __name__ == '__main__':
+    main()
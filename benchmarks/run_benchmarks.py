@@ -0,0 +1,81 @@
+import benchmark_common
+import benchmark_parsers
+import benchmark_devices
+import benchmark_imports
+import argparse
+import json
+import logging
+import sys
+
+# Runs the benchmark suites and compares the results with the tracked
+# baselines in baselines.json. Exits with status 1 if any benchmark has
+# regressed by more than its tolerance (see benchmark_common), so it can be run
+# before deploying. Baselines depend on the machine, so they should be updated
+# (with --update-baselines) when moving to a new one, and whenever a change is
+# expected to alter performance
+
+# Benchmark modules by suite name. Each provides run_benchmarks() and
+# RESULT_PREFIXES (the prefixes of the names of its results, so that
+# baselines of a suite that was run but which have no result are reported as
+# regressions)
+SUITES = {
+    'parsers': benchmark_parsers,
+    'devices': benchmark_devices,
+    'imports': benchmark_imports}
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the decawave_ble benchmarks and compare with baselines.')
+    parser.add_argument(
+        '-s',
+        '--suites',
+        help = 'comma-separated list of suites to run (from {}; default all)'.format(','.join(SUITES.keys()))
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help = 'file to write the results to (JSON)'
+    )
+    parser.add_argument(
+        '-u',
+        '--update-baselines',
+        action = 'store_true',
+        help = 'save the results as the new baselines'
+    )
+    parser.add_argument(
+        '-b',
+        '--baselines',
+        help = 'baselines file (default benchmarks/baselines.json)'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    if args.suites is None:
+        suite_names = list(SUITES.keys())
+    else:
+        suite_names = [suite_name.strip() for suite_name in args.suites.split(',') if suite_name.strip() != '']
+        unknown_suite_names = [suite_name for suite_name in suite_names if suite_name not in SUITES]
+        if len(unknown_suite_names) > 0:
+            raise ValueError('Suites not recognized: {}'.format(unknown_suite_names))
+    results = {}
+    result_prefixes = []
+    for suite_name in suite_names:
+        print('Running {} benchmarks'.format(suite_name))
+        results.update(SUITES[suite_name].run_benchmarks())
+        result_prefixes.extend(SUITES[suite_name].RESULT_PREFIXES)
+    baselines = benchmark_common.load_baselines(args.baselines)
+    benchmark_common.print_results(results, baselines, result_prefixes)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'machine': benchmark_common.get_machine_description(),
+                'results': results}, file, indent=2)
+    if args.update_baselines:
+        benchmark_common.save_baselines(results, args.baselines, result_prefixes)
+        print('Baselines updated')
+        return
+    regressions = [comparison['name'] for comparison in benchmark_common.compare_with_baselines(results, baselines, result_prefixes) if comparison['regression']]
+    if len(regressions) > 0:
+        print('{} benchmarks regressed: {}'.format(len(regressions), regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,84 @@
-import bluepy.btle
-import bitstruct
-import tenacity
+import array
 import json
 import logging
+import os
+import queue
+import sys
+import threading
+import time
+import concurrent.futures
+
+from decawave_ble.codecs import (
+    DEVICE_TYPE_NAMES,
+    UWB_MODE_NAMES,
+    FW_VERSION_NAMES,
+    LOCATION_DATA_MODE_NAMES,
+    LOCATION_DATA_CONTENT_NAMES,
+    parse_operation_mode_bytes,
+    pack_operation_mode_bytes,
+    parse_location_data_mode_bytes,
+    pack_location_data_mode_bytes,
+    parse_position_bytes,
+    pack_position_bytes,
+    parse_location_data_bytes,
+    pack_location_data_bytes,
+    parse_network_id_bytes,
+    pack_network_id_bytes,
+    parse_proxy_positions_bytes,
+    pack_proxy_positions_bytes,
+    parse_device_info_bytes,
+    pack_device_info_bytes,
+    parse_anchor_list_bytes,
+    pack_anchor_list_bytes,
+    parse_update_rate_bytes,
+    pack_update_rate_bytes,
+    pack_persisted_position_bytes)
+import decawave_ble.metrics
+import decawave_ble.records
+import decawave_ble.retry
 
 logger = logging.getLogger(__name__)
 
-retry_initial_wait = 0.1 # seconds
-retry_num_attempts = 3
-exponential_retry = tenacity.retry(
-        stop = tenacity.stop_after_attempt(retry_num_attempts),
-        wait = tenacity.wait_exponential(multiplier=retry_initial_wait/2),
-        before = tenacity.before_log(logger, logging.DEBUG),
-        after = tenacity.after_log(logger, logging.DEBUG),
-        before_sleep = tenacity.before_sleep_log(logger, logging.WARNING))
-
+# Retry policy used when none is specified (see decawave_ble.retry). Replace
+# it (e.g., decawave_ble.default_retry_policy =
+# decawave_ble.retry.RetryPolicy(deadline=60.0)) to change the default
+default_retry_policy = decawave_ble.retry.RetryPolicy()
+
+# BLE transport through which all scanning and connections go: a module or
+# object providing Scanner, Peripheral, UUID and the exceptions
+# BTLEException and BTLEDisconnectError (a subclass of BTLEException) with the
+# interface of bluepy.btle. Replace it with
+# set_transport (e.g., with a decawave_ble.simulator.SimulatedTransport) to
+# run without radios. None means bluepy.btle, which is only imported on first
+# use (see get_transport) so that the codecs, parsers and configuration tools
+# can be used on hosts without bluepy
+transport = None
+
+# Maximum number of simultaneous connections to open on each HCI interface
+# when working with multiple devices concurrently. Many BLE controllers
+# (including the one on the Raspberry Pi) cannot maintain more than a handful
+# of central connections at once, so this should not be set above the limit
+# of the controller in use
+default_max_connections_per_interface = 4
+
+# ATT MTU to request when streaming location data notifications. The default
+# BLE MTU only leaves room for 20 bytes of data, which is not enough for
+# location data that includes distances
+location_data_notification_mtu = 247
+
+
+# Fields of the data returned by get_data which are read from the device, in
+# the order in which they are read (see DATA_FIELD_FUNCTIONS for the function
+# which reads each one)
+DATA_FIELDS = [
+    'operation_mode_data',
+    'device_info_data',
+    'network_id',
+    'location_data_mode_data',
+    'location_data',
+    'proxy_positions_data',
+    'anchor_list_data',
+    'update_rate_data']
 
 # BLE advertising data type codes
 SHORT_LOCAL_NAME_TYPE_CODE = 8
@@ -43,29 +107,24 @@ ANCHOR_MAC_STATS_CHARACTERISTIC_UUID = '28d01d60-89de-4bfa-b6e9-651ba596232c'
 ANCHOR_LIST_CHARACTERISTIC_UUID = '5b10c428-af2f-486f-aee1-9dbd79b6bccb'
 TAG_UPDATE_RATE_CHARACTERISTIC_UUID = '7bd47f30-5602-4389-b069-8305731308b6'
 
-# Names of operation mode data values
-DEVICE_TYPE_NAMES = ['Tag', 'Anchor']
-UWB_MODE_NAMES = ['Off', 'Passive', 'Active']
-FW_VERSION_NAMES = ['1', '2']
-
-# Names of location data mode data values
-LOCATION_DATA_MODE_NAMES = [
-    'Position only',
-    'Distances only',
-    'Position and distances']
-
-# Names of location data content values
-LOCATION_DATA_CONTENT_NAMES = [
-    'Position only',
-    'Distances only',
-    'Position and distances']
+# Standard BLE descriptors
+CLIENT_CHARACTERISTIC_CONFIGURATION_DESCRIPTOR_UUID = '00002902-0000-1000-8000-00805f9b34fb'
 
 # Extend the default JSON encoder so it can handle bluepy.btle.UUID objects
+# (which can only exist if bluepy has already been imported) and the UUID
+# objects of the transport in use
 class CustomJSONEncoder(json.JSONEncoder):
         def default(self, obj):
-                if isinstance(obj, bluepy.btle.UUID):
+                btle = sys.modules.get('bluepy.btle')
+                if btle is not None and isinstance(obj, btle.UUID):
+                        return str(obj)
+                if transport is not None and isinstance(obj, transport.UUID):
                         return str(obj)
-                return json.JSONencoder.default(self.obj)
+                if isinstance(obj, (decawave_ble.records.Record, decawave_ble.records.RecordList)):
+                        return obj.to_dict()
+                if isinstance(obj, array.array):
+                        return obj.tolist()
+                return json.JSONEncoder.default(self, obj)
 
 # Class to represent a Decawave DWM1001 device
 class DecawaveDevice:
@@ -100,20 +159,117 @@ class DecawaveDevice:
             'connectable': self.connectable,
             'advertising_data': self.advertising_data}
 
-# Function for finding Decawave devices:
-def scan_for_decawave_devices():
-    decawave_scan_entries = get_decawave_scan_entries()
-    decawave_devices = {}
-    for decawave_scan_entry in decawave_scan_entries:
-        decawave_device = DecawaveDevice(decawave_scan_entry)
-        decawave_devices[decawave_device.device_name] = decawave_device
-    return decawave_devices
+    # Create a device from previously saved scan data (see scan_data) so that
+    # it can be connected to by address without scanning
+    @classmethod
+    def from_scan_data(cls, scan_data):
+        decawave_device = cls.__new__(cls)
+        decawave_device.scan_entry = None
+        decawave_device.device_name = scan_data['device_name']
+        decawave_device.mac_address = scan_data['mac_address']
+        decawave_device.address_type = scan_data['address_type']
+        decawave_device.interface = scan_data['interface']
+        decawave_device.rssi = scan_data.get('rssi')
+        decawave_device.connectable = scan_data.get('connectable')
+        decawave_device.advertising_data = scan_data.get('advertising_data', [])
+        return decawave_device
+
+# Function for importing bluepy.btle on first use (importing it is slow and
+# it is not needed for parsing or configuration)
+def get_btle():
+    import bluepy.btle
+    return bluepy.btle
+
+# Function for getting the BLE transport in use (see transport)
+def get_transport():
+    if transport is None:
+        return get_btle()
+    return transport
+
+# Function for setting the BLE transport (see transport). Restores bluepy if
+# new_transport is None. Returns the previous transport (None for bluepy)
+def set_transport(new_transport = None):
+    global transport
+    previous_transport = transport
+    transport = new_transport
+    return previous_transport
+
+# Function for finding Decawave devices. Scans for timeout seconds or until
+# every device in device_names (if specified) has been found
+def scan_for_decawave_devices(
+    timeout = 10.0,
+    device_names = None,
+    interface = 0,
+    retry_policy = None):
+    def scan():
+        decawave_devices = {}
+        for decawave_device in stream_decawave_devices(timeout, device_names, interface):
+            decawave_devices[decawave_device.device_name] = decawave_device
+        return decawave_devices
+    return get_retry_policy(retry_policy).call(scan)
+
+# Class for collecting Decawave scan entries as they are discovered (bluepy
+# only calls handleDiscovery, so there is no need to subclass
+# bluepy.btle.DefaultDelegate)
+class DecawaveScanDelegate:
+    def __init__(self):
+        self.decawave_scan_entries = queue.Queue()
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        if is_decawave_scan_entry(scanEntry):
+            self.decawave_scan_entries.put(scanEntry)
+
+# Function for finding Decawave devices incrementally. Yields each Decawave
+# device as soon as it is first seen. Stops after timeout seconds or (if
+# device_names is specified) as soon as all of the named devices have been
+# seen
+def stream_decawave_devices(
+    timeout = 10.0,
+    device_names = None,
+    interface = 0,
+    poll_interval = 0.1):
+    if device_names is not None:
+        remaining_device_names = set(device_names)
+        if len(remaining_device_names) == 0:
+            return
+    found_device_names = set()
+    scan_start_time = time.perf_counter()
+    scan_delegate = DecawaveScanDelegate()
+    scanner = get_transport().Scanner(interface).withDelegate(scan_delegate)
+    end_time = time.monotonic() + timeout
+    scanner.clear()
+    scanner.start()
+    try:
+        while True:
+            while not scan_delegate.decawave_scan_entries.empty():
+                decawave_device = DecawaveDevice(scan_delegate.decawave_scan_entries.get())
+                if decawave_device.device_name in found_device_names:
+                    continue
+                found_device_names.add(decawave_device.device_name)
+                logger.debug('Found {}'.format(decawave_device.device_name))
+                yield decawave_device
+                if device_names is not None:
+                    remaining_device_names.discard(decawave_device.device_name)
+                    if len(remaining_device_names) == 0:
+                        logger.debug('Found all specified devices')
+                        return
+            remaining_time = end_time - time.monotonic()
+            if remaining_time <= 0:
+                return
+            scanner.process(min(poll_interval, remaining_time))
+    finally:
+        try:
+            scanner.stop()
+        except get_transport().BTLEException as e:
+            logger.debug('Failed to stop scanner: {}'.format(repr(e)))
+        decawave_ble.metrics.record(
+            'scan',
+            time.perf_counter() - scan_start_time)
 
 # Function for retrieving Decawave scan entries
-@exponential_retry
-def get_decawave_scan_entries():
-    scanner = bluepy.btle.Scanner()
-    scan_entries = scanner.scan()
+def get_decawave_scan_entries(retry_policy = None):
+    scanner = get_transport().Scanner()
+    scan_entries = get_retry_policy(retry_policy).call(scanner.scan)
     decawave_scan_entries = list(filter(is_decawave_scan_entry, scan_entries))
     return decawave_scan_entries
 
@@ -122,65 +278,306 @@ def is_decawave_scan_entry(scan_entry):
     short_local_name = scan_entry.getValueText(SHORT_LOCAL_NAME_TYPE_CODE)
     return (short_local_name is not None and short_local_name.startswith('DW'))
 
-# Function for connecting to Decawave device
-@exponential_retry
-def get_decawave_peripheral(decawave_device):
-    decawave_peripheral = bluepy.btle.Peripheral(decawave_device.scan_entry)
+# Class to represent a connection to a Decawave DWM1001 device. Wraps a
+# bluepy.btle.Peripheral and caches the network node service and its
+# characteristics so that they are only discovered once per connection. The
+# cache is invalidated when the peripheral is disconnected. The device name
+# (if known) labels the metrics recorded for the connection
+class DecawavePeripheral:
+    def __init__(
+        self,
+        peripheral,
+        device_name = None):
+        self.peripheral = peripheral
+        self.device_name = device_name
+        self.network_node_service = None
+        self.characteristics = None
+
+    def __getattr__(self, name):
+        return getattr(self.peripheral, name)
+
+    def get_network_node_service(self):
+        if self.network_node_service is None:
+            self.network_node_service = get_decawave_network_node_service_from_peripheral(self.peripheral)
+        return self.network_node_service
+
+    def get_characteristic(self, characteristic_uuid):
+        if self.characteristics is None:
+            with decawave_ble.metrics.measure('discover', self.device_name):
+                network_node_service = self.get_network_node_service()
+                characteristics = {}
+                for characteristic in network_node_service.getCharacteristics():
+                    characteristics[str(characteristic.uuid)] = characteristic
+            self.characteristics = characteristics
+        characteristic = self.characteristics.get(str(get_transport().UUID(characteristic_uuid)))
+        if characteristic is None:
+            raise ValueError('Characteristic {} not found in network node service'.format(characteristic_uuid))
+        return characteristic
+
+    def clear_cache(self):
+        self.network_node_service = None
+        self.characteristics = None
+
+    def disconnect(self):
+        self.clear_cache()
+        self.peripheral.disconnect()
+
+# Function for listing the HCI interfaces (Bluetooth adapters) present on
+# this host by number (e.g., [0, 1] for hci0 and hci1)
+def get_hci_interfaces():
+    try:
+        interface_names = os.listdir('/sys/class/bluetooth')
+    except OSError:
+        return [0]
+    interfaces = []
+    for interface_name in interface_names:
+        if interface_name.startswith('hci') and interface_name[3:].isdigit():
+            interfaces.append(int(interface_name[3:]))
+    if len(interfaces) == 0:
+        return [0]
+    return sorted(interfaces)
+
+# Function for connecting to Decawave device (optionally through a specific
+# HCI interface rather than the one on which the device was found)
+def get_decawave_peripheral(
+    decawave_device,
+    interface = None):
+    with decawave_ble.metrics.measure('connect', decawave_device.device_name):
+        if interface is None and decawave_device.scan_entry is not None:
+            peripheral = get_transport().Peripheral(decawave_device.scan_entry)
+        else:
+            if interface is None:
+                interface = decawave_device.interface
+            peripheral = get_transport().Peripheral(
+                decawave_device.mac_address,
+                decawave_device.address_type,
+                iface=interface)
+    decawave_peripheral = DecawavePeripheral(
+        peripheral,
+        decawave_device.device_name)
     return decawave_peripheral
 
+# Function for getting the retry policy to use (the default if none is
+# specified)
+def get_retry_policy(retry_policy = None):
+    if retry_policy is None:
+        return default_retry_policy
+    return retry_policy
+
+# Function for checking whether an exception indicates that the connection to
+# the device was lost
+def is_disconnect_error(exception, retry_policy = None):
+    return get_retry_policy(retry_policy).classify(exception) == decawave_ble.retry.DISCONNECT
+
 # Function for connecting to Decawave network node service
-@exponential_retry
 def get_decawave_network_node_service_from_peripheral(decawave_peripheral):
     decawave_network_node_service = decawave_peripheral.getServiceByUUID(NETWORK_NODE_SERVICE_UUID)
     return decawave_network_node_service
 
+# Function for getting characteristic from Decawave network node service
+# (identified by UUID). Uses the handle cache if the peripheral is a
+# DecawavePeripheral and falls back to full discovery otherwise.
+def get_decawave_characteristic_from_peripheral(decawave_peripheral, characteristic_uuid):
+    if isinstance(decawave_peripheral, DecawavePeripheral):
+        return decawave_peripheral.get_characteristic(characteristic_uuid)
+    decawave_network_node_service = get_decawave_network_node_service_from_peripheral(decawave_peripheral)
+    characteristic = decawave_network_node_service.getCharacteristics(characteristic_uuid)[0]
+    return characteristic
+
 # Function for reading characteristic from Decawave network node service
 # (identified by UUID)
 def read_decawave_characteristic_from_peripheral(decawave_peripheral, characteristic_uuid):
-    decawave_network_node_service = get_decawave_network_node_service_from_peripheral(decawave_peripheral)
-    characteristic = decawave_network_node_service.getCharacteristics(characteristic_uuid)[0]
-    bytes = characteristic.read()
+    characteristic = get_decawave_characteristic_from_peripheral(decawave_peripheral, characteristic_uuid)
+    try:
+        with decawave_ble.metrics.measure('read', getattr(decawave_peripheral, 'device_name', None), characteristic_uuid):
+            bytes = characteristic.read()
+    except get_transport().BTLEDisconnectError:
+        if isinstance(decawave_peripheral, DecawavePeripheral):
+            decawave_peripheral.clear_cache()
+        raise
     return bytes
 
 # Function for writing characteristic to Decawave network node service
 # (identified by UUID)
 def write_decawave_characteristic_to_peripheral(decawave_peripheral, characteristic_uuid, bytes):
-    decawave_network_node_service = get_decawave_network_node_service_from_peripheral(decawave_peripheral)
-    characteristic = decawave_network_node_service.getCharacteristics(characteristic_uuid)[0]
-    characteristic.write(bytes)
-
-# Function for getting a complete set of data from device(s)
-def get_data(decawave_device):
+    characteristic = get_decawave_characteristic_from_peripheral(decawave_peripheral, characteristic_uuid)
+    try:
+        with decawave_ble.metrics.measure('write', getattr(decawave_peripheral, 'device_name', None), characteristic_uuid):
+            characteristic.write(bytes)
+    except get_transport().BTLEDisconnectError:
+        if isinstance(decawave_peripheral, DecawavePeripheral):
+            decawave_peripheral.clear_cache()
+        raise
+
+# Function for applying a function to multiple devices concurrently. The
+# function is called as function(decawave_device, interface). Each worker is
+# bound to one HCI interface and takes devices from a shared queue, so devices
+# are spread across all interfaces and no interface has more than
+# max_connections_per_interface connections open at once. Returns a
+# dictionary of results and a dictionary of exceptions, both keyed by device
+# name. If result_callback is specified, it is called (one call at a time) as
+# result_callback(device_name, result) as each device finishes and results
+# are not kept
+def apply_to_multiple_devices(
+    function,
+    decawave_devices,
+    max_connections_per_interface = None,
+    interfaces = None,
+    result_callback = None):
+    if max_connections_per_interface is None:
+        max_connections_per_interface = default_max_connections_per_interface
+    if max_connections_per_interface < 1:
+        raise ValueError('Maximum number of connections per interface must be at least 1')
+    if interfaces is None:
+        interfaces = get_hci_interfaces()
+    device_queue = queue.Queue()
+    for device_name, decawave_device in decawave_devices.items():
+        device_queue.put((device_name, decawave_device))
+    results = {}
+    errors = {}
+    result_lock = threading.Lock()
+    def worker(interface):
+        while True:
+            try:
+                device_name, decawave_device = device_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = function(decawave_device, interface)
+            except Exception as e:
+                logger.warning('Failed on {} (hci{}): {}'.format(device_name, interface, repr(e)))
+                errors[device_name] = e
+                continue
+            if result_callback is None:
+                results[device_name] = result
+            else:
+                with result_lock:
+                    result_callback(device_name, result)
+    worker_interfaces = []
+    for worker_index in range(max_connections_per_interface):
+        worker_interfaces.extend(interfaces)
+    worker_interfaces = worker_interfaces[:len(decawave_devices)]
+    if len(worker_interfaces) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(worker_interfaces)) as executor:
+            for future in [executor.submit(worker, interface) for interface in worker_interfaces]:
+                future.result()
+    results = {device_name: results[device_name] for device_name in decawave_devices.keys() if device_name in results}
+    errors = {device_name: errors[device_name] for device_name in decawave_devices.keys() if device_name in errors}
+    return results, errors
+
+# Function for calling one of the *_from_peripheral functions for a device.
+# If a session (see decawave_ble.session) is supplied, the connection is taken
+# from the session and left open afterwards. Otherwise the device is connected
+# to before the call and disconnected after it. The connection and the call
+# are retried together according to the retry policy (see decawave_ble.retry),
+# so the *_from_peripheral functions themselves never retry
+def call_with_peripheral(
+    function,
+    decawave_device,
+    *args,
+    session = None,
+    interface = None,
+    retry_policy = None,
+    **kwargs):
+    if session is not None:
+        return session.call(
+            function,
+            decawave_device,
+            *args,
+            interface = interface,
+            retry_policy = retry_policy,
+            **kwargs)
+    return get_retry_policy(retry_policy).run(
+        lambda decawave_peripheral: function(decawave_peripheral, *args, **kwargs),
+        connect = lambda: get_decawave_peripheral(decawave_device, interface),
+        release = disconnect_peripheral_quietly,
+        discard = disconnect_peripheral_quietly,
+        description = decawave_device.device_name,
+        device_name = decawave_device.device_name)
+
+def disconnect_peripheral_quietly(decawave_peripheral):
+    try:
+        decawave_peripheral.disconnect()
+    except get_transport().BTLEException as e:
+        logger.debug('Failed to disconnect: {}'.format(repr(e)))
+
+# Function for getting a complete set of data from device(s). If fields is
+# specified (a list of names from DATA_FIELDS), only those characteristics
+# are read and only those keys (plus device_name and scan_data) are included
+def get_data(
+    decawave_device,
+    interface = None,
+    session = None,
+    fields = None,
+    retry_policy = None):
+    fields = get_data_fields(fields)
     device_name = decawave_device.device_name
     scan_data = decawave_device.scan_data()
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    operation_mode_data = get_operation_mode_data_from_peripheral(decawave_peripheral)
-    device_info_data = get_device_info_data_from_peripheral(decawave_peripheral)
-    network_id = get_network_id_from_peripheral(decawave_peripheral)
-    location_data_mode_data = get_location_data_mode_data_from_peripheral(decawave_peripheral)
-    location_data = get_location_data_from_peripheral(decawave_peripheral)
-    proxy_positions_data = get_proxy_positions_data_from_peripheral(decawave_peripheral)
-    anchor_list_data = get_anchor_list_data_from_peripheral(decawave_peripheral)
-    update_rate_data = get_update_rate_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
     data = {
         'device_name': device_name,
-        'scan_data': scan_data,
-        'operation_mode_data': operation_mode_data,
-        'device_info_data': device_info_data,
-        'network_id': network_id,
-        'location_data_mode_data': location_data_mode_data,
-        'location_data': location_data,
-        'proxy_positions_data': proxy_positions_data,
-        'anchor_list_data': anchor_list_data,
-        'update_rate_data': update_rate_data}
+        'scan_data': scan_data}
+    data.update(call_with_peripheral(
+        get_data_from_peripheral,
+        decawave_device,
+        fields,
+        session = session,
+        interface = interface,
+        retry_policy = retry_policy))
+    return data
+
+def get_data_from_peripheral(
+    decawave_peripheral,
+    fields = None):
+    fields = get_data_fields(fields)
+    data = {}
+    for field in fields:
+        data[field] = DATA_FIELD_FUNCTIONS[field](decawave_peripheral)
     return data
 
-def get_data_multiple_devices(decawave_devices):
+# Function for checking a list of data fields and putting it in reading order
+# (all fields if fields is None)
+def get_data_fields(fields = None):
+    if fields is None:
+        return DATA_FIELDS
+    unrecognized_fields = set(fields) - set(DATA_FIELDS)
+    if len(unrecognized_fields) > 0:
+        raise ValueError('Data fields {} not recognized (must be in {})'.format(
+            sorted(unrecognized_fields),
+            DATA_FIELDS))
+    return [field for field in DATA_FIELDS if field in fields]
+
+# If concurrent is True, devices are read in parallel (see
+# apply_to_multiple_devices) and a failure on one device does not abort the
+# others. Failed devices are left out of the returned dictionary and their
+# exceptions are added to errors (if a dictionary is supplied). If fields is
+# specified, only those fields are read (see get_data)
+def get_data_multiple_devices(
+    decawave_devices,
+    concurrent = False,
+    max_connections_per_interface = None,
+    interfaces = None,
+    errors = None,
+    fields = None,
+    retry_policy = None):
+    fields = get_data_fields(fields)
+    if concurrent:
+        logger.info('Getting data for {} devices concurrently'.format(len(decawave_devices)))
+        data_multiple, device_errors = apply_to_multiple_devices(
+            lambda decawave_device, interface: get_data(decawave_device, interface, fields = fields, retry_policy = retry_policy),
+            decawave_devices,
+            max_connections_per_interface,
+            interfaces)
+        if len(device_errors) > 0:
+            logger.warning('Failed to get data for {} devices: {}'.format(
+                len(device_errors),
+                list(device_errors.keys())))
+        if errors is not None:
+            errors.update(device_errors)
+        return data_multiple
     data_multiple = {}
     for device_name, decawave_device in decawave_devices.items():
         logger.info('Getting data for {}'.format(device_name))
-        data = get_data(decawave_device)
+        data = get_data(decawave_device, fields = fields, retry_policy = retry_policy)
         data_multiple[device_name] = data
     return data_multiple
 
@@ -201,10 +598,14 @@ def set_config(
     y_position = None,
     z_position = None,
     quality = None,
-    check_config_enabled = False):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    set_operation_mode_to_peripheral(
-        decawave_peripheral,
+    check_config_enabled = False,
+    interface = None,
+    dry_run = False,
+    session = None,
+    retry_policy = None):
+    config_plan = call_with_peripheral(
+        set_config_to_peripheral,
+        decawave_device,
         device_type_name,
         uwb_mode_name,
         accelerometer_enable,
@@ -212,29 +613,209 @@ def set_config(
         initiator,
         low_power_mode,
         location_engine,
-        check_config_enabled)
-    set_network_id_to_peripheral(
-        decawave_peripheral,
         network_id,
-        check_config_enabled)
-    set_update_rate_to_peripheral(
-        decawave_peripheral,
         moving_update_rate,
         stationary_update_rate,
-        check_config_enabled)
-    set_persisted_position_to_peripheral(
-        decawave_peripheral,
         x_position,
         y_position,
         z_position,
         quality,
-        check_config_enabled)
-    decawave_peripheral.disconnect()
+        check_config_enabled,
+        dry_run,
+        session = session,
+        interface = interface,
+        retry_policy = retry_policy)
+    changed_characteristics = get_config_plan_changes(config_plan)
+    if len(changed_characteristics) == 0:
+        logger.info('Configuration of {} already matches target'.format(decawave_device.device_name))
+    elif dry_run:
+        logger.info('Configuration of {} would change: {}'.format(
+            decawave_device.device_name,
+            changed_characteristics))
+    else:
+        logger.info('Configuration of {} changed: {}'.format(
+            decawave_device.device_name,
+            changed_characteristics))
+    return config_plan
+
+def set_config_to_peripheral(
+    decawave_peripheral,
+    device_type_name = None,
+    uwb_mode_name = None,
+    accelerometer_enable = None,
+    led_enable = None,
+    initiator = None,
+    low_power_mode = None,
+    location_engine = None,
+    network_id = None,
+    moving_update_rate = None,
+    stationary_update_rate = None,
+    x_position = None,
+    y_position = None,
+    z_position = None,
+    quality = None,
+    check_config_enabled = False,
+    dry_run = False):
+    config_plan = get_config_plan_from_peripheral(
+        decawave_peripheral,
+        device_type_name,
+        uwb_mode_name,
+        accelerometer_enable,
+        led_enable,
+        initiator,
+        low_power_mode,
+        location_engine,
+        network_id,
+        moving_update_rate,
+        stationary_update_rate,
+        x_position,
+        y_position,
+        z_position,
+        quality)
+    if not dry_run:
+        apply_config_plan_to_peripheral(
+            decawave_peripheral,
+            config_plan,
+            check_config_enabled)
+    return config_plan
+
+# Functions for planning configuration changes. A configuration plan reads
+# each characteristic that has at least one target setting once and records
+# the current data, the target data, whether they differ, and the settings
+# themselves (for checking after writing). Characteristics with no target
+# settings are left out of the plan
+def get_config_plan_from_peripheral(
+    decawave_peripheral,
+    device_type_name = None,
+    uwb_mode_name = None,
+    accelerometer_enable = None,
+    led_enable = None,
+    initiator = None,
+    low_power_mode = None,
+    location_engine = None,
+    network_id = None,
+    moving_update_rate = None,
+    stationary_update_rate = None,
+    x_position = None,
+    y_position = None,
+    z_position = None,
+    quality = None):
+    config_plan = {}
+    operation_mode_settings = {
+        'device_type_name': device_type_name,
+        'uwb_mode_name': uwb_mode_name,
+        'accelerometer_enable': accelerometer_enable,
+        'led_enable': led_enable,
+        'initiator': initiator,
+        'low_power_mode': low_power_mode,
+        'location_engine': location_engine}
+    if any(value is not None for value in operation_mode_settings.values()):
+        operation_mode_data = get_operation_mode_data_from_peripheral(decawave_peripheral)
+        target_operation_mode_data = get_target_operation_mode_data(
+            operation_mode_data,
+            **operation_mode_settings)
+        config_plan['operation_mode_data'] = {
+            'current': operation_mode_data,
+            'target': target_operation_mode_data,
+            'changed': target_operation_mode_data != operation_mode_data,
+            'settings': operation_mode_settings}
+    if network_id is not None:
+        current_network_id = get_network_id_from_peripheral(decawave_peripheral)
+        config_plan['network_id'] = {
+            'current': current_network_id,
+            'target': network_id,
+            'changed': network_id != current_network_id,
+            'settings': {'network_id': network_id}}
+    update_rate_settings = {
+        'moving_update_rate': moving_update_rate,
+        'stationary_update_rate': stationary_update_rate}
+    if any(value is not None for value in update_rate_settings.values()):
+        update_rate_data = get_update_rate_data_from_peripheral(decawave_peripheral)
+        target_update_rate_data = get_target_update_rate_data(
+            update_rate_data,
+            **update_rate_settings)
+        config_plan['update_rate_data'] = {
+            'current': update_rate_data,
+            'target': target_update_rate_data,
+            'changed': target_update_rate_data != update_rate_data,
+            'settings': update_rate_settings}
+    persisted_position_settings = {
+        'x_position': x_position,
+        'y_position': y_position,
+        'z_position': z_position,
+        'quality': quality}
+    if any(value is not None for value in persisted_position_settings.values()):
+        location_data = get_location_data_from_peripheral(decawave_peripheral)
+        persisted_position_data = location_data['position_data']
+        target_persisted_position_data = get_target_persisted_position_data(
+            persisted_position_data,
+            **persisted_position_settings)
+        config_plan['persisted_position_data'] = {
+            'current': persisted_position_data,
+            'target': target_persisted_position_data,
+            'changed': target_persisted_position_data != persisted_position_data,
+            'settings': persisted_position_settings}
+    return config_plan
+
+def get_config_plan_changes(config_plan):
+    return [characteristic_name for characteristic_name, characteristic_plan in config_plan.items() if characteristic_plan['changed']]
+
+def apply_config_plan_to_peripheral(
+    decawave_peripheral,
+    config_plan,
+    check_config_enabled = False):
+    operation_mode_plan = config_plan.get('operation_mode_data')
+    if operation_mode_plan is not None and operation_mode_plan['changed']:
+        write_operation_mode_data_to_peripheral(
+            decawave_peripheral,
+            operation_mode_plan['target'])
+        if check_config_enabled:
+            check_operation_mode_from_peripheral(
+                decawave_peripheral,
+                **operation_mode_plan['settings'])
+    network_id_plan = config_plan.get('network_id')
+    if network_id_plan is not None and network_id_plan['changed']:
+        write_network_id_to_peripheral(
+            decawave_peripheral,
+            network_id_plan['target'])
+        if check_config_enabled:
+            check_network_id_from_peripheral(
+                decawave_peripheral,
+                **network_id_plan['settings'])
+    update_rate_plan = config_plan.get('update_rate_data')
+    if update_rate_plan is not None and update_rate_plan['changed']:
+        write_update_rate_data_to_peripheral(
+            decawave_peripheral,
+            update_rate_plan['target'])
+        if check_config_enabled:
+            check_update_rate_from_peripheral(
+                decawave_peripheral,
+                **update_rate_plan['settings'])
+    persisted_position_plan = config_plan.get('persisted_position_data')
+    if persisted_position_plan is not None and persisted_position_plan['changed']:
+        write_persisted_position_data_to_peripheral(
+            decawave_peripheral,
+            persisted_position_plan['target'])
+        if check_config_enabled:
+            check_persisted_position_from_peripheral(
+                decawave_peripheral,
+                **persisted_position_plan['settings'])
 
 def write_data(
     decawave_device,
+    data,
+    session = None,
+    retry_policy = None):
+    call_with_peripheral(
+        write_data_to_peripheral,
+        decawave_device,
+        data,
+        session = session,
+        retry_policy = retry_policy)
+
+def write_data_to_peripheral(
+    decawave_peripheral,
     data):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
     write_operation_mode_data_to_peripheral(
         decawave_peripheral,
         data['operation_mode_data'])
@@ -247,16 +828,17 @@ def write_data(
     write_persisted_position_data_to_peripheral(
         decawave_peripheral,
         data['persisted_position_data'])
-    decawave_peripheral.disconnect()
 
 # Functions for getting operation mode data
-def get_operation_mode_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_operation_mode_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_operation_mode_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_operation_mode_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_operation_mode_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -264,27 +846,6 @@ def get_operation_mode_data_from_peripheral(decawave_peripheral):
     data = parse_operation_mode_bytes(bytes)
     return data
 
-def parse_operation_mode_bytes(operation_mode_bytes):
-    operation_mode_data = bitstruct.unpack_dict(
-        'u1u2u1b1b1b1b1b1b1b1u4',
-        [
-            'device_type',
-            'uwb_mode',
-            'fw_version',
-            'accelerometer_enable',
-            'led_enable',
-            'fw_update_enable',
-            'reserved_01',
-            'initiator',
-            'low_power_mode',
-            'location_engine',
-            'reserved_02'],
-        operation_mode_bytes)
-    operation_mode_data['device_type_name'] = DEVICE_TYPE_NAMES[operation_mode_data['device_type']]
-    operation_mode_data['uwb_mode_name'] = UWB_MODE_NAMES[operation_mode_data['uwb_mode']]
-    operation_mode_data['fw_version_name'] = FW_VERSION_NAMES[operation_mode_data['fw_version']]
-    return operation_mode_data
-
 # Functions for writing operation mode data
 
 def set_operation_mode(
@@ -296,10 +857,11 @@ def set_operation_mode(
     initiator = None,
     low_power_mode = None,
     location_engine = None,
-    check_config_enabled = False):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    set_operation_mode_to_peripheral(
-        decawave_peripheral,
+    check_config_enabled = False,
+    session = None):
+    call_with_peripheral(
+        set_operation_mode_to_peripheral,
+        decawave_device,
         device_type_name,
         uwb_mode_name,
         accelerometer_enable,
@@ -307,10 +869,9 @@ def set_operation_mode(
         initiator,
         low_power_mode,
         location_engine,
-        check_config_enabled)
-    decawave_peripheral.disconnect()
+        check_config_enabled,
+        session = session)
 
-@exponential_retry
 def set_operation_mode_to_peripheral(
     decawave_peripheral,
     device_type_name = None,
@@ -322,25 +883,19 @@ def set_operation_mode_to_peripheral(
     location_engine = None,
     check_config_enabled = False):
     operation_mode_data = get_operation_mode_data_from_peripheral(decawave_peripheral)
-    if device_type_name is not None:
-        operation_mode_data['device_type_name'] = device_type_name
-        operation_mode_data['device_type'] = DEVICE_TYPE_NAMES.index(device_type_name)
-    if uwb_mode_name is not None:
-        operation_mode_data['uwb_mode_name'] = uwb_mode_name
-        operation_mode_data['uwb_mode'] = UWB_MODE_NAMES.index(uwb_mode_name)
-    if accelerometer_enable is not None:
-        operation_mode_data['accelerometer_enable'] = accelerometer_enable
-    if led_enable is not None:
-        operation_mode_data['led_enable'] = led_enable
-    if initiator is not None:
-        operation_mode_data['initiator'] = initiator
-    if low_power_mode is not None:
-        operation_mode_data['low_power_mode'] = low_power_mode
-    if location_engine is not None:
-        operation_mode_data['location_engine'] = location_engine
-    write_operation_mode_data_to_peripheral(
-        decawave_peripheral,
-        operation_mode_data)
+    target_operation_mode_data = get_target_operation_mode_data(
+        operation_mode_data,
+        device_type_name,
+        uwb_mode_name,
+        accelerometer_enable,
+        led_enable,
+        initiator,
+        low_power_mode,
+        location_engine)
+    if target_operation_mode_data != operation_mode_data:
+        write_operation_mode_data_to_peripheral(
+            decawave_peripheral,
+            target_operation_mode_data)
     if check_config_enabled:
         check_operation_mode_from_peripheral(
             decawave_peripheral,
@@ -352,6 +907,33 @@ def set_operation_mode_to_peripheral(
             low_power_mode,
             location_engine)
 
+def get_target_operation_mode_data(
+    operation_mode_data,
+    device_type_name = None,
+    uwb_mode_name = None,
+    accelerometer_enable = None,
+    led_enable = None,
+    initiator = None,
+    low_power_mode = None,
+    location_engine = None):
+    target_operation_mode_data = dict(operation_mode_data)
+    if device_type_name is not None:
+        target_operation_mode_data['device_type_name'] = device_type_name
+        target_operation_mode_data['device_type'] = DEVICE_TYPE_NAMES.index(device_type_name)
+    if uwb_mode_name is not None:
+        target_operation_mode_data['uwb_mode_name'] = uwb_mode_name
+        target_operation_mode_data['uwb_mode'] = UWB_MODE_NAMES.index(uwb_mode_name)
+    if accelerometer_enable is not None:
+        target_operation_mode_data['accelerometer_enable'] = accelerometer_enable
+    if led_enable is not None:
+        target_operation_mode_data['led_enable'] = led_enable
+    if initiator is not None:
+        target_operation_mode_data['initiator'] = initiator
+    if low_power_mode is not None:
+        target_operation_mode_data['low_power_mode'] = low_power_mode
+    if location_engine is not None:
+        target_operation_mode_data['location_engine'] = location_engine
+    return target_operation_mode_data
 
 def check_operation_mode_from_peripheral(
     decawave_peripheral,
@@ -407,12 +989,16 @@ def check_operation_mode_from_peripheral(
                 location_engine,
                 operation_mode_data['location_engine']))
 
-def write_operation_mode_data(decawave_device, data):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    write_operation_mode_data_to_peripheral(decawave_peripheral, data)
-    decawave_peripheral.disconnect()
+def write_operation_mode_data(
+    decawave_device,
+    data,
+    session = None):
+    call_with_peripheral(
+        write_operation_mode_data_to_peripheral,
+        decawave_device,
+        data,
+        session = session)
 
-@exponential_retry
 def write_operation_mode_data_to_peripheral(decawave_peripheral, data):
     bytes = pack_operation_mode_bytes(data)
     write_decawave_characteristic_to_peripheral(
@@ -420,33 +1006,16 @@ def write_operation_mode_data_to_peripheral(decawave_peripheral, data):
         OPERATION_MODE_CHARACTERISTIC_UUID,
         bytes)
 
-def pack_operation_mode_bytes(operation_mode_data):
-    operation_mode_bytes = bitstruct.pack_dict(
-        'u1u2u1b1b1b1b1b1b1b1u4',
-        [
-            'device_type',
-            'uwb_mode',
-            'fw_version',
-            'accelerometer_enable',
-            'led_enable',
-            'fw_update_enable',
-            'reserved_01',
-            'initiator',
-            'low_power_mode',
-            'location_engine',
-            'reserved_02'],
-        operation_mode_data)
-    return operation_mode_bytes
-
-
 # Functions for getting location data mode data
-def get_location_data_mode_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_location_data_mode_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_location_data_mode_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_location_data_mode_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_location_data_mode_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -454,22 +1023,16 @@ def get_location_data_mode_data_from_peripheral(decawave_peripheral):
     data = parse_location_data_mode_bytes(bytes)
     return data
 
-def parse_location_data_mode_bytes(location_data_mode_bytes):
-    location_data_mode = location_data_mode_bytes[0]
-    location_data_mode_name = LOCATION_DATA_MODE_NAMES[location_data_mode]
-    location_data_mode_data = {
-        'location_data_mode': location_data_mode,
-        'location_data_mode_name': location_data_mode_name}
-    return location_data_mode_data
-
 # Functions for getting location data
-def get_location_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_location_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_location_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_location_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_location_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -477,60 +1040,157 @@ def get_location_data_from_peripheral(decawave_peripheral):
     data = parse_location_data_bytes(bytes)
     return data
 
-def parse_location_data_bytes(location_data_bytes):
-    if len(location_data_bytes) > 0:
-        location_data_content = location_data_bytes[0]
-        location_data_bytes = location_data_bytes[1:]
-        location_data_content_name = LOCATION_DATA_CONTENT_NAMES[location_data_content]
-    else:
-        location_data_content = None
-        location_data_content_name = None
-    if (location_data_content == 0 or location_data_content == 2):
-        if len(location_data_bytes) < 13:
-            raise ValueError('Location data content byte indicated position data was included but less than 13 bytes follow')
-        position_bytes = location_data_bytes[:13]
-        location_data_bytes = location_data_bytes[13:]
-        position_data = bitstruct.unpack_dict(
-            's32s32s32u8<',
-            ['x_position', 'y_position', 'z_position', 'quality'],
-            position_bytes)
+# Functions for streaming location data via notifications
+
+# Class for handling location data notifications from a Decawave device. Each
+# notification is parsed and passed to the callback along with the device
+# name and the time at which it was received by the host (bluepy only calls
+# handleNotification, so there is no need to subclass
+# bluepy.btle.DefaultDelegate)
+class LocationDataDelegate:
+    def __init__(
+        self,
+        device_name,
+        characteristic_handle,
+        callback,
+        parse_function = parse_location_data_bytes):
+        self.device_name = device_name
+        self.characteristic_handle = characteristic_handle
+        self.callback = callback
+        self.parse_function = parse_function
+
+    def handleNotification(self, cHandle, data):
+        timestamp = time.time()
+        if cHandle != self.characteristic_handle:
+            return
+        try:
+            location_data = self.parse_function(data)
+        except Exception as e:
+            logger.warning('Failed to parse location data notification from {}: {}'.format(
+                self.device_name,
+                repr(e)))
+            return
+        self.callback({
+            'device_name': self.device_name,
+            'timestamp': timestamp,
+            'location_data': location_data})
+
+def set_location_data_notifications_to_peripheral(
+    decawave_peripheral,
+    enable = True):
+    characteristic = get_decawave_characteristic_from_peripheral(
+        decawave_peripheral,
+        LOCATION_DATA_CHARACTERISTIC_UUID)
+    descriptor = characteristic.getDescriptors(
+        forUUID=CLIENT_CHARACTERISTIC_CONFIGURATION_DESCRIPTOR_UUID)[0]
+    if enable:
+        descriptor.write(b'\x01\x00', withResponse=True)
     else:
-        position_data = None
-    if (location_data_content == 1 or location_data_content == 2):
-        if len(location_data_bytes) < 1:
-            raise ValueError('Location data content byte indicated distance data was included but no bytes follow')
-        distance_count = location_data_bytes[0]
-        location_data_bytes = location_data_bytes[1:]
-        if len(location_data_bytes) < 7*distance_count:
-            raise ValueError('Distance count byte indicated that {} distance values would follow so expected {} bytes but only {} bytes follow'.format(
-                distance_count,
-                7*distance_count,
-                len(location_data_bytes)))
-        distance_data=[]
-        for distance_data_index in range(distance_count):
-            distance_datum_bytes = location_data_bytes[:7]
-            location_data_bytes = location_data_bytes[7:]
-            distance_datum = bitstruct.unpack_dict(
-                'u16u32u8<',
-                ['node_id', 'distance', 'quality'],
-                distance_datum_bytes)
-            distance_data.append(distance_datum)
+        descriptor.write(b'\x00\x00', withResponse=True)
+    return characteristic.getHandle()
+
+# Function for streaming location data from one or more devices. Connects to
+# each device (each in its own thread), enables location data notifications
+# and yields a record for each notification received (with keys device_name,
+# timestamp and location_data) until duration seconds have passed (or
+# forever if duration is None) or every device has disconnected. A device
+# that fails is logged and dropped without stopping the others. If records is
+# True, location data is returned as a compact decawave_ble.records.LocationData
+# rather than a dictionary. If raw is True, location data is returned as the
+# raw characteristic value (bytes) without parsing
+def stream_location_data(
+    decawave_devices,
+    duration = None,
+    poll_interval = 0.1,
+    records = False,
+    raw = False):
+    if raw:
+        parse_function = bytes
+    elif records:
+        parse_function = decawave_ble.records.parse_location_data_record
     else:
-        distance_data = None
-    return {
-        'location_data_content': location_data_content,
-        'location_data_content_name': location_data_content_name,
-        'position_data': position_data,
-        'distance_data': distance_data}
+        parse_function = parse_location_data_bytes
+    record_queue = queue.Queue()
+    stop_event = threading.Event()
+    def stream_device(decawave_device):
+        try:
+            decawave_peripheral = default_retry_policy.call(get_decawave_peripheral, decawave_device)
+            try:
+                if location_data_notification_mtu is not None:
+                    try:
+                        decawave_peripheral.setMTU(location_data_notification_mtu)
+                    except get_transport().BTLEException as e:
+                        logger.warning('Failed to set MTU for {}: {}'.format(
+                            decawave_device.device_name,
+                            repr(e)))
+                characteristic_handle = set_location_data_notifications_to_peripheral(decawave_peripheral)
+                decawave_peripheral.withDelegate(LocationDataDelegate(
+                    decawave_device.device_name,
+                    characteristic_handle,
+                    record_queue.put,
+                    parse_function))
+                while not stop_event.is_set():
+                    decawave_peripheral.waitForNotifications(poll_interval)
+            finally:
+                decawave_peripheral.disconnect()
+        except Exception as e:
+            logger.warning('Stopped streaming location data from {}: {}'.format(
+                decawave_device.device_name,
+                repr(e)))
+        finally:
+            record_queue.put(None)
+    threads = []
+    for decawave_device in decawave_devices.values():
+        thread = threading.Thread(
+            target=stream_device,
+            args=(decawave_device,),
+            daemon=True)
+        thread.start()
+        threads.append(thread)
+    if duration is not None:
+        end_time = time.monotonic() + duration
+    num_streaming_devices = len(threads)
+    try:
+        while num_streaming_devices > 0:
+            if duration is None:
+                timeout = None
+            else:
+                timeout = end_time - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                record = record_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if record is None:
+                num_streaming_devices -= 1
+                continue
+            yield record
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+# Function for passing streamed location data records to a callback (see
+# stream_location_data)
+def subscribe_location_data(
+    decawave_devices,
+    callback,
+    duration = None,
+    records = False):
+    for record in stream_location_data(decawave_devices, duration, records = records):
+        callback(record)
 
 # Functions for getting network ID
-def get_network_id(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_network_id_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_network_id(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_network_id_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_network_id_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -538,29 +1198,20 @@ def get_network_id_from_peripheral(decawave_peripheral):
     data = parse_network_id_bytes(bytes)
     return data
 
-def parse_network_id_bytes(network_id_bytes):
-    if len(network_id_bytes) > 0:
-        network_id = bitstruct.unpack(
-            'u16<',
-            network_id_bytes)[0]
-        return network_id
-    else:
-        return None
-
 # Functions for writing network ID
 
 def set_network_id(
     decawave_device,
     network_id = None,
-    check_config_enabled = False):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    set_network_id_to_peripheral(
-        decawave_peripheral,
+    check_config_enabled = False,
+    session = None):
+    call_with_peripheral(
+        set_network_id_to_peripheral,
+        decawave_device,
         network_id,
-        check_config_enabled)
-    decawave_peripheral.disconnect()
+        check_config_enabled,
+        session = session)
 
-@exponential_retry
 def set_network_id_to_peripheral(
     decawave_peripheral,
     network_id = None,
@@ -586,14 +1237,14 @@ def check_network_id_from_peripheral(
 
 def write_network_id(
     decawave_device,
-    network_id):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    write_network_id_to_peripheral(
-        decawave_peripheral,
-        network_id)
-    decawave_peripheral.disconnect()
+    network_id,
+    session = None):
+    call_with_peripheral(
+        write_network_id_to_peripheral,
+        decawave_device,
+        network_id,
+        session = session)
 
-@exponential_retry
 def write_network_id_to_peripheral(
     decawave_peripheral,
     network_id):
@@ -603,20 +1254,16 @@ def write_network_id_to_peripheral(
         NETWORK_ID_CHARACTERISTIC_UUID,
         bytes)
 
-def pack_network_id_bytes(network_id):
-    network_id_bytes = bitstruct.pack(
-        'u16<',
-        network_id)
-    return network_id_bytes
-
 # Functions for getting proxy positions data
-def get_proxy_positions_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_proxy_positions_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_proxy_positions_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_proxy_positions_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_proxy_positions_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -624,31 +1271,16 @@ def get_proxy_positions_data_from_peripheral(decawave_peripheral):
     data = parse_proxy_positions_bytes(bytes)
     return data
 
-def parse_proxy_positions_bytes(proxy_positions_bytes):
-    if len(proxy_positions_bytes) > 0:
-        num_elements = proxy_positions_bytes[0]
-        proxy_positions_bytes = proxy_positions_bytes[1:]
-        proxy_positions_data = []
-        for element_index in range(num_elements):
-            position_bytes = proxy_positions_bytes[:15]
-            proxy_positions_bytes = proxy_positions_bytes[15:]
-            position_data = bitstruct.unpack_dict(
-                'u16s32s32s32u8<',
-                ['node_id', 'x_position', 'y_position', 'z_position', 'quality'],
-                position_bytes)
-            proxy_positions_data.append(position_data)
-        return proxy_positions_data
-    else:
-        return None
-
 # Functions for getting device info data
-def get_device_info_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_device_info_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_device_info_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_device_info_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_device_info_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -656,29 +1288,16 @@ def get_device_info_data_from_peripheral(decawave_peripheral):
     data = parse_device_info_bytes(bytes)
     return data
 
-def parse_device_info_bytes(device_info_bytes):
-    device_info_data = bitstruct.unpack_dict(
-        'u64u32u32u32u32u32b1u7<',
-        [
-            'node_id',
-            'hw_version',
-            'fw1_version',
-            'fw2_version',
-            'fw1_checksum',
-            'fw2_checksum',
-            'bridge',
-            'unknown'],
-        device_info_bytes)
-    return device_info_data
-
 # Functions for getting anchor list data
-def get_anchor_list_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_anchor_list_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_anchor_list_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_anchor_list_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_anchor_list_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -686,30 +1305,16 @@ def get_anchor_list_data_from_peripheral(decawave_peripheral):
     data = parse_anchor_list_bytes(bytes)
     return data
 
-def parse_anchor_list_bytes(anchor_list_bytes):
-    if len(anchor_list_bytes) > 0:
-        num_elements = anchor_list_bytes[0]
-        anchor_list_bytes = anchor_list_bytes[1:]
-        anchor_list_data = []
-        for element_index in range(num_elements):
-            node_id_bytes = anchor_list_bytes[:2]
-            anchor_list_bytes = anchor_list_bytes[2:]
-            node_id = bitstruct.unpack(
-                'u16<',
-                node_id_bytes)[0]
-            anchor_list_data.append(node_id)
-        return anchor_list_data
-    else:
-        return None
-
 # Functions for getting update rate data
-def get_update_rate_data(decawave_device):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    data = get_update_rate_data_from_peripheral(decawave_peripheral)
-    decawave_peripheral.disconnect()
+def get_update_rate_data(
+    decawave_device,
+    session = None):
+    data = call_with_peripheral(
+        get_update_rate_data_from_peripheral,
+        decawave_device,
+        session = session)
     return data
 
-@exponential_retry
 def get_update_rate_data_from_peripheral(decawave_peripheral):
     bytes = read_decawave_characteristic_from_peripheral(
         decawave_peripheral,
@@ -717,49 +1322,52 @@ def get_update_rate_data_from_peripheral(decawave_peripheral):
     data = parse_update_rate_bytes(bytes)
     return data
 
-def parse_update_rate_bytes(update_rate_bytes):
-    update_rate_data = bitstruct.unpack_dict(
-        'u32u32<',
-        [
-            'moving_update_rate',
-            'stationary_update_rate'],
-        update_rate_bytes)
-    return update_rate_data
-
 # Functions for writing update rate data
 def set_update_rate(
     decawave_device,
     moving_update_rate = None,
     stationary_update_rate = None,
-    check_config_enabled = False):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    set_update_rate_to_peripheral(
-        decawave_peripheral,
+    check_config_enabled = False,
+    session = None):
+    call_with_peripheral(
+        set_update_rate_to_peripheral,
+        decawave_device,
         moving_update_rate,
         stationary_update_rate,
-        check_config_enabled)
-    decawave_peripheral.disconnect()
+        check_config_enabled,
+        session = session)
 
-@exponential_retry
 def set_update_rate_to_peripheral(
     decawave_peripheral,
     moving_update_rate = None,
     stationary_update_rate = None,
     check_config_enabled = False):
     update_rate_data = get_update_rate_data_from_peripheral(decawave_peripheral)
-    if moving_update_rate is not None:
-        update_rate_data['moving_update_rate'] = moving_update_rate
-    if stationary_update_rate is not None:
-        update_rate_data['stationary_update_rate'] = stationary_update_rate
-    write_update_rate_data_to_peripheral(
-        decawave_peripheral,
-        update_rate_data)
+    target_update_rate_data = get_target_update_rate_data(
+        update_rate_data,
+        moving_update_rate,
+        stationary_update_rate)
+    if target_update_rate_data != update_rate_data:
+        write_update_rate_data_to_peripheral(
+            decawave_peripheral,
+            target_update_rate_data)
     if check_config_enabled:
         check_update_rate_from_peripheral(
             decawave_peripheral,
             moving_update_rate,
             stationary_update_rate)
 
+def get_target_update_rate_data(
+    update_rate_data,
+    moving_update_rate = None,
+    stationary_update_rate = None):
+    target_update_rate_data = dict(update_rate_data)
+    if moving_update_rate is not None:
+        target_update_rate_data['moving_update_rate'] = moving_update_rate
+    if stationary_update_rate is not None:
+        target_update_rate_data['stationary_update_rate'] = stationary_update_rate
+    return target_update_rate_data
+
 def check_update_rate_from_peripheral(
     decawave_peripheral,
     moving_update_rate = None,
@@ -776,12 +1384,16 @@ def check_update_rate_from_peripheral(
                 stationary_update_rate,
                 update_rate_data['stationary_update_rate']))
 
-def write_update_rate_data(decawave_device, data):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    write_update_rate_data_to_peripheral(decawave_peripheral, data)
-    decawave_peripheral.disconnect()
+def write_update_rate_data(
+    decawave_device,
+    data,
+    session = None):
+    call_with_peripheral(
+        write_update_rate_data_to_peripheral,
+        decawave_device,
+        data,
+        session = session)
 
-@exponential_retry
 def write_update_rate_data_to_peripheral(decawave_peripheral, data):
     bytes = pack_update_rate_bytes(data)
     write_decawave_characteristic_to_peripheral(
@@ -789,15 +1401,6 @@ def write_update_rate_data_to_peripheral(decawave_peripheral, data):
         TAG_UPDATE_RATE_CHARACTERISTIC_UUID,
         bytes)
 
-def pack_update_rate_bytes(update_rate_data):
-    update_rate_bytes = bitstruct.pack_dict(
-        'u32u32<',
-        [
-            'moving_update_rate',
-            'stationary_update_rate'],
-        update_rate_data)
-    return update_rate_bytes
-
 # Functions for writing persisted position data
 def set_persisted_position(
     decawave_device,
@@ -805,18 +1408,18 @@ def set_persisted_position(
     y_position = None,
     z_position = None,
     quality = None,
-    check_config_enabled = False):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    set_persisted_position_to_peripheral(
-        decawave_peripheral,
+    check_config_enabled = False,
+    session = None):
+    call_with_peripheral(
+        set_persisted_position_to_peripheral,
+        decawave_device,
         x_position,
         y_position,
         z_position,
         quality,
-        check_config_enabled)
-    decawave_peripheral.disconnect()
+        check_config_enabled,
+        session = session)
 
-@exponential_retry
 def set_persisted_position_to_peripheral(
     decawave_peripheral,
     x_position = None,
@@ -826,30 +1429,50 @@ def set_persisted_position_to_peripheral(
     check_config_enabled = False):
     location_data = get_location_data_from_peripheral(decawave_peripheral)
     persisted_position_data = location_data['position_data']
+    target_persisted_position_data = get_target_persisted_position_data(
+        persisted_position_data,
+        x_position,
+        y_position,
+        z_position,
+        quality)
+    if target_persisted_position_data != persisted_position_data:
+        write_persisted_position_data_to_peripheral(
+            decawave_peripheral,
+            target_persisted_position_data)
+    if check_config_enabled:
+        check_persisted_position_from_peripheral(
+            decawave_peripheral,
+            x_position,
+            y_position,
+            z_position,
+            quality)
+
+# Function for applying target settings to the current persisted position
+# (the device reports no position until one has been set, so start from the
+# origin in that case)
+def get_target_persisted_position_data(
+    persisted_position_data,
+    x_position = None,
+    y_position = None,
+    z_position = None,
+    quality = None):
     if persisted_position_data is None:
-        persisted_position_data = {
+        target_persisted_position_data = {
             'x_position': 0,
             'y_position': 0,
             'z_position': 0,
             'quality': 100}
+    else:
+        target_persisted_position_data = dict(persisted_position_data)
     if x_position is not None:
-        persisted_position_data['x_position'] = x_position
+        target_persisted_position_data['x_position'] = x_position
     if y_position is not None:
-        persisted_position_data['y_position'] = y_position
+        target_persisted_position_data['y_position'] = y_position
     if z_position is not None:
-        persisted_position_data['z_position'] = z_position
+        target_persisted_position_data['z_position'] = z_position
     if quality is not None:
-        persisted_position_data['quality'] = quality
-    write_persisted_position_data_to_peripheral(
-        decawave_peripheral,
-        persisted_position_data)
-    if check_config_enabled:
-        check_persisted_position_from_peripheral(
-            decawave_peripheral,
-            x_position,
-            y_position,
-            z_position,
-            quality)
+        target_persisted_position_data['quality'] = quality
+    return target_persisted_position_data
 
 def check_persisted_position_from_peripheral(
     decawave_peripheral,
@@ -886,12 +1509,16 @@ def check_persisted_position_from_peripheral(
                 quality,
                 persisted_position_data['quality']))
 
-def write_persisted_position_data(decawave_device, data):
-    decawave_peripheral = get_decawave_peripheral(decawave_device)
-    write_persisted_position_data_to_peripheral(decawave_peripheral, data)
-    decawave_peripheral.disconnect()
+def write_persisted_position_data(
+    decawave_device,
+    data,
+    session = None):
+    call_with_peripheral(
+        write_persisted_position_data_to_peripheral,
+        decawave_device,
+        data,
+        session = session)
 
-@exponential_retry
 def write_persisted_position_data_to_peripheral(decawave_peripheral, data):
     bytes = pack_persisted_position_bytes(data)
     write_decawave_characteristic_to_peripheral(
@@ -899,12 +1526,18 @@ def write_persisted_position_data_to_peripheral(decawave_peripheral, data):
         ANCHOR_PERSISTED_POSITION_CHARACTERISTIC_UUID,
         bytes)
 
-def pack_persisted_position_bytes(persisted_position_data):
-    persisted_position_bytes = bitstruct.pack_dict(
-        's32s32s32u8<',
-        ['x_position', 'y_position', 'z_position', 'quality'],
-        persisted_position_data)
-    return persisted_position_bytes
+# Functions for reading each of the DATA_FIELDS from a connected device
+# (defined here, rather than next to DATA_FIELDS, since the functions must be
+# defined first)
+DATA_FIELD_FUNCTIONS = {
+    'operation_mode_data': get_operation_mode_data_from_peripheral,
+    'device_info_data': get_device_info_data_from_peripheral,
+    'network_id': get_network_id_from_peripheral,
+    'location_data_mode_data': get_location_data_mode_data_from_peripheral,
+    'location_data': get_location_data_from_peripheral,
+    'proxy_positions_data': get_proxy_positions_data_from_peripheral,
+    'anchor_list_data': get_anchor_list_data_from_peripheral,
+    'update_rate_data': get_update_rate_data_from_peripheral}
 
 # Functions for outputting data from multiple Decawave devices
 def write_data_multiple_devices_to_json_local(data_multiple, path):
@@ -916,44 +1549,159 @@ def write_data_multiple_devices_to_json_local(data_multiple, path):
             cls=CustomJSONEncoder,
             indent=2)
 
+# Functions for streaming data from multiple Decawave devices to a JSON Lines
+# file (one line per device, with the device data as returned by get_data).
+# Each line is written and flushed as soon as the device has been read, so
+# memory use does not grow with the number of devices and a sweep that is
+# interrupted loses nothing that was already read. If resume is True, devices
+# already in the file are skipped and new lines are appended; otherwise the
+# file is overwritten. Returns the number of devices written. Failed devices
+# are skipped and their exceptions are added to errors (if a dictionary is
+# supplied). If fields is specified, only those fields are read (see get_data)
+def write_data_multiple_devices_to_json_lines_local(
+    decawave_devices,
+    path,
+    resume = False,
+    concurrent = False,
+    max_connections_per_interface = None,
+    interfaces = None,
+    errors = None,
+    fields = None):
+    fields = get_data_fields(fields)
+    if resume:
+        written_device_names = get_device_names_from_json_lines_local(path)
+        decawave_devices = {device_name: decawave_device for device_name, decawave_device in decawave_devices.items() if device_name not in written_device_names}
+        logger.info('Resuming {}: {} devices already written, {} to go'.format(
+            path,
+            len(written_device_names),
+            len(decawave_devices)))
+        mode = 'a'
+    else:
+        logger.info('Saving results in {}'.format(path))
+        mode = 'w'
+    num_written = 0
+    with open(path, mode) as file:
+        def write_line(device_name, data):
+            nonlocal num_written
+            file.write(json.dumps(data, cls=CustomJSONEncoder) + '\n')
+            file.flush()
+            num_written += 1
+        if concurrent:
+            results, device_errors = apply_to_multiple_devices(
+                lambda decawave_device, interface: get_data(decawave_device, interface, fields = fields),
+                decawave_devices,
+                max_connections_per_interface,
+                interfaces,
+                result_callback = write_line)
+        else:
+            device_errors = {}
+            for device_name, decawave_device in decawave_devices.items():
+                logger.info('Getting data for {}'.format(device_name))
+                try:
+                    data = get_data(decawave_device, fields = fields)
+                except Exception as e:
+                    logger.warning('Failed to get data for {}: {}'.format(device_name, repr(e)))
+                    device_errors[device_name] = e
+                    continue
+                write_line(device_name, data)
+    if len(device_errors) > 0:
+        logger.warning('Failed to get data for {} devices: {}'.format(
+            len(device_errors),
+            list(device_errors.keys())))
+    if errors is not None:
+        errors.update(device_errors)
+    return num_written
+
+# Function for iterating over the device data in a JSON Lines file. A
+# truncated last line (e.g., from an interrupted sweep) is skipped
+def read_data_from_json_lines_local(path):
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.endswith('\n'):
+                logger.warning('Ignoring incomplete last line in {}'.format(path))
+                return
+            if len(line.strip()) == 0:
+                continue
+            yield json.loads(line)
+
+# Function for getting the names of the devices already in a JSON Lines file.
+# If the file ends with an incomplete line, it is truncated so that new lines
+# can be appended
+def get_device_names_from_json_lines_local(path):
+    if not os.path.exists(path):
+        return set()
+    device_names = set()
+    with open(path, 'rb+') as file:
+        complete_length = 0
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            complete_length += len(line)
+            if len(line.strip()) > 0:
+                device_names.add(json.loads(line)['device_name'])
+        if file.tell() != complete_length:
+            logger.warning('Truncating incomplete last line in {}'.format(path))
+            file.truncate(complete_length)
+    return device_names
+
+# Function for writing a text summary of the device data in a JSON Lines file
+# (see write_data_multiple_devices_to_text_local) without loading all of it
+def write_json_lines_to_text_local(json_lines_path, path):
+    logger.info('Saving results in {}'.format(path))
+    num_devices = sum(1 for data in read_data_from_json_lines_local(json_lines_path))
+    with open(path, 'w') as file:
+        file.write('Data for {} Decawave devices\n'.format(num_devices))
+        for data in read_data_from_json_lines_local(json_lines_path):
+            write_data_to_text(file, data['device_name'], data)
+
 def write_data_multiple_devices_to_text_local(data_multiple, path):
     logger.info('Saving results in {}'.format(path))
     with open(path, 'w') as file:
         file.write('Data for {} Decawave devices\n'.format(len(data_multiple)))
         for device_name, decawave_device in data_multiple.items():
-            file.write('\nDevice name: {}\n'.format(device_name))
-            file.write('Node ID: {:016X}\n'.format(decawave_device['device_info_data']['node_id']))
-            file.write('Device type: {}\n'.format(decawave_device['operation_mode_data']['device_type_name']))
-            file.write('Initiator: {}\n'.format(decawave_device['operation_mode_data']['initiator']))
-            file.write('UWB mode: {}\n'.format(decawave_device['operation_mode_data']['uwb_mode_name']))
-            if decawave_device['network_id'] is not None:
-                file.write('Network ID: {:04X}\n'.format(decawave_device['network_id']))
-            else:
-                file.write('Network ID: None\n')
-            if decawave_device['update_rate_data'] is not None:
-                file.write('Moving update rate (ms): {}\n'.format(decawave_device['update_rate_data']['moving_update_rate']))
-                file.write('Stationary update rate (ms): {}\n'.format(decawave_device['update_rate_data']['stationary_update_rate']))
-            file.write('Location engine: {}\n'.format(decawave_device['operation_mode_data']['location_engine']))
-            file.write('Location data mode name: {}\n'.format(decawave_device['location_data_mode_data']['location_data_mode_name']))
-            file.write('Location data content name: {}\n'.format(decawave_device['location_data']['location_data_content_name']))
-            if decawave_device['location_data']['position_data'] is not None:
-                file.write('Position data:\n')
-                file.write('  X: {} mm\n'.format(decawave_device['location_data']['position_data']['x_position']))
-                file.write('  Y: {} mm\n'.format(decawave_device['location_data']['position_data']['y_position']))
-                file.write('  Z: {} mm\n'.format(decawave_device['location_data']['position_data']['z_position']))
-                file.write('  Quality: {}\n'.format(decawave_device['location_data']['position_data']['quality']))
-            if decawave_device['location_data']['distance_data'] is not None:
-                file.write('Distance data:\n')
-                for distance_datum in decawave_device['location_data']['distance_data']:
-                    file.write('  {:04X}: {} mm (Q={})\n'.format(
-                        distance_datum['node_id'],
-                        distance_datum['distance'],
-                        distance_datum['quality']))
-            if decawave_device['proxy_positions_data'] is not None:
-                file.write('Proxy positions data:\n')
-                for proxy_positions_datum in decawave_device['proxy_positions_data']:
-                    file.write('  Node ID: {:04X}\n'.format(proxy_positions_datum['node_id']))
-                    file.write('    X: {} mm\n'.format(proxy_positions_datum['x_position']))
-                    file.write('    Y: {} mm\n'.format(proxy_positions_datum['y_position']))
-                    file.write('    Z: {} mm\n'.format(proxy_positions_datum['z_position']))
-                    file.write('    Quality: {}\n'.format(proxy_positions_datum['quality']))
+            write_data_to_text(file, device_name, decawave_device)
+
+def write_data_to_text(file, device_name, decawave_device):
+    # Fields which were not read (see get_data) are left out
+    file.write('\nDevice name: {}\n'.format(device_name))
+    if 'device_info_data' in decawave_device:
+        file.write('Node ID: {:016X}\n'.format(decawave_device['device_info_data']['node_id']))
+    if 'operation_mode_data' in decawave_device:
+        file.write('Device type: {}\n'.format(decawave_device['operation_mode_data']['device_type_name']))
+        file.write('Initiator: {}\n'.format(decawave_device['operation_mode_data']['initiator']))
+        file.write('UWB mode: {}\n'.format(decawave_device['operation_mode_data']['uwb_mode_name']))
+    if 'network_id' in decawave_device:
+        if decawave_device['network_id'] is not None:
+            file.write('Network ID: {:04X}\n'.format(decawave_device['network_id']))
+        else:
+            file.write('Network ID: None\n')
+    if decawave_device.get('update_rate_data') is not None:
+        file.write('Moving update rate (ms): {}\n'.format(decawave_device['update_rate_data']['moving_update_rate']))
+        file.write('Stationary update rate (ms): {}\n'.format(decawave_device['update_rate_data']['stationary_update_rate']))
+    if 'operation_mode_data' in decawave_device:
+        file.write('Location engine: {}\n'.format(decawave_device['operation_mode_data']['location_engine']))
+    if 'location_data_mode_data' in decawave_device:
+        file.write('Location data mode name: {}\n'.format(decawave_device['location_data_mode_data']['location_data_mode_name']))
+    if 'location_data' in decawave_device:
+        file.write('Location data content name: {}\n'.format(decawave_device['location_data']['location_data_content_name']))
+        if decawave_device['location_data']['position_data'] is not None:
+            file.write('Position data:\n')
+            file.write('  X: {} mm\n'.format(decawave_device['location_data']['position_data']['x_position']))
+            file.write('  Y: {} mm\n'.format(decawave_device['location_data']['position_data']['y_position']))
+            file.write('  Z: {} mm\n'.format(decawave_device['location_data']['position_data']['z_position']))
+            file.write('  Quality: {}\n'.format(decawave_device['location_data']['position_data']['quality']))
+        if decawave_device['location_data']['distance_data'] is not None:
+            file.write('Distance data:\n')
+            for distance_datum in decawave_device['location_data']['distance_data']:
+                file.write('  {:04X}: {} mm (Q={})\n'.format(
+                    distance_datum['node_id'],
+                    distance_datum['distance'],
+                    distance_datum['quality']))
+    if decawave_device.get('proxy_positions_data') is not None:
+        file.write('Proxy positions data:\n')
+        for proxy_positions_datum in decawave_device['proxy_positions_data']:
+            file.write('  Node ID: {:04X}\n'.format(proxy_positions_datum['node_id']))
+            file.write('    X: {} mm\n'.format(proxy_positions_datum['x_position']))
+            file.write('    Y: {} mm\n'.format(proxy_positions_datum['y_position']))
+            file.write('    Z: {} mm\n'.format(proxy_positions_datum['z_position']))
+            file.write('    Quality: {}\n'.format(proxy_positions_datum['quality']))
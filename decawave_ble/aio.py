@@ -0,0 +1,265 @@
+import decawave_ble
+import decawave_ble.retry
+import asyncio
+import functools
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Coroutine versions of the public functions in decawave_ble. Blocking BLE
+# I/O runs in an executor (the event loop's default executor unless one is
+# set here) so that the event loop is never blocked. Retries happen at this
+# level according to the retry policy (see decawave_ble.retry) with asyncio
+# sleeps, and the blocking functions are called with a single attempt
+
+executor = None
+
+# Function for running a blocking function in the executor
+async def run_blocking(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        functools.partial(function, *args, **kwargs))
+
+# Function for finding Decawave devices. Scans for timeout seconds or until
+# every device in device_names (if specified) has been found
+async def scan_for_decawave_devices(
+    timeout = 10.0,
+    device_names = None,
+    interface = 0,
+    retry_policy = None):
+    return await decawave_ble.get_retry_policy(retry_policy).run_async(
+        lambda connection: run_blocking(
+            decawave_ble.scan_for_decawave_devices,
+            timeout,
+            device_names,
+            interface,
+            decawave_ble.retry.no_retry_policy),
+        description = 'scan')
+
+async def get_decawave_scan_entries(retry_policy = None):
+    return await decawave_ble.get_retry_policy(retry_policy).run_async(
+        lambda connection: run_blocking(
+            decawave_ble.get_decawave_scan_entries,
+            decawave_ble.retry.no_retry_policy),
+        description = 'scan')
+
+# Function for connecting to Decawave device (a single attempt; see
+# run_with_peripheral). The executor cannot stop a connection that is being
+# opened, so if the coroutine is cancelled while waiting for it, the
+# connection is closed once it has been opened (by the worker thread if it is
+# still connecting, otherwise in the executor) rather than leaked
+async def get_decawave_peripheral(
+    decawave_device,
+    interface = None):
+    lock = threading.Lock()
+    connection_state = {
+        'cancelled': False,
+        'peripheral': None}
+    def connect():
+        decawave_peripheral = decawave_ble.get_decawave_peripheral(decawave_device, interface)
+        with lock:
+            if not connection_state['cancelled']:
+                connection_state['peripheral'] = decawave_peripheral
+                return decawave_peripheral
+        logger.debug('Closing connection to {} opened after cancellation'.format(decawave_device.device_name))
+        decawave_ble.disconnect_peripheral_quietly(decawave_peripheral)
+        return None
+    try:
+        return await run_blocking(connect)
+    except asyncio.CancelledError:
+        with lock:
+            connection_state['cancelled'] = True
+            decawave_peripheral = connection_state['peripheral']
+        if decawave_peripheral is not None:
+            logger.debug('Closing connection to {} after cancellation'.format(decawave_device.device_name))
+            asyncio.get_running_loop().run_in_executor(
+                executor,
+                decawave_ble.disconnect_peripheral_quietly,
+                decawave_peripheral)
+        raise
+
+async def disconnect_peripheral(decawave_peripheral):
+    await run_blocking(decawave_ble.disconnect_peripheral_quietly, decawave_peripheral)
+
+# Function for calling one of the *_from_peripheral functions in decawave_ble
+# (a single attempt; see run_with_peripheral)
+async def call_from_peripheral(function, decawave_peripheral, *args, **kwargs):
+    return await run_blocking(
+        function,
+        decawave_peripheral,
+        *args,
+        **kwargs)
+
+# Function for connecting to a device, running operation(decawave_peripheral)
+# (a coroutine function) and disconnecting. The connection and the operation
+# are retried together according to the retry policy
+async def run_with_peripheral(
+    operation,
+    decawave_device,
+    interface = None,
+    retry_policy = None):
+    return await decawave_ble.get_retry_policy(retry_policy).run_async(
+        operation,
+        connect = lambda: get_decawave_peripheral(decawave_device, interface),
+        release = disconnect_peripheral,
+        discard = disconnect_peripheral,
+        description = decawave_device.device_name,
+        device_name = decawave_device.device_name)
+
+# Function for connecting to a device, calling one of the *_from_peripheral
+# functions in decawave_ble and disconnecting
+async def call_with_peripheral(
+    function,
+    decawave_device,
+    *args,
+    interface = None,
+    retry_policy = None,
+    **kwargs):
+    return await run_with_peripheral(
+        lambda decawave_peripheral: call_from_peripheral(function, decawave_peripheral, *args, **kwargs),
+        decawave_device,
+        interface,
+        retry_policy)
+
+# Function for getting a complete set of data from device(s). If fields is
+# specified, only those characteristics are read (see decawave_ble.get_data)
+async def get_data(
+    decawave_device,
+    interface = None,
+    fields = None,
+    retry_policy = None):
+    fields = decawave_ble.get_data_fields(fields)
+    async def get_data_from_peripheral(decawave_peripheral):
+        data = {
+            'device_name': decawave_device.device_name,
+            'scan_data': decawave_device.scan_data()}
+        for field in fields:
+            data[field] = await call_from_peripheral(decawave_ble.DATA_FIELD_FUNCTIONS[field], decawave_peripheral)
+        return data
+    return await run_with_peripheral(
+        get_data_from_peripheral,
+        decawave_device,
+        interface,
+        retry_policy)
+
+# Function for getting data from multiple devices at once. Devices are
+# assigned to the HCI interfaces in interfaces (all interfaces on this host by
+# default) in turn and no more than max_connections_per_interface devices are
+# connected on each interface at any time. Failed (or cancelled) devices are
+# left out of the returned dictionary and their exceptions are added to errors
+# (if a dictionary is supplied). If fields is specified, only those fields are
+# read
+async def get_data_multiple_devices(
+    decawave_devices,
+    max_connections_per_interface = None,
+    errors = None,
+    fields = None,
+    retry_policy = None,
+    interfaces = None):
+    fields = decawave_ble.get_data_fields(fields)
+    if max_connections_per_interface is None:
+        max_connections_per_interface = decawave_ble.default_max_connections_per_interface
+    if max_connections_per_interface < 1:
+        raise ValueError('Maximum number of connections per interface must be at least 1')
+    if interfaces is None:
+        interfaces = decawave_ble.get_hci_interfaces()
+    semaphores = {interface: asyncio.Semaphore(max_connections_per_interface) for interface in interfaces}
+    async def get_data_limited(decawave_device, interface):
+        async with semaphores[interface]:
+            return await get_data(
+                decawave_device,
+                interface = interface,
+                fields = fields,
+                retry_policy = retry_policy)
+    results = await asyncio.gather(
+        *[get_data_limited(decawave_device, interfaces[device_index % len(interfaces)])
+            for device_index, decawave_device in enumerate(decawave_devices.values())],
+        return_exceptions=True)
+    data_multiple = {}
+    for device_name, result in zip(decawave_devices.keys(), results):
+        if isinstance(result, BaseException):
+            logger.warning('Failed to get data for {}: {}'.format(device_name, repr(result)))
+            if errors is not None:
+                errors[device_name] = result
+        else:
+            data_multiple[device_name] = result
+    return data_multiple
+
+# Functions for setting all configuration parameters
+async def set_config(
+    decawave_device,
+    device_type_name = None,
+    uwb_mode_name = None,
+    accelerometer_enable = None,
+    led_enable = None,
+    initiator = None,
+    low_power_mode = None,
+    location_engine = None,
+    network_id = None,
+    moving_update_rate = None,
+    stationary_update_rate = None,
+    x_position = None,
+    y_position = None,
+    z_position = None,
+    quality = None,
+    check_config_enabled = False,
+    interface = None,
+    dry_run = False,
+    retry_policy = None):
+    async def set_config_to_peripheral(decawave_peripheral):
+        config_plan = await call_from_peripheral(
+            decawave_ble.get_config_plan_from_peripheral,
+            decawave_peripheral,
+            device_type_name,
+            uwb_mode_name,
+            accelerometer_enable,
+            led_enable,
+            initiator,
+            low_power_mode,
+            location_engine,
+            network_id,
+            moving_update_rate,
+            stationary_update_rate,
+            x_position,
+            y_position,
+            z_position,
+            quality)
+        if not dry_run:
+            await call_from_peripheral(
+                decawave_ble.apply_config_plan_to_peripheral,
+                decawave_peripheral,
+                config_plan,
+                check_config_enabled)
+        return config_plan
+    return await run_with_peripheral(
+        set_config_to_peripheral,
+        decawave_device,
+        interface,
+        retry_policy)
+
+# Functions for getting individual characteristics
+async def get_operation_mode_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_operation_mode_data_from_peripheral, decawave_device)
+
+async def get_location_data_mode_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_location_data_mode_data_from_peripheral, decawave_device)
+
+async def get_location_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_location_data_from_peripheral, decawave_device)
+
+async def get_network_id(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_network_id_from_peripheral, decawave_device)
+
+async def get_proxy_positions_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_proxy_positions_data_from_peripheral, decawave_device)
+
+async def get_device_info_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_device_info_data_from_peripheral, decawave_device)
+
+async def get_anchor_list_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_anchor_list_data_from_peripheral, decawave_device)
+
+async def get_update_rate_data(decawave_device):
+    return await call_with_peripheral(decawave_ble.get_update_rate_data_from_peripheral, decawave_device)
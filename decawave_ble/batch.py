@@ -0,0 +1,143 @@
+import decawave_ble.codecs
+import numpy as np
+
+# Batch decoders for captured location data characteristic payloads. Rather
+# than parsing one frame at a time into lists of dictionaries, many frames are
+# decoded at once into structured NumPy arrays. All frames are gathered into a
+# single byte buffer and the fixed-size position and distance records are
+# pulled out with fancy indexing and reinterpreted with packed little-endian
+# dtypes, so the work is vectorized over records rather than looped in Python
+
+POSITION_RECORD_DTYPE = np.dtype([
+    ('x_position', '<i4'),
+    ('y_position', '<i4'),
+    ('z_position', '<i4'),
+    ('quality', 'u1')])
+DISTANCE_RECORD_DTYPE = np.dtype([
+    ('node_id', '<u2'),
+    ('distance', '<u4'),
+    ('quality', 'u1')])
+
+POSITION_ARRAY_DTYPE = np.dtype([
+    ('frame_index', '<i8'),
+    ('x_position', '<i4'),
+    ('y_position', '<i4'),
+    ('z_position', '<i4'),
+    ('quality', 'u1')])
+DISTANCE_ARRAY_DTYPE = np.dtype([
+    ('frame_index', '<i8'),
+    ('node_id', '<u2'),
+    ('distance', '<u4'),
+    ('quality', 'u1')])
+
+if POSITION_RECORD_DTYPE.itemsize != decawave_ble.codecs.POSITION_SIZE:
+    raise ValueError('Position record dtype does not match position record layout')
+if DISTANCE_RECORD_DTYPE.itemsize != decawave_ble.codecs.DISTANCE_SIZE:
+    raise ValueError('Distance record dtype does not match distance record layout')
+
+# Function for decoding a list of location data payloads (bytes-like objects).
+# Returns a tuple of structured arrays (positions, distances). Each row carries
+# the index of the frame it came from. Frames with no position (or distance)
+# data contribute no rows to the corresponding array
+def parse_location_data_frames(location_data_frames):
+    lengths = np.fromiter(
+        (len(location_data_frame) for location_data_frame in location_data_frames),
+        dtype=np.int64,
+        count=len(location_data_frames))
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    location_data_buffer = b''.join(location_data_frames)
+    return parse_location_data_buffer(
+        location_data_buffer,
+        offsets,
+        lengths)
+
+# Function for decoding location data payloads stored back to back in a single
+# buffer. offsets gives the start of each frame. If lengths is not specified,
+# each frame is assumed to run to the start of the next (and the last to the end
+# of the buffer). Returns a tuple of structured arrays (positions, distances)
+# as in parse_location_data_frames
+def parse_location_data_buffer(
+    location_data_buffer,
+    offsets,
+    lengths = None):
+    buffer_array = np.frombuffer(location_data_buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if lengths is None:
+        lengths = np.diff(np.append(offsets, len(buffer_array)))
+    else:
+        lengths = np.asarray(lengths, dtype=np.int64)
+    if offsets.shape != lengths.shape:
+        raise ValueError('Number of offsets ({}) does not match number of lengths ({})'.format(
+            len(offsets),
+            len(lengths)))
+    if np.any(offsets < 0) or np.any(lengths < 0) or np.any(offsets + lengths > len(buffer_array)):
+        raise ValueError('Frame offsets and lengths extend outside of buffer')
+    frame_indices = np.arange(len(offsets))
+    frame_ends = offsets + lengths
+    # Frames with no bytes have no location data content
+    nonempty = lengths > 0
+    location_data_content = np.full(len(offsets), -1, dtype=np.int64)
+    location_data_content[nonempty] = buffer_array[offsets[nonempty]]
+    unrecognized = nonempty & (location_data_content > 2)
+    if np.any(unrecognized):
+        raise ValueError('Location data content byte {} in frame {} not recognized'.format(
+            location_data_content[unrecognized][0],
+            frame_indices[unrecognized][0]))
+    has_position = (location_data_content == 0) | (location_data_content == 2)
+    has_distances = (location_data_content == 1) | (location_data_content == 2)
+    # Positions
+    position_offsets = offsets + 1
+    truncated = has_position & (frame_ends - position_offsets < decawave_ble.codecs.POSITION_SIZE)
+    if np.any(truncated):
+        raise ValueError('Location data content byte indicated position data was included but less than 13 bytes follow (frame {})'.format(
+            frame_indices[truncated][0]))
+    position_records = gather_records(
+        buffer_array,
+        position_offsets[has_position],
+        POSITION_RECORD_DTYPE)
+    positions = np.empty(len(position_records), dtype=POSITION_ARRAY_DTYPE)
+    positions['frame_index'] = frame_indices[has_position]
+    for field_name in POSITION_RECORD_DTYPE.names:
+        positions[field_name] = position_records[field_name]
+    # Distances
+    distance_count_offsets = position_offsets + np.where(has_position, decawave_ble.codecs.POSITION_SIZE, 0)
+    truncated = has_distances & (frame_ends - distance_count_offsets < 1)
+    if np.any(truncated):
+        raise ValueError('Location data content byte indicated distance data was included but no bytes follow (frame {})'.format(
+            frame_indices[truncated][0]))
+    distance_count_offsets = distance_count_offsets[has_distances]
+    distance_frame_indices = frame_indices[has_distances]
+    distance_counts = buffer_array[distance_count_offsets].astype(np.int64)
+    distance_bytes_available = frame_ends[has_distances] - distance_count_offsets - 1
+    truncated = distance_bytes_available < decawave_ble.codecs.DISTANCE_SIZE*distance_counts
+    if np.any(truncated):
+        raise ValueError('Distance count byte indicated that {} distance values would follow so expected {} bytes but only {} bytes follow (frame {})'.format(
+            distance_counts[truncated][0],
+            decawave_ble.codecs.DISTANCE_SIZE*distance_counts[truncated][0],
+            distance_bytes_available[truncated][0],
+            distance_frame_indices[truncated][0]))
+    # Offset of each distance record: the start of its frame's distance list
+    # plus its position within that list
+    num_distances = int(np.sum(distance_counts))
+    first_record_indices = np.cumsum(distance_counts) - distance_counts
+    record_positions = np.arange(num_distances) - np.repeat(first_record_indices, distance_counts)
+    distance_offsets = np.repeat(distance_count_offsets + 1, distance_counts) + decawave_ble.codecs.DISTANCE_SIZE*record_positions
+    distance_records = gather_records(
+        buffer_array,
+        distance_offsets,
+        DISTANCE_RECORD_DTYPE)
+    distances = np.empty(num_distances, dtype=DISTANCE_ARRAY_DTYPE)
+    distances['frame_index'] = np.repeat(distance_frame_indices, distance_counts)
+    for field_name in DISTANCE_RECORD_DTYPE.names:
+        distances[field_name] = distance_records[field_name]
+    return positions, distances
+
+# Function for pulling fixed-size records out of a byte array at the specified
+# offsets and reinterpreting them with a packed record dtype
+def gather_records(
+    buffer_array,
+    record_offsets,
+    record_dtype):
+    record_bytes = buffer_array[record_offsets[:, np.newaxis] + np.arange(record_dtype.itemsize)]
+    return np.ascontiguousarray(record_bytes).view(record_dtype).reshape(len(record_offsets))
@@ -0,0 +1,427 @@
+import decawave_ble
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Binary capture format for raw characteristic values (e.g., location data
+# notifications) from many devices over long periods.
+#
+# A capture file starts with a file header and is followed by chunks. Each
+# chunk starts with a chunk header (record count, size, base monotonic and UTC
+# timestamps and the range of UTC timestamps it covers), then the names of any
+# devices that first appear in the chunk, then the records. Each record is a
+# small header (monotonic and UTC offsets from the chunk base in microseconds,
+# device index, characteristic code and payload length) followed by the raw
+# payload. When the writer is closed, an index of all chunks and devices is
+# appended as a JSON footer, followed by a fixed-size trailer pointing to it.
+# A file without a valid trailer (e.g., because the writer was killed) is
+# indexed by walking the chunks, and a partially written last chunk is
+# ignored (or truncated when the file is reopened for appending)
+
+CAPTURE_FILE_MAGIC = b'DWBLECAP'
+CAPTURE_FILE_VERSION = 1
+CHUNK_MAGIC = b'CHNK'
+TRAILER_MAGIC = b'DWBLEIDX'
+
+FILE_HEADER_STRUCT = struct.Struct('<8sH')
+CHUNK_HEADER_STRUCT = struct.Struct('<4sIIddddH')
+DEVICE_NAME_HEADER_STRUCT = struct.Struct('<HB')
+RECORD_HEADER_STRUCT = struct.Struct('<IiHBH')
+TRAILER_STRUCT = struct.Struct('<QQ8s')
+
+# Characteristics which can be captured, identified in the file by their
+# position in this list (so new characteristics must only be added at the end)
+CAPTURE_CHARACTERISTIC_UUIDS = [
+    decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID,
+    decawave_ble.OPERATION_MODE_CHARACTERISTIC_UUID,
+    decawave_ble.NETWORK_ID_CHARACTERISTIC_UUID,
+    decawave_ble.LOCATION_DATA_MODE_CHARACTERISTIC_UUID,
+    decawave_ble.PROXY_POSITIONS_CHARACTERISTIC_UUID,
+    decawave_ble.DEVICE_INFO_CHARACTERISTIC_UUID,
+    decawave_ble.ANCHOR_LIST_CHARACTERISTIC_UUID,
+    decawave_ble.TAG_UPDATE_RATE_CHARACTERISTIC_UUID]
+
+PARSE_FUNCTIONS = {
+    decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID: decawave_ble.parse_location_data_bytes,
+    decawave_ble.OPERATION_MODE_CHARACTERISTIC_UUID: decawave_ble.parse_operation_mode_bytes,
+    decawave_ble.NETWORK_ID_CHARACTERISTIC_UUID: decawave_ble.parse_network_id_bytes,
+    decawave_ble.LOCATION_DATA_MODE_CHARACTERISTIC_UUID: decawave_ble.parse_location_data_mode_bytes,
+    decawave_ble.PROXY_POSITIONS_CHARACTERISTIC_UUID: decawave_ble.parse_proxy_positions_bytes,
+    decawave_ble.DEVICE_INFO_CHARACTERISTIC_UUID: decawave_ble.parse_device_info_bytes,
+    decawave_ble.ANCHOR_LIST_CHARACTERISTIC_UUID: decawave_ble.parse_anchor_list_bytes,
+    decawave_ble.TAG_UPDATE_RATE_CHARACTERISTIC_UUID: decawave_ble.parse_update_rate_bytes}
+
+# Maximum span of a chunk (microsecond offsets must fit in 32 bits)
+MAX_CHUNK_DURATION = 2000.0
+
+# Class for appending records to a capture file. Records are buffered in
+# memory and written out a chunk at a time (when chunk_size records or
+# chunk_duration seconds have accumulated, or when flush() is called). If the
+# file already exists, new chunks are added after the existing ones
+class CaptureWriter:
+    def __init__(
+        self,
+        path,
+        chunk_size = 4096,
+        chunk_duration = 10.0):
+        if chunk_duration > MAX_CHUNK_DURATION:
+            raise ValueError('Chunk duration cannot exceed {} seconds'.format(MAX_CHUNK_DURATION))
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_duration = chunk_duration
+        self.lock = threading.Lock()
+        self.device_indices = {}
+        self.chunks = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with CaptureReader(path) as capture_reader:
+                devices = capture_reader.devices
+                self.chunks = capture_reader.chunks
+                data_end = capture_reader.data_end
+            self.device_indices = {device_name: device_index for device_index, device_name in enumerate(devices)}
+            self.file = open(path, 'r+b')
+            self.file.truncate(data_end)
+            self.file.seek(data_end)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(FILE_HEADER_STRUCT.pack(CAPTURE_FILE_MAGIC, CAPTURE_FILE_VERSION))
+        self.reset_chunk()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reset_chunk(self):
+        self.chunk_records = bytearray()
+        self.chunk_num_records = 0
+        self.chunk_new_devices = []
+        self.chunk_device_indices = set()
+        self.chunk_base_monotonic_time = None
+        self.chunk_base_utc_time = None
+        self.chunk_start_time = None
+        self.chunk_end_time = None
+
+    # Function for adding a record. Timestamps default to the current time
+    def append(
+        self,
+        device_name,
+        payload,
+        characteristic_uuid = decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID,
+        monotonic_time = None,
+        utc_time = None):
+        if monotonic_time is None:
+            monotonic_time = time.monotonic()
+        if utc_time is None:
+            utc_time = time.time()
+        try:
+            characteristic_code = CAPTURE_CHARACTERISTIC_UUIDS.index(characteristic_uuid)
+        except ValueError:
+            raise ValueError('Characteristic {} cannot be captured'.format(characteristic_uuid))
+        if len(payload) > 0xffff:
+            raise ValueError('Payload of {} bytes is too long to capture'.format(len(payload)))
+        with self.lock:
+            if self.chunk_num_records > 0 and (
+                self.chunk_num_records >= self.chunk_size or
+                monotonic_time - self.chunk_base_monotonic_time >= self.chunk_duration or
+                monotonic_time < self.chunk_base_monotonic_time or
+                abs(utc_time - self.chunk_base_utc_time) >= MAX_CHUNK_DURATION):
+                self.write_chunk()
+            if self.chunk_num_records == 0:
+                self.chunk_base_monotonic_time = monotonic_time
+                self.chunk_base_utc_time = utc_time
+                self.chunk_start_time = utc_time
+                self.chunk_end_time = utc_time
+            device_index = self.device_indices.get(device_name)
+            if device_index is None:
+                if len(self.device_indices) > 0xffff:
+                    raise ValueError('Too many devices in capture')
+                device_index = len(self.device_indices)
+                self.device_indices[device_name] = device_index
+                self.chunk_new_devices.append((device_index, device_name))
+            self.chunk_device_indices.add(device_index)
+            self.chunk_start_time = min(self.chunk_start_time, utc_time)
+            self.chunk_end_time = max(self.chunk_end_time, utc_time)
+            self.chunk_records += RECORD_HEADER_STRUCT.pack(
+                int(round((monotonic_time - self.chunk_base_monotonic_time)*1e6)),
+                int(round((utc_time - self.chunk_base_utc_time)*1e6)),
+                device_index,
+                characteristic_code,
+                len(payload))
+            self.chunk_records += payload
+            self.chunk_num_records += 1
+
+    def write_chunk(self):
+        if self.chunk_num_records == 0:
+            return
+        device_names_bytes = bytearray()
+        for device_index, device_name in self.chunk_new_devices:
+            device_name_bytes = device_name.encode('utf-8')
+            device_names_bytes += DEVICE_NAME_HEADER_STRUCT.pack(device_index, len(device_name_bytes))
+            device_names_bytes += device_name_bytes
+        chunk_offset = self.file.tell()
+        self.file.write(CHUNK_HEADER_STRUCT.pack(
+            CHUNK_MAGIC,
+            self.chunk_num_records,
+            len(device_names_bytes) + len(self.chunk_records),
+            self.chunk_base_monotonic_time,
+            self.chunk_base_utc_time,
+            self.chunk_start_time,
+            self.chunk_end_time,
+            len(self.chunk_new_devices)))
+        self.file.write(device_names_bytes)
+        self.file.write(self.chunk_records)
+        self.chunks.append({
+            'offset': chunk_offset,
+            'num_records': self.chunk_num_records,
+            'start_time': self.chunk_start_time,
+            'end_time': self.chunk_end_time,
+            'device_indices': sorted(self.chunk_device_indices)})
+        self.reset_chunk()
+
+    # Function for writing buffered records to disk
+    def flush(self):
+        with self.lock:
+            self.write_chunk()
+            self.file.flush()
+
+    # Function for writing buffered records and the index and closing the file
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.write_chunk()
+            index_offset = self.file.tell()
+            devices = sorted(self.device_indices, key=self.device_indices.get)
+            index_bytes = json.dumps({
+                'devices': devices,
+                'chunks': self.chunks}).encode('utf-8')
+            self.file.write(index_bytes)
+            self.file.write(TRAILER_STRUCT.pack(
+                index_offset,
+                len(index_bytes),
+                TRAILER_MAGIC))
+            self.file.close()
+
+# Class for reading a capture file. The file is memory mapped and only the
+# index is read when it is opened. Records are decoded lazily by read(), which
+# only visits chunks that overlap the requested time range and contain the
+# requested devices
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            if os.fstat(self.file.fileno()).st_size < FILE_HEADER_STRUCT.size:
+                raise ValueError('{} is not a capture file'.format(path))
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        magic, version = FILE_HEADER_STRUCT.unpack_from(self.buffer)
+        if magic != CAPTURE_FILE_MAGIC:
+            self.close()
+            raise ValueError('{} is not a capture file'.format(path))
+        if version != CAPTURE_FILE_VERSION:
+            self.close()
+            raise ValueError('Capture file version {} not supported'.format(version))
+        if not self.load_index():
+            logger.info('No index found in {}. Scanning chunks'.format(path))
+            self.scan_chunks()
+        self.chunk_end_times = [chunk['end_time'] for chunk in self.chunks]
+        self.device_indices = {device_name: device_index for device_index, device_name in enumerate(self.devices)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if hasattr(self, 'buffer'):
+            self.buffer.close()
+        self.file.close()
+
+    def load_index(self):
+        if len(self.buffer) < FILE_HEADER_STRUCT.size + TRAILER_STRUCT.size:
+            return False
+        index_offset, index_length, magic = TRAILER_STRUCT.unpack_from(
+            self.buffer,
+            len(self.buffer) - TRAILER_STRUCT.size)
+        if magic != TRAILER_MAGIC or index_offset + index_length + TRAILER_STRUCT.size != len(self.buffer):
+            return False
+        index = json.loads(bytes(self.buffer[index_offset:index_offset + index_length]).decode('utf-8'))
+        self.devices = index['devices']
+        self.chunks = index['chunks']
+        self.data_end = index_offset
+        return True
+
+    def scan_chunks(self):
+        devices = {}
+        self.chunks = []
+        offset = FILE_HEADER_STRUCT.size
+        while offset + CHUNK_HEADER_STRUCT.size <= len(self.buffer):
+            (
+                magic,
+                num_records,
+                chunk_size,
+                base_monotonic_time,
+                base_utc_time,
+                start_time,
+                end_time,
+                num_new_devices
+            ) = CHUNK_HEADER_STRUCT.unpack_from(self.buffer, offset)
+            if magic != CHUNK_MAGIC or offset + CHUNK_HEADER_STRUCT.size + chunk_size > len(self.buffer):
+                break
+            device_name_offset = offset + CHUNK_HEADER_STRUCT.size
+            for new_device_index in range(num_new_devices):
+                device_index, name_length = DEVICE_NAME_HEADER_STRUCT.unpack_from(self.buffer, device_name_offset)
+                device_name_offset += DEVICE_NAME_HEADER_STRUCT.size
+                devices[device_index] = bytes(self.buffer[device_name_offset:device_name_offset + name_length]).decode('utf-8')
+                device_name_offset += name_length
+            device_indices = set()
+            for record in self.iterate_chunk_records(offset):
+                device_indices.add(record[2])
+            self.chunks.append({
+                'offset': offset,
+                'num_records': num_records,
+                'start_time': start_time,
+                'end_time': end_time,
+                'device_indices': sorted(device_indices)})
+            offset += CHUNK_HEADER_STRUCT.size + chunk_size
+        self.devices = [devices[device_index] for device_index in range(len(devices))]
+        self.data_end = offset
+
+    # Function for iterating over the records in the chunk at the specified
+    # offset. Yields tuples (monotonic time, UTC time, device index,
+    # characteristic code, payload) where the payload is a copy (bytes), so
+    # that the reader can be closed while a generator is still alive (the mmap
+    # cannot be closed while views into it exist)
+    def iterate_chunk_records(self, chunk_offset):
+        (
+            magic,
+            num_records,
+            chunk_size,
+            base_monotonic_time,
+            base_utc_time,
+            start_time,
+            end_time,
+            num_new_devices
+        ) = CHUNK_HEADER_STRUCT.unpack_from(self.buffer, chunk_offset)
+        offset = chunk_offset + CHUNK_HEADER_STRUCT.size
+        for new_device_index in range(num_new_devices):
+            name_length = DEVICE_NAME_HEADER_STRUCT.unpack_from(self.buffer, offset)[1]
+            offset += DEVICE_NAME_HEADER_STRUCT.size + name_length
+        for record_index in range(num_records):
+            (
+                monotonic_offset,
+                utc_offset,
+                device_index,
+                characteristic_code,
+                payload_length
+            ) = RECORD_HEADER_STRUCT.unpack_from(self.buffer, offset)
+            offset += RECORD_HEADER_STRUCT.size
+            yield (
+                base_monotonic_time + monotonic_offset*1e-6,
+                base_utc_time + utc_offset*1e-6,
+                device_index,
+                characteristic_code,
+                self.buffer[offset:offset + payload_length])
+            offset += payload_length
+
+    @property
+    def start_time(self):
+        if len(self.chunks) == 0:
+            return None
+        return min(chunk['start_time'] for chunk in self.chunks)
+
+    @property
+    def end_time(self):
+        if len(self.chunks) == 0:
+            return None
+        return max(chunk['end_time'] for chunk in self.chunks)
+
+    @property
+    def num_records(self):
+        return sum(chunk['num_records'] for chunk in self.chunks)
+
+    # Function for reading records. Yields dictionaries with keys device_name,
+    # timestamp (UTC), monotonic_time, characteristic_uuid and data. If parse
+    # is True, data is parsed with the matching parse_*_bytes function;
+    # otherwise it is the raw payload (bytes). Records are filtered by UTC
+    # timestamp (start_time inclusive, end_time exclusive), device name and
+    # characteristic UUID. Chunks are assumed to be written in time order
+    def read(
+        self,
+        start_time = None,
+        end_time = None,
+        device_names = None,
+        characteristic_uuids = None,
+        parse = False):
+        if device_names is not None:
+            device_indices = set(self.device_indices[device_name] for device_name in device_names if device_name in self.device_indices)
+        else:
+            device_indices = None
+        if characteristic_uuids is not None:
+            characteristic_codes = set(CAPTURE_CHARACTERISTIC_UUIDS.index(characteristic_uuid) for characteristic_uuid in characteristic_uuids)
+        else:
+            characteristic_codes = None
+        if start_time is None:
+            first_chunk_index = 0
+        else:
+            first_chunk_index = bisect.bisect_left(self.chunk_end_times, start_time)
+        for chunk in self.chunks[first_chunk_index:]:
+            if end_time is not None and chunk['start_time'] >= end_time:
+                break
+            if device_indices is not None and device_indices.isdisjoint(chunk['device_indices']):
+                continue
+            for monotonic_time, utc_time, device_index, characteristic_code, payload in self.iterate_chunk_records(chunk['offset']):
+                if start_time is not None and utc_time < start_time:
+                    continue
+                if end_time is not None and utc_time >= end_time:
+                    continue
+                if device_indices is not None and device_index not in device_indices:
+                    continue
+                if characteristic_codes is not None and characteristic_code not in characteristic_codes:
+                    continue
+                characteristic_uuid = CAPTURE_CHARACTERISTIC_UUIDS[characteristic_code]
+                if parse:
+                    data = PARSE_FUNCTIONS[characteristic_uuid](payload)
+                else:
+                    data = payload
+                yield {
+                    'device_name': self.devices[device_index],
+                    'timestamp': utc_time,
+                    'monotonic_time': monotonic_time,
+                    'characteristic_uuid': characteristic_uuid,
+                    'data': data}
+
+# Function for capturing location data notifications from one or more devices
+# to a capture file (see decawave_ble.stream_location_data). Returns the
+# number of records captured
+def capture_location_data(
+    decawave_devices,
+    path,
+    duration = None,
+    chunk_size = 4096,
+    chunk_duration = 10.0):
+    num_records = 0
+    with CaptureWriter(path, chunk_size, chunk_duration) as capture_writer:
+        for record in decawave_ble.stream_location_data(
+            decawave_devices,
+            duration,
+            raw = True):
+            capture_writer.append(
+                record['device_name'],
+                record['location_data'],
+                utc_time = record['timestamp'])
+            num_records += 1
+    logger.info('Captured {} location data records in {}'.format(num_records, path))
+    return num_records
@@ -0,0 +1,266 @@
+import bitstruct
+import struct
+
+# Codecs for the Decawave network node service characteristics. Formats are
+# compiled once at import and data is decoded by offset (slicing memoryviews
+# rather than bytes), so no intermediate copies are made. All multi-byte
+# fields are little endian
+
+# Names of operation mode data values
+DEVICE_TYPE_NAMES = ['Tag', 'Anchor']
+UWB_MODE_NAMES = ['Off', 'Passive', 'Active']
+FW_VERSION_NAMES = ['1', '2']
+
+# Names of location data mode data values
+LOCATION_DATA_MODE_NAMES = [
+    'Position only',
+    'Distances only',
+    'Position and distances']
+
+# Names of location data content values
+LOCATION_DATA_CONTENT_NAMES = [
+    'Position only',
+    'Distances only',
+    'Position and distances']
+
+OPERATION_MODE_FORMAT = bitstruct.compile(
+    'u1u2u1b1b1b1b1b1b1b1u4',
+    [
+        'device_type',
+        'uwb_mode',
+        'fw_version',
+        'accelerometer_enable',
+        'led_enable',
+        'fw_update_enable',
+        'reserved_01',
+        'initiator',
+        'low_power_mode',
+        'location_engine',
+        'reserved_02'])
+POSITION_STRUCT = struct.Struct('<iiiB')
+DISTANCE_STRUCT = struct.Struct('<HIB')
+PROXY_POSITION_STRUCT = struct.Struct('<HiiiB')
+DEVICE_INFO_STRUCT = struct.Struct('<QIIIIIB')
+NODE_ID_STRUCT = struct.Struct('<H')
+NETWORK_ID_STRUCT = struct.Struct('<H')
+UPDATE_RATE_STRUCT = struct.Struct('<II')
+COUNT_STRUCT = struct.Struct('<B')
+
+POSITION_SIZE = POSITION_STRUCT.size
+DISTANCE_SIZE = DISTANCE_STRUCT.size
+PROXY_POSITION_SIZE = PROXY_POSITION_STRUCT.size
+
+# Functions for operation mode data
+def parse_operation_mode_bytes(operation_mode_bytes):
+    operation_mode_data = OPERATION_MODE_FORMAT.unpack(operation_mode_bytes)
+    operation_mode_data['device_type_name'] = DEVICE_TYPE_NAMES[operation_mode_data['device_type']]
+    operation_mode_data['uwb_mode_name'] = UWB_MODE_NAMES[operation_mode_data['uwb_mode']]
+    operation_mode_data['fw_version_name'] = FW_VERSION_NAMES[operation_mode_data['fw_version']]
+    return operation_mode_data
+
+def pack_operation_mode_bytes(operation_mode_data):
+    operation_mode_bytes = OPERATION_MODE_FORMAT.pack(operation_mode_data)
+    return operation_mode_bytes
+
+# Functions for location data mode data
+def parse_location_data_mode_bytes(location_data_mode_bytes):
+    location_data_mode = location_data_mode_bytes[0]
+    location_data_mode_name = LOCATION_DATA_MODE_NAMES[location_data_mode]
+    location_data_mode_data = {
+        'location_data_mode': location_data_mode,
+        'location_data_mode_name': location_data_mode_name}
+    return location_data_mode_data
+
+def pack_location_data_mode_bytes(location_data_mode_data):
+    return COUNT_STRUCT.pack(int(location_data_mode_data['location_data_mode']))
+
+# Functions for location data
+def parse_position_bytes(position_bytes, offset = 0):
+    x_position, y_position, z_position, quality = POSITION_STRUCT.unpack_from(position_bytes, offset)
+    return {
+        'x_position': x_position,
+        'y_position': y_position,
+        'z_position': z_position,
+        'quality': quality}
+
+def parse_location_data_bytes(location_data_bytes):
+    location_data_view = memoryview(location_data_bytes)
+    num_bytes = len(location_data_view)
+    offset = 0
+    if num_bytes > 0:
+        location_data_content = location_data_view[0]
+        offset = 1
+        location_data_content_name = LOCATION_DATA_CONTENT_NAMES[location_data_content]
+    else:
+        location_data_content = None
+        location_data_content_name = None
+    if (location_data_content == 0 or location_data_content == 2):
+        if num_bytes - offset < POSITION_SIZE:
+            raise ValueError('Location data content byte indicated position data was included but less than 13 bytes follow')
+        position_data = parse_position_bytes(location_data_view, offset)
+        offset += POSITION_SIZE
+    else:
+        position_data = None
+    if (location_data_content == 1 or location_data_content == 2):
+        if num_bytes - offset < 1:
+            raise ValueError('Location data content byte indicated distance data was included but no bytes follow')
+        distance_count = location_data_view[offset]
+        offset += 1
+        if num_bytes - offset < DISTANCE_SIZE*distance_count:
+            raise ValueError('Distance count byte indicated that {} distance values would follow so expected {} bytes but only {} bytes follow'.format(
+                distance_count,
+                DISTANCE_SIZE*distance_count,
+                num_bytes - offset))
+        distance_data = []
+        for node_id, distance, quality in DISTANCE_STRUCT.iter_unpack(location_data_view[offset:offset + DISTANCE_SIZE*distance_count]):
+            distance_data.append({
+                'node_id': node_id,
+                'distance': distance,
+                'quality': quality})
+    else:
+        distance_data = None
+    return {
+        'location_data_content': location_data_content,
+        'location_data_content_name': location_data_content_name,
+        'position_data': position_data,
+        'distance_data': distance_data}
+
+def pack_position_bytes(position_data):
+    position_bytes = POSITION_STRUCT.pack(
+        int(position_data['x_position']),
+        int(position_data['y_position']),
+        int(position_data['z_position']),
+        int(position_data['quality']))
+    return position_bytes
+
+def pack_location_data_bytes(location_data):
+    location_data_content = location_data['location_data_content']
+    if location_data_content is None:
+        return b''
+    location_data_bytes = bytearray(COUNT_STRUCT.pack(location_data_content))
+    if (location_data_content == 0 or location_data_content == 2):
+        location_data_bytes += pack_position_bytes(location_data['position_data'])
+    if (location_data_content == 1 or location_data_content == 2):
+        distance_data = location_data['distance_data']
+        location_data_bytes += COUNT_STRUCT.pack(len(distance_data))
+        for distance_datum in distance_data:
+            location_data_bytes += DISTANCE_STRUCT.pack(
+                int(distance_datum['node_id']),
+                int(distance_datum['distance']),
+                int(distance_datum['quality']))
+    return bytes(location_data_bytes)
+
+# Functions for network ID
+def parse_network_id_bytes(network_id_bytes):
+    if len(network_id_bytes) > 0:
+        network_id = NETWORK_ID_STRUCT.unpack_from(network_id_bytes)[0]
+        return network_id
+    else:
+        return None
+
+def pack_network_id_bytes(network_id):
+    network_id_bytes = NETWORK_ID_STRUCT.pack(int(network_id))
+    return network_id_bytes
+
+# Functions for proxy positions data
+def parse_proxy_positions_bytes(proxy_positions_bytes):
+    if len(proxy_positions_bytes) > 0:
+        num_elements = proxy_positions_bytes[0]
+        proxy_positions_data = []
+        for element_index in range(num_elements):
+            node_id, x_position, y_position, z_position, quality = PROXY_POSITION_STRUCT.unpack_from(
+                proxy_positions_bytes,
+                1 + PROXY_POSITION_SIZE*element_index)
+            proxy_positions_data.append({
+                'node_id': node_id,
+                'x_position': x_position,
+                'y_position': y_position,
+                'z_position': z_position,
+                'quality': quality})
+        return proxy_positions_data
+    else:
+        return None
+
+def pack_proxy_positions_bytes(proxy_positions_data):
+    if proxy_positions_data is None:
+        return b''
+    proxy_positions_bytes = bytearray(COUNT_STRUCT.pack(len(proxy_positions_data)))
+    for position_data in proxy_positions_data:
+        proxy_positions_bytes += PROXY_POSITION_STRUCT.pack(
+            int(position_data['node_id']),
+            int(position_data['x_position']),
+            int(position_data['y_position']),
+            int(position_data['z_position']),
+            int(position_data['quality']))
+    return bytes(proxy_positions_bytes)
+
+# Functions for device info data
+def parse_device_info_bytes(device_info_bytes):
+    (
+        node_id,
+        hw_version,
+        fw1_version,
+        fw2_version,
+        fw1_checksum,
+        fw2_checksum,
+        flags
+    ) = DEVICE_INFO_STRUCT.unpack_from(device_info_bytes)
+    return {
+        'node_id': node_id,
+        'hw_version': hw_version,
+        'fw1_version': fw1_version,
+        'fw2_version': fw2_version,
+        'fw1_checksum': fw1_checksum,
+        'fw2_checksum': fw2_checksum,
+        'bridge': bool(flags >> 7),
+        'unknown': flags & 0x7f}
+
+def pack_device_info_bytes(device_info_data):
+    device_info_bytes = DEVICE_INFO_STRUCT.pack(
+        int(device_info_data['node_id']),
+        int(device_info_data['hw_version']),
+        int(device_info_data['fw1_version']),
+        int(device_info_data['fw2_version']),
+        int(device_info_data['fw1_checksum']),
+        int(device_info_data['fw2_checksum']),
+        (int(bool(device_info_data['bridge'])) << 7) | (int(device_info_data['unknown']) & 0x7f))
+    return device_info_bytes
+
+# Functions for anchor list data
+def parse_anchor_list_bytes(anchor_list_bytes):
+    if len(anchor_list_bytes) > 0:
+        num_elements = anchor_list_bytes[0]
+        anchor_list_data = []
+        for element_index in range(num_elements):
+            node_id = NODE_ID_STRUCT.unpack_from(
+                anchor_list_bytes,
+                1 + NODE_ID_STRUCT.size*element_index)[0]
+            anchor_list_data.append(node_id)
+        return anchor_list_data
+    else:
+        return None
+
+def pack_anchor_list_bytes(anchor_list_data):
+    if anchor_list_data is None:
+        return b''
+    anchor_list_bytes = bytearray(COUNT_STRUCT.pack(len(anchor_list_data)))
+    for node_id in anchor_list_data:
+        anchor_list_bytes += NODE_ID_STRUCT.pack(int(node_id))
+    return bytes(anchor_list_bytes)
+
+# Functions for update rate data
+def parse_update_rate_bytes(update_rate_bytes):
+    moving_update_rate, stationary_update_rate = UPDATE_RATE_STRUCT.unpack_from(update_rate_bytes)
+    return {
+        'moving_update_rate': moving_update_rate,
+        'stationary_update_rate': stationary_update_rate}
+
+def pack_update_rate_bytes(update_rate_data):
+    update_rate_bytes = UPDATE_RATE_STRUCT.pack(
+        int(update_rate_data['moving_update_rate']),
+        int(update_rate_data['stationary_update_rate']))
+    return update_rate_bytes
+
+# Functions for persisted position data
+def pack_persisted_position_bytes(persisted_position_data):
+    return pack_position_bytes(persisted_position_data)
@@ -1,6 +1,82 @@
+import csv
+import re
+import time
+
+# Strings treated as missing values in CSV configuration files (the defaults
+# of pandas.read_csv)
+CSV_MISSING_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null'}
+
+CSV_TRUE_VALUES = {'True', 'TRUE', 'true'}
+CSV_FALSE_VALUES = {'False', 'FALSE', 'false'}
+
+CSV_INTEGER_PATTERN = re.compile(r'[+-]?[0-9]+')
+
+# Function for parsing a configuration database in CSV format (a header row,
+# then one row per device keyed by the value in the first column) into a
+# dictionary of dictionaries. The type of each column is inferred as
+# pandas.read_csv would (bool, int, float or str, with missing values as None
+# and integer columns with missing values as float), so the result is the
+# same as json.loads(pd.read_csv(csv_file, index_col=0).to_json(orient='index'))
+# without the cost of importing pandas
+def parse_configuration_csv(csv_file):
+    rows = [row for row in csv.reader(csv_file) if len(row) > 0]
+    if len(rows) == 0:
+        return {}
+    column_names = rows[0][1:]
+    index_values = []
+    columns = [[] for column_name in column_names]
+    for row in rows[1:]:
+        if len(row) > len(column_names) + 1:
+            raise ValueError('Expected {} fields in row for {} but found {}'.format(
+                len(column_names) + 1,
+                row[0],
+                len(row)))
+        index_values.append(row[0])
+        for column_index, column in enumerate(columns):
+            column_position = column_index + 1
+            value = row[column_position] if column_position < len(row) else ''
+            column.append(None if value in CSV_MISSING_VALUES else value)
+    if len(set(index_values)) < len(index_values):
+        raise ValueError('Device names in configuration are not unique')
+    columns = [get_csv_column_values(column) for column in columns]
+    configuration = {}
+    for row_index, index_value in enumerate(index_values):
+        configuration[index_value] = {
+            column_name: column[row_index]
+            for column_name, column in zip(column_names, columns)}
+    return configuration
+
+# Function for converting the (string) values in a CSV column to the type
+# pandas.read_csv would infer for the column
+def get_csv_column_values(values):
+    present_values = [value for value in values if value is not None]
+    if len(present_values) == 0:
+        return values
+    if all([value in CSV_TRUE_VALUES or value in CSV_FALSE_VALUES for value in present_values]):
+        return [None if value is None else value in CSV_TRUE_VALUES for value in values]
+    if all([CSV_INTEGER_PATTERN.fullmatch(value) is not None for value in present_values]):
+        if len(present_values) < len(values):
+            return [None if value is None else float(value) for value in values]
+        return [int(value) for value in values]
+    try:
+        return [None if value is None else float(value) for value in values]
+    except ValueError:
+        return values
 
 class ConfigurationDatabase:
 
+    # Minimum number of seconds between checks of whether the stored
+    # configuration has changed since it was loaded (None means that the
+    # loaded configuration is used until it is explicitly invalidated)
+    revalidation_interval = None
+
+    _configuration = None
+    _configuration_version = None
+    _configuration_check_time = None
+
     def get_target_device_names(self):
         """Returns a list of the device names associated with this configuration instance"""
         configuration_df = self.get_configuration()
@@ -9,10 +85,51 @@ class ConfigurationDatabase:
     def get_configuration(self):
         """Gets the configuration for this instance
 
+        The configuration is loaded once and then served from memory. If
+        revalidation_interval is set, the version of the stored configuration
+        is checked at most that often and the configuration is reloaded only
+        if the version has changed.
+
+        Keyword arguments:
+        """
+        check_time = time.monotonic()
+        if self._configuration is not None:
+            if (
+                self.revalidation_interval is None or
+                check_time - self._configuration_check_time < self.revalidation_interval
+            ):
+                return self._configuration
+            configuration_version = self.get_configuration_version()
+            self._configuration_check_time = check_time
+            if configuration_version is not None and configuration_version == self._configuration_version:
+                return self._configuration
+        else:
+            configuration_version = self.get_configuration_version()
+        self._configuration = self.load_configuration()
+        self._configuration_version = configuration_version
+        self._configuration_check_time = check_time
+        return self._configuration
+
+    def load_configuration(self):
+        """Loads and parses the configuration for this instance from storage
+
         Keyword arguments:
         """
         raise NotImplementedError()
 
+    def get_configuration_version(self):
+        """Returns a token that changes whenever the stored configuration changes (or None if unknown)
+
+        Keyword arguments:
+        """
+        return None
+
+    def invalidate_configuration(self):
+        """Discards the loaded configuration so that it is reloaded on next use"""
+        self._configuration = None
+        self._configuration_version = None
+        self._configuration_check_time = None
+
     def get_target_data(
             self,
             target_device_name):
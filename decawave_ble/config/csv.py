@@ -1,12 +1,9 @@
-import json
 import os
 import logging
 
-import pandas as pd
-
 logger = logging.getLogger(__name__)
 
-from . import ConfigurationDatabase
+from . import ConfigurationDatabase, parse_configuration_csv
 
 
 class ConfigurationDatabaseCSVLocal(ConfigurationDatabase):
@@ -17,14 +14,21 @@ class ConfigurationDatabaseCSVLocal(ConfigurationDatabase):
             configuration_database_local_path = os.environ['CONFIGURATION_DATABASE_LOCAL_PATH']
         self.configuration_database_local_path = configuration_database_local_path
 
-    def get_configuration(self):
-        configuration_df = pd.read_csv(
-            self.configuration_database_local_path,
-            index_col=0)
-        return json.loads(configuration_df.to_json(orient='index'))
+    # Checking the modification time of a local file is cheap, so do it every
+    # time the configuration is requested
+    revalidation_interval = 0
+
+    def load_configuration(self):
+        with open(self.configuration_database_local_path, 'r', newline='') as f:
+            return parse_configuration_csv(f)
+
+    def get_configuration_version(self):
+        stat_result = os.stat(self.configuration_database_local_path)
+        return (stat_result.st_mtime_ns, stat_result.st_size)
 
     def put_dataframe(
             self,
             configuration_df):
         configuration_df.to_csv(
             self.configuration_database_local_path)
+        self.invalidate_configuration()
@@ -1,13 +1,10 @@
-import json
+import io
 import os
 import logging
 
-import pandas as pd
-import s3fs
-
 logger = logging.getLogger(__name__)
 
-from . import ConfigurationDatabase
+from . import ConfigurationDatabase, parse_configuration_csv
 
 
 class ConfigurationDatabaseCSVS3(ConfigurationDatabase):
@@ -21,20 +18,36 @@ class ConfigurationDatabaseCSVS3(ConfigurationDatabase):
             configuration_database_object_name = os.environ['CONFIGURATION_DATABASE_S3_OBJECT_NAME']
         self.configuration_database_bucket_name = configuration_database_bucket_name
         self.configuration_database_object_name = configuration_database_object_name
+        self.s3 = None
+
+    # Checking the ETag of the object costs a request to S3, so only do it
+    # once a minute
+    revalidation_interval = 60
+
+    def get_s3(self):
+        if self.s3 is None:
+            import s3fs
+            self.s3 = s3fs.S3FileSystem(anon=False)
+        return self.s3
 
-    def get_configuration(self):
-        s3_location = 's3://' + self.configuration_database_bucket_name + '/' + self.configuration_database_object_name
+    def load_configuration(self):
+        s3_location = self.configuration_database_bucket_name + '/' + self.configuration_database_object_name
         logging.info('S3 location: {}'.format(s3_location))
-        configuration_df = pd.read_csv(
-            s3_location,
-            index_col=0)
-        return json.loads(configuration_df.to_json(orient='index'))
+        with self.get_s3().open(s3_location, 'rb') as f:
+            return parse_configuration_csv(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+
+    def get_configuration_version(self):
+        s3_location = self.configuration_database_bucket_name + '/' + self.configuration_database_object_name
+        s3 = self.get_s3()
+        s3.invalidate_cache(s3_location)
+        return s3.info(s3_location).get('ETag')
 
     def put_dataframe(
             self,
             configuration_df):
-        s3 = s3fs.S3FileSystem(anon=False)
+        s3 = self.get_s3()
         s3_location = self.configuration_database_bucket_name + '/' + self.configuration_database_object_name
         bytes_to_write = configuration_df.to_csv(None).encode()
         with s3.open(s3_location, 'wb') as f:
             f.write(bytes_to_write)
+        self.invalidate_configuration()
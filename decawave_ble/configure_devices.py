@@ -1,5 +1,7 @@
 import decawave_ble
+import decawave_ble.registry
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -19,13 +21,38 @@ MINIMAL_CONFIG = {
         'moving_update_rate',
         'stationary_update_rate']}
 
-# Function for configuring multiple devices from a database
-def configure_devices_from_database(configuration_database):
+# Function for configuring multiple devices from a database. If concurrent is
+# True, devices are configured in parallel (see
+# decawave_ble.apply_to_multiple_devices) and a failure on one device does not
+# stop the others. If dry_run is True, the current configuration of each device
+# is read and compared with the target but nothing is written. The scan for
+# devices stops as soon as all target devices have been found (or after
+# scan_timeout seconds). If a device registry (see decawave_ble.registry) is
+# supplied, devices in the registry are connected to without scanning,
+# devices that fail are rescanned and tried once more and devices that were
+# configured (or checked) successfully are marked as seen. Returns a dictionary of
+# per-device results keyed by device name
+def configure_devices_from_database(
+    configuration_database,
+    dry_run = False,
+    concurrent = False,
+    max_connections_per_interface = None,
+    interfaces = None,
+    scan_timeout = 10.0,
+    device_registry = None):
     logger.info('Getting target device names')
     target_device_names = configuration_database.get_target_device_names()
     logger.info('Target device names: {}'.format(target_device_names))
-    logger.info('Scanning for Decawave devices')
-    devices = decawave_ble.scan_for_decawave_devices()
+    if device_registry is None:
+        logger.info('Scanning for Decawave devices')
+        devices = decawave_ble.scan_for_decawave_devices(
+            timeout = scan_timeout,
+            device_names = target_device_names)
+    else:
+        devices = decawave_ble.registry.find_decawave_devices(
+            device_registry,
+            target_device_names,
+            scan_timeout)
     logger.info('Found {} Decawave devices'.format(len(devices)))
     device_names = list(devices.keys())
     target_devices_not_present = set(target_device_names) - set(device_names)
@@ -38,49 +65,145 @@ def configure_devices_from_database(configuration_database):
         logger.warning('Devices found but not mentioned in config data: {}'.format(present_devices_not_targeted))
     else:
         logger.info('All found devices are mentioned in config data')
+    target_configs = {}
     for target_device_name in target_device_names:
         logger.info('Getting target data for {}'.format(target_device_name))
         target_data = configuration_database.get_target_data(target_device_name)
         logger.info('Target data: {}'.format(target_data))
-        device_type_name = target_data.get('device_type_name')
-        if device_type_name is None:
-            raise ValueError('Device type must be specified when configuring devices')
-        if device_type_name not in MINIMAL_CONFIG.keys():
-            raise ValueError('Device type {} not recognized'.format(device_type_name))
-        minimal_config = MINIMAL_CONFIG[device_type_name]
-        specified_fields =[]
-        for key in target_data.keys():
-            if target_data.get(key) is not None:
-                specified_fields.append(key)
-        if not set(minimal_config).issubset(specified_fields):
-            logger.warning('Device type for {} is set to {} but some important fields are not specified in config: {}'.format(
-                target_device_name,
-                device_type_name,
-                list(set(minimal_config) - set(specified_fields))))
-        if target_data.get('network_id') is not None:
+        target_configs[target_device_name] = get_target_config(
+            target_device_name,
+            target_data)
+    target_devices = {target_device_name: devices[target_device_name] for target_device_name in target_device_names}
+    def configure_device(decawave_device, interface = None):
+        logger.info('Comparing {} with target data'.format(decawave_device.device_name))
+        start_time = time.monotonic()
+        config_plan = decawave_ble.set_config(
+            decawave_device,
+            check_config_enabled = True,
+            interface = interface,
+            dry_run = dry_run,
+            **target_configs[decawave_device.device_name])
+        changes = decawave_ble.get_config_plan_changes(config_plan)
+        if len(changes) == 0:
+            status = 'unchanged'
+        elif dry_run:
+            status = 'planned'
+        else:
+            status = 'configured'
+            logger.info('Configuration is set correctly for {}'.format(decawave_device.device_name))
+        return {
+            'status': status,
+            'changes': changes,
+            'error': None,
+            'duration': time.monotonic() - start_time}
+    if concurrent:
+        results, errors = decawave_ble.apply_to_multiple_devices(
+            configure_device,
+            target_devices,
+            max_connections_per_interface,
+            interfaces)
+    else:
+        results = {}
+        errors = {}
+        for target_device_name, target_device in target_devices.items():
+            try:
+                results[target_device_name] = configure_device(target_device)
+            except Exception as e:
+                if device_registry is None:
+                    raise
+                errors[target_device_name] = e
+    if device_registry is not None and len(errors) > 0:
+        rescanned_devices = decawave_ble.registry.rescan_decawave_devices(
+            device_registry,
+            list(errors.keys()),
+            scan_timeout)
+        for target_device_name, target_device in rescanned_devices.items():
+            if target_device_name not in errors:
+                continue
+            logger.info('Retrying {} after rescan'.format(target_device_name))
             try:
-                network_id = int(target_data.get('network_id'))
+                results[target_device_name] = configure_device(target_device)
+            except Exception as e:
+                errors[target_device_name] = e
+            else:
+                del errors[target_device_name]
+    for target_device_name, error in errors.items():
+        results[target_device_name] = {
+            'status': 'failed',
+            'changes': None,
+            'error': repr(error),
+            'duration': None}
+    results = {target_device_name: results[target_device_name] for target_device_name in target_device_names}
+    if device_registry is not None:
+        device_registry.mark_seen([target_device_name for target_device_name, result in results.items() if result['status'] != 'failed'])
+        device_registry.save()
+    log_configuration_summary(results)
+    return results
+
+# Function for converting a row of the configuration database into keyword
+# arguments for decawave_ble.set_config
+def get_target_config(
+    target_device_name,
+    target_data):
+    device_type_name = target_data.get('device_type_name')
+    if device_type_name is None:
+        raise ValueError('Device type must be specified when configuring devices')
+    if device_type_name not in MINIMAL_CONFIG.keys():
+        raise ValueError('Device type {} not recognized'.format(device_type_name))
+    minimal_config = MINIMAL_CONFIG[device_type_name]
+    specified_fields =[]
+    for key in target_data.keys():
+        if target_data.get(key) is not None:
+            specified_fields.append(key)
+    if not set(minimal_config).issubset(specified_fields):
+        logger.warning('Device type for {} is set to {} but some important fields are not specified in config: {}'.format(
+            target_device_name,
+            device_type_name,
+            list(set(minimal_config) - set(specified_fields))))
+    network_id = None
+    if target_data.get('network_id') is not None:
+        try:
+            network_id = int(target_data.get('network_id'))
+        except:
+            try:
+                network_id = int(target_data.get('network_id'), base=0)
             except:
-                try:
-                    network_id = int(target_data.get('network_id'), base=0)
-                except:
-                    raise ValueError('Network ID {} is not of a recognized type'.format(network_id))
-        logger.info('Writing target data')
-        decawave_ble.set_config(
-            devices[target_device_name],
-            device_type_name=target_data.get('device_type_name'),
-            uwb_mode_name=target_data.get('uwb_mode_name'),
-            accelerometer_enable=target_data.get('accelerometer_enable'),
-            led_enable=target_data.get('led_enable'),
-            initiator=target_data.get('initiator'),
-            low_power_mode=target_data.get('low_power_mode'),
-            location_engine=target_data.get('location_engine'),
-            network_id=network_id,
-            moving_update_rate=target_data.get('moving_update_rate'),
-            stationary_update_rate=target_data.get('stationary_update_rate'),
-            x_position=target_data.get('x_position'),
-            y_position=target_data.get('y_position'),
-            z_position=target_data.get('z_position'),
-            quality=target_data.get('quality'),
-            check_config_enabled = True)
-        logger.info('Configuration is set correctly')
+                raise ValueError('Network ID {} is not of a recognized type'.format(target_data.get('network_id')))
+    return {
+        'device_type_name': target_data.get('device_type_name'),
+        'uwb_mode_name': target_data.get('uwb_mode_name'),
+        'accelerometer_enable': target_data.get('accelerometer_enable'),
+        'led_enable': target_data.get('led_enable'),
+        'initiator': target_data.get('initiator'),
+        'low_power_mode': target_data.get('low_power_mode'),
+        'location_engine': target_data.get('location_engine'),
+        'network_id': network_id,
+        'moving_update_rate': target_data.get('moving_update_rate'),
+        'stationary_update_rate': target_data.get('stationary_update_rate'),
+        'x_position': target_data.get('x_position'),
+        'y_position': target_data.get('y_position'),
+        'z_position': target_data.get('z_position'),
+        'quality': target_data.get('quality')}
+
+# Function for logging a summary of the results of a configuration pass
+def log_configuration_summary(results):
+    failed_device_names = [device_name for device_name, result in results.items() if result['status'] == 'failed']
+    for device_name, result in results.items():
+        if result['status'] == 'failed':
+            logger.error('{}: failed ({})'.format(device_name, result['error']))
+        else:
+            logger.info('{}: {} {} in {:.1f} s'.format(
+                device_name,
+                result['status'],
+                result['changes'],
+                result['duration']))
+    status_counts = {}
+    for result in results.values():
+        status_counts[result['status']] = status_counts.get(result['status'], 0) + 1
+    logger.info('Results for {} devices: {}'.format(
+        len(results),
+        status_counts))
+    if len(failed_device_names) > 0:
+        logger.error('Failed to configure {} devices: {}'.format(
+            len(failed_device_names),
+            failed_device_names))
@@ -0,0 +1,260 @@
+import decawave_ble.records
+import os
+import logging
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet
+
+logger = logging.getLogger(__name__)
+
+# Export of device data (as returned by decawave_ble.get_data) and streamed
+# location data (as yielded by decawave_ble.stream_location_data or
+# decawave_ble.replay.replay_location_data) to typed columnar tables, written
+# as Parquet or Arrow IPC files. Nested data is flattened into one table per
+# kind of record, linked by device name (and timestamp for streamed data).
+# Rows are buffered and written in row groups (record batches for Arrow IPC)
+# of row_group_size rows, so input of any size can be exported with bounded
+# memory
+
+DEVICE_SCHEMA = pa.schema([
+    ('device_name', pa.string()),
+    ('mac_address', pa.string()),
+    ('address_type', pa.string()),
+    ('interface', pa.int32()),
+    ('rssi', pa.int32()),
+    ('connectable', pa.bool_()),
+    ('node_id', pa.uint64()),
+    ('hw_version', pa.uint32()),
+    ('fw1_version', pa.uint32()),
+    ('fw2_version', pa.uint32()),
+    ('fw1_checksum', pa.uint32()),
+    ('fw2_checksum', pa.uint32()),
+    ('bridge', pa.bool_()),
+    ('device_type', pa.uint8()),
+    ('device_type_name', pa.string()),
+    ('uwb_mode', pa.uint8()),
+    ('uwb_mode_name', pa.string()),
+    ('fw_version', pa.uint8()),
+    ('fw_version_name', pa.string()),
+    ('accelerometer_enable', pa.bool_()),
+    ('led_enable', pa.bool_()),
+    ('fw_update_enable', pa.bool_()),
+    ('initiator', pa.bool_()),
+    ('low_power_mode', pa.bool_()),
+    ('location_engine', pa.bool_()),
+    ('network_id', pa.uint16()),
+    ('location_data_mode', pa.uint8()),
+    ('location_data_mode_name', pa.string()),
+    ('location_data_content', pa.uint8()),
+    ('location_data_content_name', pa.string()),
+    ('x_position', pa.int32()),
+    ('y_position', pa.int32()),
+    ('z_position', pa.int32()),
+    ('quality', pa.uint8()),
+    ('moving_update_rate', pa.uint32()),
+    ('stationary_update_rate', pa.uint32())])
+
+LOCATION_SCHEMA = pa.schema([
+    ('device_name', pa.string()),
+    ('timestamp', pa.float64()),
+    ('location_data_content', pa.uint8()),
+    ('x_position', pa.int32()),
+    ('y_position', pa.int32()),
+    ('z_position', pa.int32()),
+    ('quality', pa.uint8())])
+
+DISTANCE_SCHEMA = pa.schema([
+    ('device_name', pa.string()),
+    ('timestamp', pa.float64()),
+    ('node_id', pa.uint16()),
+    ('distance', pa.uint32()),
+    ('quality', pa.uint8())])
+
+PROXY_POSITION_SCHEMA = pa.schema([
+    ('device_name', pa.string()),
+    ('node_id', pa.uint16()),
+    ('x_position', pa.int32()),
+    ('y_position', pa.int32()),
+    ('z_position', pa.int32()),
+    ('quality', pa.uint8())])
+
+ANCHOR_LIST_SCHEMA = pa.schema([
+    ('device_name', pa.string()),
+    ('anchor_index', pa.uint8()),
+    ('node_id', pa.uint16())])
+
+EXPORT_FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow'}
+
+# Class for writing rows to a Parquet or Arrow IPC file in row groups
+class TableWriter:
+    def __init__(
+        self,
+        path,
+        schema,
+        export_format = 'parquet',
+        row_group_size = 65536):
+        get_extension(export_format)
+        self.path = path
+        self.schema = schema
+        self.export_format = export_format
+        self.row_group_size = row_group_size
+        self.columns = {field_name: [] for field_name in schema.names}
+        self.num_buffered_rows = 0
+        self.num_rows = 0
+        if export_format == 'parquet':
+            self.writer = pa.parquet.ParquetWriter(path, schema)
+        else:
+            self.sink = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Function for adding a row (a dictionary keyed by field name; missing
+    # fields are null)
+    def append(self, row):
+        for field_name, column in self.columns.items():
+            column.append(row.get(field_name))
+        self.num_buffered_rows += 1
+        if self.num_buffered_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.num_buffered_rows == 0:
+            return
+        record_batch = pa.record_batch(
+            [self.columns[field_name] for field_name in self.schema.names],
+            schema=self.schema)
+        if self.export_format == 'parquet':
+            self.writer.write_batch(record_batch, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_batch(record_batch)
+        self.num_rows += self.num_buffered_rows
+        self.columns = {field_name: [] for field_name in self.schema.names}
+        self.num_buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.export_format == 'arrow':
+            self.sink.close()
+
+def get_extension(export_format):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Export format {} not recognized (must be one of {})'.format(
+            export_format,
+            list(EXPORT_FORMATS.keys())))
+    return EXPORT_FORMATS[export_format]
+
+# Function for flattening device data into a row of the devices table
+def flatten_device_data(data):
+    row = {'device_name': data.get('device_name')}
+    scan_data = data.get('scan_data')
+    if scan_data is not None:
+        for field_name in ['mac_address', 'address_type', 'interface', 'rssi', 'connectable']:
+            row[field_name] = scan_data.get(field_name)
+    for key in ['device_info_data', 'operation_mode_data', 'location_data_mode_data', 'update_rate_data']:
+        if data.get(key) is not None:
+            row.update(data[key])
+    row['network_id'] = data.get('network_id')
+    location_data = data.get('location_data')
+    if location_data is not None:
+        row['location_data_content'] = location_data['location_data_content']
+        row['location_data_content_name'] = location_data['location_data_content_name']
+        if location_data['position_data'] is not None:
+            row.update(location_data['position_data'])
+    return row
+
+# Function for exporting data from multiple devices (a dictionary as returned
+# by decawave_ble.get_data_multiple_devices or any iterable of device data,
+# e.g., from decawave_ble.read_data_from_json_lines_local) to a devices table
+# and distances, proxy positions and anchor lists tables in directory. Returns
+# a dictionary of the number of rows written to each table
+def export_data_multiple_devices(
+    data_multiple,
+    directory,
+    export_format = 'parquet',
+    row_group_size = 65536):
+    if isinstance(data_multiple, dict):
+        data_multiple = data_multiple.values()
+    extension = get_extension(export_format)
+    os.makedirs(directory, exist_ok=True)
+    table_writers = {
+        'devices': TableWriter(os.path.join(directory, 'devices' + extension), DEVICE_SCHEMA, export_format, row_group_size),
+        'distances': TableWriter(os.path.join(directory, 'distances' + extension), DISTANCE_SCHEMA, export_format, row_group_size),
+        'proxy_positions': TableWriter(os.path.join(directory, 'proxy_positions' + extension), PROXY_POSITION_SCHEMA, export_format, row_group_size),
+        'anchor_lists': TableWriter(os.path.join(directory, 'anchor_lists' + extension), ANCHOR_LIST_SCHEMA, export_format, row_group_size)}
+    try:
+        for data in data_multiple:
+            data = decawave_ble.records.to_dict(data)
+            device_name = data.get('device_name')
+            table_writers['devices'].append(flatten_device_data(data))
+            location_data = data.get('location_data')
+            if location_data is not None and location_data['distance_data'] is not None:
+                for distance_datum in location_data['distance_data']:
+                    row = {'device_name': device_name}
+                    row.update(distance_datum)
+                    table_writers['distances'].append(row)
+            if data.get('proxy_positions_data') is not None:
+                for proxy_positions_datum in data['proxy_positions_data']:
+                    row = {'device_name': device_name}
+                    row.update(proxy_positions_datum)
+                    table_writers['proxy_positions'].append(row)
+            if data.get('anchor_list_data') is not None:
+                for anchor_index, node_id in enumerate(data['anchor_list_data']):
+                    table_writers['anchor_lists'].append({
+                        'device_name': device_name,
+                        'anchor_index': anchor_index,
+                        'node_id': node_id})
+    finally:
+        for table_writer in table_writers.values():
+            table_writer.close()
+    num_rows = {table_name: table_writer.num_rows for table_name, table_writer in table_writers.items()}
+    logger.info('Exported {} to {}'.format(num_rows, directory))
+    return num_rows
+
+# Function for exporting streamed location data records (dictionaries with
+# keys device_name, timestamp and location_data) to a locations table and a
+# distances table in directory. Returns a dictionary of the number of rows
+# written to each table
+def export_location_data(
+    location_data_records,
+    directory,
+    export_format = 'parquet',
+    row_group_size = 65536):
+    extension = get_extension(export_format)
+    os.makedirs(directory, exist_ok=True)
+    table_writers = {
+        'locations': TableWriter(os.path.join(directory, 'locations' + extension), LOCATION_SCHEMA, export_format, row_group_size),
+        'distances': TableWriter(os.path.join(directory, 'distances' + extension), DISTANCE_SCHEMA, export_format, row_group_size)}
+    try:
+        for record in location_data_records:
+            device_name = record['device_name']
+            timestamp = record['timestamp']
+            location_data = decawave_ble.records.to_dict(record['location_data'])
+            row = {
+                'device_name': device_name,
+                'timestamp': timestamp,
+                'location_data_content': location_data['location_data_content']}
+            if location_data['position_data'] is not None:
+                row.update(location_data['position_data'])
+            table_writers['locations'].append(row)
+            if location_data['distance_data'] is not None:
+                for distance_datum in location_data['distance_data']:
+                    row = {
+                        'device_name': device_name,
+                        'timestamp': timestamp}
+                    row.update(distance_datum)
+                    table_writers['distances'].append(row)
+    finally:
+        for table_writer in table_writers.values():
+            table_writer.close()
+    num_rows = {table_name: table_writer.num_rows for table_name, table_writer in table_writers.items()}
+    logger.info('Exported {} to {}'.format(num_rows, directory))
+    return num_rows
@@ -0,0 +1,324 @@
+import bisect
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Instrumentation of BLE operations. Scans, connections, service discovery,
+# characteristic reads and writes, whole (retried) device operations
+# (device_operation) and other retried calls (retry:<description>, e.g.,
+# retry:scan) are timed and reported as events to every registered sink. An
+# event is a dictionary with keys operation, device_name,
+# characteristic_uuid (None if not applicable), duration (seconds), success,
+# error (the exception class name, or None) and attempts (for retried
+# operations only, otherwise None).
+# When no sinks are registered, recording an event costs almost nothing.
+#
+# Sinks are objects with a record(event) method. Two are provided:
+# MetricsCollector (aggregates events into histograms per operation, device
+# and characteristic, with an in-memory summary and Prometheus text format
+# output) and CallbackMetricsSink (passes each event to a function)
+
+# Upper bounds of the latency histogram buckets (seconds)
+DEFAULT_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Upper bounds of the attempts histogram buckets
+DEFAULT_ATTEMPTS_BUCKETS = [1, 2, 3, 5, 10]
+
+sinks = []
+sinks_lock = threading.Lock()
+
+# Function for registering a sink. Returns the sink so that, e.g.,
+# collector = decawave_ble.metrics.add_sink(decawave_ble.metrics.MetricsCollector())
+def add_sink(sink):
+    global sinks
+    with sinks_lock:
+        sinks = sinks + [sink]
+    return sink
+
+def remove_sink(sink):
+    global sinks
+    with sinks_lock:
+        sinks = [existing_sink for existing_sink in sinks if existing_sink is not sink]
+
+def is_enabled():
+    return len(sinks) > 0
+
+# Function for reporting an event to all registered sinks. A sink that fails
+# is logged and does not affect the operation being measured
+def record(
+    operation,
+    duration,
+    device_name = None,
+    characteristic_uuid = None,
+    success = True,
+    error = None,
+    attempts = None):
+    current_sinks = sinks
+    if len(current_sinks) == 0:
+        return
+    event = {
+        'operation': operation,
+        'device_name': device_name,
+        'characteristic_uuid': characteristic_uuid,
+        'duration': duration,
+        'success': success,
+        'error': error,
+        'attempts': attempts}
+    for sink in current_sinks:
+        try:
+            sink.record(event)
+        except Exception as e:
+            logger.warning('Metrics sink {} failed: {}'.format(sink, repr(e)))
+
+# Function for timing a block of code and recording it as an event, e.g.,
+#
+# with decawave_ble.metrics.measure('read', device_name, characteristic_uuid):
+#     ...
+#
+# The event records a failure (with the exception class name) if the block
+# raises
+def measure(
+    operation,
+    device_name = None,
+    characteristic_uuid = None):
+    return MeasuredOperation(
+        operation,
+        device_name,
+        characteristic_uuid)
+
+class MeasuredOperation:
+    __slots__ = (
+        'operation',
+        'device_name',
+        'characteristic_uuid',
+        'start_time')
+
+    def __init__(
+        self,
+        operation,
+        device_name = None,
+        characteristic_uuid = None):
+        self.operation = operation
+        self.device_name = device_name
+        self.characteristic_uuid = characteristic_uuid
+        self.start_time = None
+
+    def __enter__(self):
+        if len(sinks) > 0:
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start_time is None:
+            return False
+        record(
+            self.operation,
+            time.perf_counter() - self.start_time,
+            self.device_name,
+            self.characteristic_uuid,
+            success = exc_type is None,
+            error = None if exc_type is None else exc_type.__name__)
+        return False
+
+# Class to represent a histogram with fixed bucket upper bounds (plus an
+# overflow bucket)
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0]*(len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.sum/self.count
+
+    # Function for estimating a quantile (the upper bound of the bucket it falls
+    # in, or the maximum if it falls in the overflow bucket)
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        threshold = q*self.count
+        cumulative_count = 0
+        for bucket_index, bucket_count in enumerate(self.counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= threshold and cumulative_count > 0:
+                if bucket_index < len(self.buckets):
+                    return min(self.buckets[bucket_index], self.max)
+                return self.max
+        return self.max
+
+# Class for aggregating events in memory. Events are grouped by operation,
+# device name and characteristic UUID; each group has a latency histogram,
+# failure counts by error and (for retried operations) an attempts histogram
+class MetricsCollector:
+    def __init__(
+        self,
+        latency_buckets = None,
+        attempts_buckets = None):
+        if latency_buckets is None:
+            latency_buckets = DEFAULT_LATENCY_BUCKETS
+        if attempts_buckets is None:
+            attempts_buckets = DEFAULT_ATTEMPTS_BUCKETS
+        self.latency_buckets = sorted(latency_buckets)
+        self.attempts_buckets = sorted(attempts_buckets)
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def record(self, event):
+        key = (
+            event['operation'],
+            event['device_name'],
+            event['characteristic_uuid'])
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = {
+                    'latency': Histogram(self.latency_buckets),
+                    'attempts': Histogram(self.attempts_buckets),
+                    'failures': {}}
+                self.groups[key] = group
+            group['latency'].observe(event['duration'])
+            if event['attempts'] is not None:
+                group['attempts'].observe(event['attempts'])
+            if not event['success']:
+                group['failures'][event['error']] = group['failures'].get(event['error'], 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.groups = {}
+
+    # Function for summarizing the collected metrics. Returns a list of
+    # dictionaries (one per operation, device and characteristic), slowest
+    # mean latency first. If operation and/or device_name are specified, only
+    # matching groups are included
+    def summary(
+        self,
+        operation = None,
+        device_name = None):
+        rows = []
+        with self.lock:
+            for (group_operation, group_device_name, characteristic_uuid), group in self.groups.items():
+                if operation is not None and group_operation != operation:
+                    continue
+                if device_name is not None and group_device_name != device_name:
+                    continue
+                latency = group['latency']
+                attempts = group['attempts']
+                rows.append({
+                    'operation': group_operation,
+                    'device_name': group_device_name,
+                    'characteristic_uuid': characteristic_uuid,
+                    'count': latency.count,
+                    'failures': sum(group['failures'].values()),
+                    'failures_by_error': dict(group['failures']),
+                    'total_duration': latency.sum,
+                    'mean_duration': latency.mean(),
+                    'min_duration': latency.min,
+                    'max_duration': latency.max,
+                    'p50_duration': latency.quantile(0.5),
+                    'p90_duration': latency.quantile(0.9),
+                    'p99_duration': latency.quantile(0.99),
+                    'mean_attempts': attempts.mean(),
+                    'max_attempts': attempts.max})
+        rows.sort(key=lambda row: row['mean_duration'], reverse=True)
+        return rows
+
+    # Function for rendering the collected metrics in the Prometheus text
+    # exposition format
+    def prometheus_text(self, prefix = 'decawave_ble'):
+        lines = []
+        with self.lock:
+            groups = sorted(self.groups.items(), key=lambda item: tuple('' if value is None else value for value in item[0]))
+            lines.append('# HELP {}_operation_duration_seconds Duration of BLE operations'.format(prefix))
+            lines.append('# TYPE {}_operation_duration_seconds histogram'.format(prefix))
+            for key, group in groups:
+                write_prometheus_histogram(
+                    lines,
+                    '{}_operation_duration_seconds'.format(prefix),
+                    get_prometheus_labels(*key),
+                    group['latency'])
+            lines.append('# HELP {}_operation_attempts Number of attempts made by retried operations'.format(prefix))
+            lines.append('# TYPE {}_operation_attempts histogram'.format(prefix))
+            for key, group in groups:
+                if group['attempts'].count == 0:
+                    continue
+                write_prometheus_histogram(
+                    lines,
+                    '{}_operation_attempts'.format(prefix),
+                    get_prometheus_labels(*key),
+                    group['attempts'])
+            lines.append('# HELP {}_operation_failures_total Number of failed BLE operations'.format(prefix))
+            lines.append('# TYPE {}_operation_failures_total counter'.format(prefix))
+            for key, group in groups:
+                for error, failure_count in sorted(group['failures'].items()):
+                    labels = get_prometheus_labels(*key) + [('error', error)]
+                    lines.append('{}_operation_failures_total{} {}'.format(
+                        prefix,
+                        format_prometheus_labels(labels),
+                        failure_count))
+        return '\n'.join(lines) + '\n'
+
+# Class for passing each event to a callback (e.g., to forward events to
+# another metrics system)
+class CallbackMetricsSink:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, event):
+        self.callback(event)
+
+def get_prometheus_labels(
+    operation,
+    device_name,
+    characteristic_uuid):
+    labels = [('operation', operation)]
+    if device_name is not None:
+        labels.append(('device', device_name))
+    if characteristic_uuid is not None:
+        labels.append(('characteristic', characteristic_uuid))
+    return labels
+
+def format_prometheus_labels(labels):
+    return '{' + ','.join('{}="{}"'.format(
+        name,
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels) + '}'
+
+def write_prometheus_histogram(
+    lines,
+    name,
+    labels,
+    histogram):
+    cumulative_count = 0
+    for bucket, bucket_count in zip(histogram.buckets, histogram.counts):
+        cumulative_count += bucket_count
+        lines.append('{}_bucket{} {}'.format(
+            name,
+            format_prometheus_labels(labels + [('le', repr(float(bucket)))]),
+            cumulative_count))
+    lines.append('{}_bucket{} {}'.format(
+        name,
+        format_prometheus_labels(labels + [('le', '+Inf')]),
+        histogram.count))
+    lines.append('{}_sum{} {}'.format(
+        name,
+        format_prometheus_labels(labels),
+        repr(float(histogram.sum))))
+    lines.append('{}_count{} {}'.format(
+        name,
+        format_prometheus_labels(labels),
+        histogram.count))
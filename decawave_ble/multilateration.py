@@ -0,0 +1,380 @@
+import decawave_ble.batch
+import decawave_ble.records
+import numpy as np
+
+# Host-side multilateration: solving tag positions from the distances to
+# anchors reported in location data (distance_data, keyed by 16-bit node ID)
+# and the known anchor positions, rather than relying on the location engine
+# of the tag. Everything is vectorized over epochs (sets of distances measured
+# together, i.e., location data frames), so thousands of epochs are solved per
+# call.
+#
+# Each epoch is first solved in closed form by linearizing the range equations
+# in the horizontal plane (with the tag assumed to be at initial_z), then
+# refined by damped Gauss-Newton iterations on the full (weighted) range
+# residuals. Distances are weighted by their quality (0-100) unless weights are
+# given. Anchors are usually mounted at similar heights, which leaves the
+# height of the tag poorly determined and ambiguous (above or below the
+# anchors); starting below the anchors picks the solution below, and the
+# damping keeps the steps well defined. If dimensions is 2, the tag height is
+# fixed and only x and y are solved (using horizontal distances).
+#
+# Positions and distances are in millimeters, as reported by the devices
+
+# Fields of each solution. rms_residual is the weighted root mean square of the
+# range residuals (measured minus solved distance)
+SOLUTION_DTYPE = np.dtype([
+    ('x_position', '<f8'),
+    ('y_position', '<f8'),
+    ('z_position', '<f8'),
+    ('rms_residual', '<f8'),
+    ('num_anchors', '<i4'),
+    ('iterations', '<i4'),
+    ('converged', '?')])
+
+SOLUTION_ARRAY_DTYPE = np.dtype([('frame_index', '<i8')] + SOLUTION_DTYPE.descr)
+
+# Default height below the lowest anchor at which tags are assumed to start
+# (millimeters)
+DEFAULT_INITIAL_Z_OFFSET = 1000.0
+
+# Class to represent an index of anchor positions by node ID, for looking up
+# the positions of the anchors in distance data in bulk. Node IDs are reduced
+# to the 16 bits used in distance data
+class AnchorIndex:
+    def __init__(self, anchor_positions = None):
+        self.anchor_positions = {}
+        self.node_ids = np.empty(0, dtype=np.int64)
+        self.positions = np.empty((0, 3), dtype=np.float64)
+        if anchor_positions is not None:
+            self.update(anchor_positions)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return (int(node_id) & 0xffff) in self.anchor_positions
+
+    # Function for adding (or moving) anchors. anchor_positions is a dictionary
+    # of (x, y, z) positions keyed by node ID
+    def update(self, anchor_positions):
+        for node_id, position in anchor_positions.items():
+            if len(position) != 3:
+                raise ValueError('Position of anchor {} must have three coordinates'.format(node_id))
+            self.anchor_positions[int(node_id) & 0xffff] = tuple(float(coordinate) for coordinate in position)
+        node_ids = sorted(self.anchor_positions.keys())
+        self.node_ids = np.array(node_ids, dtype=np.int64)
+        self.positions = np.array(
+            [self.anchor_positions[node_id] for node_id in node_ids],
+            dtype=np.float64).reshape(len(node_ids), 3)
+
+    # Function for looking up the positions of an array of node IDs. Returns a
+    # tuple (positions, found), where positions has an extra trailing axis of
+    # length 3 (NaN where the node ID is not in the index)
+    def lookup(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64) & 0xffff
+        if len(self.node_ids) == 0:
+            return np.full(node_ids.shape + (3,), np.nan), np.zeros(node_ids.shape, dtype=bool)
+        indices = np.searchsorted(self.node_ids, node_ids)
+        indices = np.minimum(indices, len(self.node_ids) - 1)
+        found = self.node_ids[indices] == node_ids
+        positions = self.positions[indices]
+        positions[~found] = np.nan
+        return positions, found
+
+    # Create an index from proxy positions data (see
+    # decawave_ble.parse_proxy_positions_bytes) or any list of dictionaries with
+    # keys node_id, x_position, y_position and z_position
+    @classmethod
+    def from_position_data(cls, position_data_list):
+        return cls({
+            position_data['node_id']: (
+                position_data['x_position'],
+                position_data['y_position'],
+                position_data['z_position'])
+            for position_data in decawave_ble.records.to_dict(position_data_list)})
+
+    # Create an index from data from multiple devices (see
+    # decawave_ble.get_data_multiple_devices) using the node ID and reported
+    # position of every anchor
+    @classmethod
+    def from_device_data(cls, data_multiple):
+        if isinstance(data_multiple, dict):
+            data_multiple = data_multiple.values()
+        anchor_positions = {}
+        for data in data_multiple:
+            data = decawave_ble.records.to_dict(data)
+            operation_mode_data = data.get('operation_mode_data')
+            device_info_data = data.get('device_info_data')
+            location_data = data.get('location_data')
+            if operation_mode_data is None or device_info_data is None or location_data is None:
+                continue
+            if operation_mode_data['device_type_name'] != 'Anchor' or location_data['position_data'] is None:
+                continue
+            position_data = location_data['position_data']
+            anchor_positions[device_info_data['node_id']] = (
+                position_data['x_position'],
+                position_data['y_position'],
+                position_data['z_position'])
+        return cls(anchor_positions)
+
+# Function for solving positions from padded arrays of anchor positions (shape
+# (num_epochs, max_anchors, 3)) and distances (shape (num_epochs,
+# max_anchors)). Entries where valid is False (or the distance or anchor
+# position is NaN, or the weight is zero) are ignored. Epochs with fewer than
+# min_anchors valid distances are not solved (their positions are NaN). If
+# dimensions is 2, z is fixed at z_position (a scalar or one value per epoch)
+# and only x and y are solved. Returns a tuple (solutions, residuals), where
+# solutions is a structured array of SOLUTION_DTYPE and residuals holds the
+# range residual of each distance (NaN where ignored)
+def solve_positions(
+    anchor_positions,
+    distances,
+    weights = None,
+    valid = None,
+    dimensions = 3,
+    z_position = None,
+    initial_z = None,
+    min_anchors = 3,
+    max_iterations = 10,
+    tolerance = 1.0,
+    damping = 1e-3):
+    if dimensions not in (2, 3):
+        raise ValueError('Number of dimensions must be 2 or 3')
+    if dimensions == 2 and z_position is None:
+        raise ValueError('Tag height (z_position) must be specified when solving in 2 dimensions')
+    anchor_positions = np.asarray(anchor_positions, dtype=np.float64)
+    distances = np.asarray(distances, dtype=np.float64)
+    if anchor_positions.ndim != 3 or anchor_positions.shape[2] != 3 or anchor_positions.shape[:2] != distances.shape:
+        raise ValueError('Anchor positions must have shape (num_epochs, max_anchors, 3) and distances (num_epochs, max_anchors)')
+    num_epochs = distances.shape[0]
+    if weights is None:
+        weights = np.ones(distances.shape, dtype=np.float64)
+    else:
+        weights = np.array(weights, dtype=np.float64)
+    usable = np.isfinite(distances) & np.all(np.isfinite(anchor_positions), axis=2) & (weights > 0)
+    if valid is not None:
+        usable &= np.asarray(valid, dtype=bool)
+    weights = np.where(usable, weights, 0.0)
+    distances = np.where(usable, distances, 0.0)
+    anchor_positions = np.where(usable[:, :, np.newaxis], anchor_positions, 0.0)
+    num_anchors = np.sum(usable, axis=1)
+    solvable = num_anchors >= max(min_anchors, 3)
+    solutions = np.zeros(num_epochs, dtype=SOLUTION_DTYPE)
+    for field_name in ['x_position', 'y_position', 'z_position', 'rms_residual']:
+        solutions[field_name] = np.nan
+    solutions['num_anchors'] = num_anchors
+    residuals = np.full(distances.shape, np.nan)
+    if not np.any(solvable):
+        return solutions, residuals
+    anchor_positions = anchor_positions[solvable]
+    distances = distances[solvable]
+    weights = weights[solvable]
+    usable = usable[solvable]
+    # Height of the tag: fixed (2 dimensions) or a starting point (3
+    # dimensions)
+    if dimensions == 2:
+        tag_z = np.broadcast_to(np.asarray(z_position, dtype=np.float64), (num_epochs,))[solvable]
+    elif initial_z is not None:
+        tag_z = np.broadcast_to(np.asarray(initial_z, dtype=np.float64), (num_epochs,))[solvable]
+    else:
+        anchor_z = np.where(usable, anchor_positions[:, :, 2], np.inf)
+        tag_z = np.min(anchor_z, axis=1) - DEFAULT_INITIAL_Z_OFFSET
+    # Horizontal distances (given the tag height)
+    height_differences = anchor_positions[:, :, 2] - tag_z[:, np.newaxis]
+    horizontal_distances = np.sqrt(np.maximum(distances**2 - height_differences**2, 0.0))
+    horizontal_positions = get_linearized_positions(
+        anchor_positions[:, :, :2],
+        horizontal_distances,
+        weights,
+        usable)
+    if dimensions == 2:
+        positions, iterations, converged = refine_positions(
+            horizontal_positions,
+            anchor_positions[:, :, :2],
+            horizontal_distances,
+            weights,
+            max_iterations,
+            tolerance,
+            damping)
+        positions = np.concatenate([positions, tag_z[:, np.newaxis]], axis=1)
+    else:
+        positions, iterations, converged = refine_positions(
+            np.concatenate([horizontal_positions, tag_z[:, np.newaxis]], axis=1),
+            anchor_positions,
+            distances,
+            weights,
+            max_iterations,
+            tolerance,
+            damping)
+    solved_ranges = np.linalg.norm(positions[:, np.newaxis, :] - anchor_positions, axis=2)
+    solved_residuals = np.where(usable, distances - solved_ranges, np.nan)
+    rms_residuals = np.sqrt(np.sum(weights*np.where(usable, solved_residuals, 0.0)**2, axis=1)/np.sum(weights, axis=1))
+    solutions['x_position'][solvable] = positions[:, 0]
+    solutions['y_position'][solvable] = positions[:, 1]
+    solutions['z_position'][solvable] = positions[:, 2]
+    solutions['rms_residual'][solvable] = rms_residuals
+    solutions['iterations'][solvable] = iterations
+    solutions['converged'][solvable] = converged
+    residuals[solvable] = solved_residuals
+    return solutions, residuals
+
+# Function for solving the range equations in closed form (by subtracting the
+# squared range of the tag, which is treated as an extra unknown, the
+# equations become linear). Falls back to the weighted centroid of the anchors
+# where the anchors are degenerate (e.g., collinear)
+def get_linearized_positions(
+    anchor_positions,
+    distances,
+    weights,
+    usable):
+    num_epochs, max_anchors, dimensions = anchor_positions.shape
+    # Rows [-2 a, 1] . [p, |p|^2] = d^2 - |a|^2
+    design = np.concatenate(
+        [-2.0*anchor_positions, np.ones((num_epochs, max_anchors, 1))],
+        axis=2)
+    targets = distances**2 - np.sum(anchor_positions**2, axis=2)
+    weighted_design = design*weights[:, :, np.newaxis]
+    normal_matrices = np.einsum('emi,emj->eij', weighted_design, design)
+    normal_targets = np.einsum('emi,em->ei', weighted_design, targets)
+    solutions = np.einsum('eij,ej->ei', np.linalg.pinv(normal_matrices), normal_targets)[:, :dimensions]
+    centroids = np.sum(anchor_positions*weights[:, :, np.newaxis], axis=1)/np.sum(weights, axis=1)[:, np.newaxis]
+    condition_numbers = np.linalg.cond(normal_matrices)
+    degenerate = ~np.isfinite(condition_numbers) | (condition_numbers > 1e12) | ~np.all(np.isfinite(solutions), axis=1)
+    solutions[degenerate] = centroids[degenerate]
+    return solutions
+
+# Function for refining positions by damped Gauss-Newton iterations on the
+# weighted range residuals. Only epochs which have not yet converged (moved
+# less than tolerance in an iteration) are iterated. Returns a tuple
+# (positions, iterations, converged)
+def refine_positions(
+    positions,
+    anchor_positions,
+    distances,
+    weights,
+    max_iterations,
+    tolerance,
+    damping):
+    positions = positions.copy()
+    num_epochs, dimensions = positions.shape
+    iterations = np.zeros(num_epochs, dtype=np.int32)
+    converged = np.zeros(num_epochs, dtype=bool)
+    active = np.arange(num_epochs)
+    identity = np.eye(dimensions)
+    for iteration_index in range(max_iterations):
+        if len(active) == 0:
+            break
+        offsets = positions[active, np.newaxis, :] - anchor_positions[active]
+        ranges = np.maximum(np.linalg.norm(offsets, axis=2), 1e-6)
+        active_residuals = distances[active] - ranges
+        jacobians = offsets/ranges[:, :, np.newaxis]
+        weighted_jacobians = jacobians*weights[active][:, :, np.newaxis]
+        normal_matrices = np.einsum('emi,emj->eij', weighted_jacobians, jacobians)
+        gradients = np.einsum('emi,em->ei', weighted_jacobians, active_residuals)
+        diagonal_scale = np.trace(normal_matrices, axis1=1, axis2=2)/dimensions
+        normal_matrices += (damping*diagonal_scale + 1e-9)[:, np.newaxis, np.newaxis]*identity
+        steps = np.linalg.solve(normal_matrices, gradients[:, :, np.newaxis])[:, :, 0]
+        positions[active] += steps
+        iterations[active] += 1
+        step_converged = np.linalg.norm(steps, axis=1) < tolerance
+        converged[active[step_converged]] = True
+        active = active[~step_converged]
+    return positions, iterations, converged
+
+# Function for arranging distance records (a structured array of
+# decawave_ble.batch.DISTANCE_ARRAY_DTYPE, as returned by
+# decawave_ble.batch.parse_location_data_frames) into padded arrays with one
+# row per frame, looking up anchor positions in anchor_index. Distances with
+# quality below min_quality or from anchors not in the index are marked
+# invalid. Returns a tuple (frame_indices, anchor_positions, distances,
+# qualities, valid)
+def get_distance_matrices(
+    distance_records,
+    anchor_index,
+    min_quality = 0):
+    order = np.argsort(distance_records['frame_index'], kind='stable')
+    distance_records = distance_records[order]
+    frame_indices, first_record_indices, distance_counts = np.unique(
+        distance_records['frame_index'],
+        return_index=True,
+        return_counts=True)
+    num_frames = len(frame_indices)
+    max_anchors = int(np.max(distance_counts)) if num_frames > 0 else 0
+    rows = np.repeat(np.arange(num_frames), distance_counts)
+    columns = np.arange(len(distance_records)) - np.repeat(first_record_indices, distance_counts)
+    record_anchor_positions, found = anchor_index.lookup(distance_records['node_id'])
+    anchor_positions = np.full((num_frames, max_anchors, 3), np.nan)
+    anchor_positions[rows, columns] = record_anchor_positions
+    distances = np.full((num_frames, max_anchors), np.nan)
+    distances[rows, columns] = distance_records['distance']
+    qualities = np.zeros((num_frames, max_anchors), dtype=np.float64)
+    qualities[rows, columns] = distance_records['quality']
+    valid = np.zeros((num_frames, max_anchors), dtype=bool)
+    valid[rows, columns] = found & (distance_records['quality'] >= min_quality)
+    return frame_indices, anchor_positions, distances, qualities, valid
+
+# Function for solving positions from distance records (see
+# get_distance_matrices). Distances are weighted by quality unless
+# quality_weighting is False. Returns a tuple (solutions, residuals), where
+# solutions is a structured array of SOLUTION_ARRAY_DTYPE (one row per frame
+# with distances) and residuals has one row per solution and one column per
+# distance in the frame (in the order of the distance records)
+def multilaterate_distances(
+    distance_records,
+    anchor_index,
+    min_quality = 1,
+    quality_weighting = True,
+    **solve_kwargs):
+    frame_indices, anchor_positions, distances, qualities, valid = get_distance_matrices(
+        distance_records,
+        anchor_index,
+        min_quality)
+    weights = qualities/100.0 if quality_weighting else None
+    frame_solutions, residuals = solve_positions(
+        anchor_positions,
+        distances,
+        weights = weights,
+        valid = valid,
+        **solve_kwargs)
+    solutions = np.empty(len(frame_indices), dtype=SOLUTION_ARRAY_DTYPE)
+    solutions['frame_index'] = frame_indices
+    for field_name in SOLUTION_DTYPE.names:
+        solutions[field_name] = frame_solutions[field_name]
+    return solutions, residuals
+
+# Function for solving positions from location data payloads (bytes-like
+# objects, e.g., from a capture file). See multilaterate_distances
+def multilaterate_location_data_frames(
+    location_data_frames,
+    anchor_index,
+    **kwargs):
+    positions, distance_records = decawave_ble.batch.parse_location_data_frames(location_data_frames)
+    return multilaterate_distances(
+        distance_records,
+        anchor_index,
+        **kwargs)
+
+# Function for solving positions from parsed location data (a list of
+# dictionaries as returned by decawave_ble.parse_location_data_bytes, or
+# decawave_ble.records.LocationData). See multilaterate_distances
+def multilaterate_location_data(
+    location_data_list,
+    anchor_index,
+    **kwargs):
+    distance_values = []
+    for frame_index, location_data in enumerate(location_data_list):
+        location_data = decawave_ble.records.to_dict(location_data)
+        if location_data['distance_data'] is None:
+            continue
+        for distance_datum in location_data['distance_data']:
+            distance_values.append((
+                frame_index,
+                distance_datum['node_id'],
+                distance_datum['distance'],
+                distance_datum['quality']))
+    distance_records = np.array(distance_values, dtype=decawave_ble.batch.DISTANCE_ARRAY_DTYPE)
+    return multilaterate_distances(
+        distance_records,
+        anchor_index,
+        **kwargs)
@@ -0,0 +1,484 @@
+import decawave_ble.codecs
+import array
+
+# Compact record types for Decawave data. The parse_*_bytes functions in
+# decawave_ble.codecs return nested dictionaries (one per distance or proxy
+# position), which adds up when a long-running collector keeps history for
+# many tags. These classes hold the same values in __slots__ attributes, and
+# distance and proxy position lists are stored column-wise in typed arrays.
+# Each record has a to_dict() which returns exactly what the corresponding
+# parse_*_bytes function returns, so JSON output is unchanged (see
+# decawave_ble.CustomJSONEncoder), and a from_dict() for converting existing
+# data
+
+# Base class for records. Fields are the names in __slots__
+class Record:
+    __slots__ = ()
+
+    def to_dict(self):
+        return {field_name: getattr(self, field_name) for field_name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data is None:
+            return None
+        return cls(**{field_name: data[field_name] for field_name in cls.__slots__})
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field_name) == getattr(other, field_name) for field_name in self.__slots__)
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join('{}={!r}'.format(field_name, getattr(self, field_name)) for field_name in self.__slots__))
+
+# Class to represent operation mode data
+class OperationModeData(Record):
+    __slots__ = (
+        'device_type',
+        'uwb_mode',
+        'fw_version',
+        'accelerometer_enable',
+        'led_enable',
+        'fw_update_enable',
+        'reserved_01',
+        'initiator',
+        'low_power_mode',
+        'location_engine',
+        'reserved_02')
+
+    def __init__(
+        self,
+        device_type,
+        uwb_mode,
+        fw_version,
+        accelerometer_enable,
+        led_enable,
+        fw_update_enable,
+        reserved_01,
+        initiator,
+        low_power_mode,
+        location_engine,
+        reserved_02):
+        self.device_type = device_type
+        self.uwb_mode = uwb_mode
+        self.fw_version = fw_version
+        self.accelerometer_enable = accelerometer_enable
+        self.led_enable = led_enable
+        self.fw_update_enable = fw_update_enable
+        self.reserved_01 = reserved_01
+        self.initiator = initiator
+        self.low_power_mode = low_power_mode
+        self.location_engine = location_engine
+        self.reserved_02 = reserved_02
+
+    @property
+    def device_type_name(self):
+        return decawave_ble.codecs.DEVICE_TYPE_NAMES[self.device_type]
+
+    @property
+    def uwb_mode_name(self):
+        return decawave_ble.codecs.UWB_MODE_NAMES[self.uwb_mode]
+
+    @property
+    def fw_version_name(self):
+        return decawave_ble.codecs.FW_VERSION_NAMES[self.fw_version]
+
+    def to_dict(self):
+        operation_mode_data = Record.to_dict(self)
+        operation_mode_data['device_type_name'] = self.device_type_name
+        operation_mode_data['uwb_mode_name'] = self.uwb_mode_name
+        operation_mode_data['fw_version_name'] = self.fw_version_name
+        return operation_mode_data
+
+# Class to represent location data mode data
+class LocationDataModeData(Record):
+    __slots__ = ('location_data_mode',)
+
+    def __init__(
+        self,
+        location_data_mode):
+        self.location_data_mode = location_data_mode
+
+    @property
+    def location_data_mode_name(self):
+        return decawave_ble.codecs.LOCATION_DATA_MODE_NAMES[self.location_data_mode]
+
+    def to_dict(self):
+        return {
+            'location_data_mode': self.location_data_mode,
+            'location_data_mode_name': self.location_data_mode_name}
+
+# Class to represent a position (location data or persisted position)
+class PositionData(Record):
+    __slots__ = (
+        'x_position',
+        'y_position',
+        'z_position',
+        'quality')
+
+    def __init__(
+        self,
+        x_position,
+        y_position,
+        z_position,
+        quality):
+        self.x_position = x_position
+        self.y_position = y_position
+        self.z_position = z_position
+        self.quality = quality
+
+# Class to represent a single distance measurement
+class DistanceData(Record):
+    __slots__ = (
+        'node_id',
+        'distance',
+        'quality')
+
+    def __init__(
+        self,
+        node_id,
+        distance,
+        quality):
+        self.node_id = node_id
+        self.distance = distance
+        self.quality = quality
+
+# Class to represent the position of another node as reported by a device
+class ProxyPositionData(Record):
+    __slots__ = (
+        'node_id',
+        'x_position',
+        'y_position',
+        'z_position',
+        'quality')
+
+    def __init__(
+        self,
+        node_id,
+        x_position,
+        y_position,
+        z_position,
+        quality):
+        self.node_id = node_id
+        self.x_position = x_position
+        self.y_position = y_position
+        self.z_position = z_position
+        self.quality = quality
+
+# Class to represent device info data
+class DeviceInfoData(Record):
+    __slots__ = (
+        'node_id',
+        'hw_version',
+        'fw1_version',
+        'fw2_version',
+        'fw1_checksum',
+        'fw2_checksum',
+        'bridge',
+        'unknown')
+
+    def __init__(
+        self,
+        node_id,
+        hw_version,
+        fw1_version,
+        fw2_version,
+        fw1_checksum,
+        fw2_checksum,
+        bridge,
+        unknown):
+        self.node_id = node_id
+        self.hw_version = hw_version
+        self.fw1_version = fw1_version
+        self.fw2_version = fw2_version
+        self.fw1_checksum = fw1_checksum
+        self.fw2_checksum = fw2_checksum
+        self.bridge = bridge
+        self.unknown = unknown
+
+# Class to represent update rate data
+class UpdateRateData(Record):
+    __slots__ = (
+        'moving_update_rate',
+        'stationary_update_rate')
+
+    def __init__(
+        self,
+        moving_update_rate,
+        stationary_update_rate):
+        self.moving_update_rate = moving_update_rate
+        self.stationary_update_rate = stationary_update_rate
+
+# Base class for lists of records stored column-wise in typed arrays. Each
+# field in __slots__ is stored in an array with the matching typecode in
+# typecodes. Items are returned as instances of record_class
+class RecordList:
+    __slots__ = ()
+    record_class = None
+    typecodes = ()
+
+    def __init__(self, records = None):
+        for field_name, typecode in zip(self.__slots__, self.typecodes):
+            setattr(self, field_name, array.array(typecode))
+        if records is not None:
+            self.extend(records)
+
+    def __len__(self):
+        return len(getattr(self, self.__slots__[0]))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)(self[item_index] for item_index in range(*index.indices(len(self))))
+        return self.record_class(*[getattr(self, field_name)[index] for field_name in self.__slots__])
+
+    def __iter__(self):
+        for values in zip(*[getattr(self, field_name) for field_name in self.__slots__]):
+            yield self.record_class(*values)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field_name) == getattr(other, field_name) for field_name in self.__slots__)
+
+    def __repr__(self):
+        return '{}({!r})'.format(
+            type(self).__name__,
+            list(self))
+
+    def append(self, record):
+        for field_name in self.__slots__:
+            getattr(self, field_name).append(getattr(record, field_name))
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    # Function for appending field values in bulk (e.g., tuples from
+    # struct.iter_unpack), in the order of __slots__
+    def extend_values(self, values):
+        columns = list(zip(*values))
+        if len(columns) == 0:
+            return
+        for field_name, column in zip(self.__slots__, columns):
+            getattr(self, field_name).extend(column)
+
+    def to_dict(self):
+        return [record.to_dict() for record in self]
+
+    @classmethod
+    def from_dict(cls, data):
+        if data is None:
+            return None
+        return cls(cls.record_class.from_dict(datum) for datum in data)
+
+# Class to represent a list of distance measurements
+class DistanceList(RecordList):
+    __slots__ = (
+        'node_id',
+        'distance',
+        'quality')
+    record_class = DistanceData
+    typecodes = ('H', 'I', 'B')
+
+# Class to represent a list of proxy positions
+class ProxyPositionList(RecordList):
+    __slots__ = (
+        'node_id',
+        'x_position',
+        'y_position',
+        'z_position',
+        'quality')
+    record_class = ProxyPositionData
+    typecodes = ('H', 'i', 'i', 'i', 'B')
+
+# Class to represent location data
+class LocationData(Record):
+    __slots__ = (
+        'location_data_content',
+        'position_data',
+        'distance_data')
+
+    def __init__(
+        self,
+        location_data_content,
+        position_data,
+        distance_data):
+        self.location_data_content = location_data_content
+        self.position_data = position_data
+        self.distance_data = distance_data
+
+    @property
+    def location_data_content_name(self):
+        if self.location_data_content is None:
+            return None
+        return decawave_ble.codecs.LOCATION_DATA_CONTENT_NAMES[self.location_data_content]
+
+    def to_dict(self):
+        return {
+            'location_data_content': self.location_data_content,
+            'location_data_content_name': self.location_data_content_name,
+            'position_data': to_dict(self.position_data),
+            'distance_data': to_dict(self.distance_data)}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data is None:
+            return None
+        return cls(
+            data['location_data_content'],
+            PositionData.from_dict(data['position_data']),
+            DistanceList.from_dict(data['distance_data']))
+
+# Class to represent a complete set of data from a device (see
+# decawave_ble.get_data). Anchor lists are stored as arrays of node IDs
+class DeviceData(Record):
+    __slots__ = (
+        'device_name',
+        'scan_data',
+        'operation_mode_data',
+        'device_info_data',
+        'network_id',
+        'location_data_mode_data',
+        'location_data',
+        'proxy_positions_data',
+        'anchor_list_data',
+        'update_rate_data')
+    field_classes = {
+        'operation_mode_data': OperationModeData,
+        'device_info_data': DeviceInfoData,
+        'location_data_mode_data': LocationDataModeData,
+        'location_data': LocationData,
+        'proxy_positions_data': ProxyPositionList,
+        'update_rate_data': UpdateRateData}
+
+    def __init__(
+        self,
+        device_name = None,
+        scan_data = None,
+        operation_mode_data = None,
+        device_info_data = None,
+        network_id = None,
+        location_data_mode_data = None,
+        location_data = None,
+        proxy_positions_data = None,
+        anchor_list_data = None,
+        update_rate_data = None):
+        self.device_name = device_name
+        self.scan_data = scan_data
+        self.operation_mode_data = operation_mode_data
+        self.device_info_data = device_info_data
+        self.network_id = network_id
+        self.location_data_mode_data = location_data_mode_data
+        self.location_data = location_data
+        self.proxy_positions_data = proxy_positions_data
+        self.anchor_list_data = anchor_list_data
+        self.update_rate_data = update_rate_data
+
+    def to_dict(self):
+        data = {}
+        for field_name in self.__slots__:
+            value = getattr(self, field_name)
+            if field_name == 'anchor_list_data' and value is not None:
+                value = list(value)
+            data[field_name] = to_dict(value)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if data is None:
+            return None
+        device_data = cls()
+        for field_name in cls.__slots__:
+            value = data.get(field_name)
+            if field_name in cls.field_classes:
+                value = cls.field_classes[field_name].from_dict(value)
+            elif field_name == 'anchor_list_data' and value is not None:
+                value = array.array('H', value)
+            setattr(device_data, field_name, value)
+        return device_data
+
+# Function for converting a record (or None) to its dictionary form
+def to_dict(value):
+    if isinstance(value, (Record, RecordList)):
+        return value.to_dict()
+    return value
+
+# Functions for parsing characteristic values directly into records
+def parse_operation_mode_record(operation_mode_bytes):
+    return OperationModeData(*decawave_ble.codecs.OPERATION_MODE_FORMAT.unpack(operation_mode_bytes).values())
+
+def parse_location_data_mode_record(location_data_mode_bytes):
+    return LocationDataModeData(location_data_mode_bytes[0])
+
+def parse_location_data_record(location_data_bytes):
+    location_data_view = memoryview(location_data_bytes)
+    num_bytes = len(location_data_view)
+    if num_bytes == 0:
+        return LocationData(None, None, None)
+    location_data_content = location_data_view[0]
+    if location_data_content >= len(decawave_ble.codecs.LOCATION_DATA_CONTENT_NAMES):
+        raise ValueError('Location data content byte {} not recognized'.format(location_data_content))
+    offset = 1
+    position_data = None
+    distance_data = None
+    if (location_data_content == 0 or location_data_content == 2):
+        if num_bytes - offset < decawave_ble.codecs.POSITION_SIZE:
+            raise ValueError('Location data content byte indicated position data was included but less than 13 bytes follow')
+        position_data = PositionData(*decawave_ble.codecs.POSITION_STRUCT.unpack_from(location_data_view, offset))
+        offset += decawave_ble.codecs.POSITION_SIZE
+    if (location_data_content == 1 or location_data_content == 2):
+        if num_bytes - offset < 1:
+            raise ValueError('Location data content byte indicated distance data was included but no bytes follow')
+        distance_count = location_data_view[offset]
+        offset += 1
+        if num_bytes - offset < decawave_ble.codecs.DISTANCE_SIZE*distance_count:
+            raise ValueError('Distance count byte indicated that {} distance values would follow so expected {} bytes but only {} bytes follow'.format(
+                distance_count,
+                decawave_ble.codecs.DISTANCE_SIZE*distance_count,
+                num_bytes - offset))
+        distance_data = DistanceList()
+        distance_data.extend_values(decawave_ble.codecs.DISTANCE_STRUCT.iter_unpack(
+            location_data_view[offset:offset + decawave_ble.codecs.DISTANCE_SIZE*distance_count]))
+    return LocationData(
+        location_data_content,
+        position_data,
+        distance_data)
+
+def parse_proxy_positions_record(proxy_positions_bytes):
+    if len(proxy_positions_bytes) == 0:
+        return None
+    proxy_positions_view = memoryview(proxy_positions_bytes)
+    num_elements = proxy_positions_view[0]
+    if len(proxy_positions_view) < 1 + decawave_ble.codecs.PROXY_POSITION_SIZE*num_elements:
+        raise ValueError('Count byte indicated that {} proxy positions would follow so expected {} bytes but only {} bytes follow'.format(
+            num_elements,
+            decawave_ble.codecs.PROXY_POSITION_SIZE*num_elements,
+            len(proxy_positions_view) - 1))
+    proxy_positions_data = ProxyPositionList()
+    proxy_positions_data.extend_values(decawave_ble.codecs.PROXY_POSITION_STRUCT.iter_unpack(
+        proxy_positions_view[1:1 + decawave_ble.codecs.PROXY_POSITION_SIZE*num_elements]))
+    return proxy_positions_data
+
+def parse_device_info_record(device_info_bytes):
+    return DeviceInfoData.from_dict(decawave_ble.codecs.parse_device_info_bytes(device_info_bytes))
+
+def parse_anchor_list_record(anchor_list_bytes):
+    if len(anchor_list_bytes) == 0:
+        return None
+    num_elements = anchor_list_bytes[0]
+    if len(anchor_list_bytes) < 1 + decawave_ble.codecs.NODE_ID_STRUCT.size*num_elements:
+        raise ValueError('Count byte indicated that {} anchors would follow so expected {} bytes but only {} bytes follow'.format(
+            num_elements,
+            decawave_ble.codecs.NODE_ID_STRUCT.size*num_elements,
+            len(anchor_list_bytes) - 1))
+    anchor_list_data = array.array('H')
+    for node_id, in decawave_ble.codecs.NODE_ID_STRUCT.iter_unpack(
+        memoryview(anchor_list_bytes)[1:1 + decawave_ble.codecs.NODE_ID_STRUCT.size*num_elements]):
+        anchor_list_data.append(node_id)
+    return anchor_list_data
+
+def parse_update_rate_record(update_rate_bytes):
+    return UpdateRateData(*decawave_ble.codecs.UPDATE_RATE_STRUCT.unpack_from(update_rate_bytes))
@@ -0,0 +1,274 @@
+import decawave_ble
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY_PATH = os.path.join(
+    os.path.expanduser('~'),
+    '.cache',
+    'decawave_ble',
+    'device_registry.json')
+
+# Number of seconds after which a device that has not been seen is dropped
+# from the registry
+default_ttl = 7*24*60*60
+
+# Number of seconds after which find_decawave_devices runs a full scan (rather
+# than trusting the registry) so that newly deployed devices are found
+default_full_scan_interval = 24*60*60
+
+# Version of the registry file format. Version 1 files (a dictionary of
+# entries keyed by device name) are still read, but record no full scan
+REGISTRY_FORMAT_VERSION = 2
+
+# Class to represent an on-disk registry of known Decawave devices (scan data,
+# time last seen and node ID, keyed by device name) so that devices can be
+# connected to by address without scanning first. The time of the last full
+# scan is also kept, so that a full scan can be run every full_scan_interval
+# seconds (see find_decawave_devices)
+class DecawaveDeviceRegistry:
+    def __init__(
+        self,
+        path = None,
+        ttl = None,
+        full_scan_interval = None):
+        if path is None:
+            path = os.environ.get('DECAWAVE_DEVICE_REGISTRY_PATH', DEFAULT_REGISTRY_PATH)
+        if ttl is None:
+            ttl = default_ttl
+        if full_scan_interval is None:
+            full_scan_interval = default_full_scan_interval
+        self.path = path
+        self.ttl = ttl
+        self.full_scan_interval = full_scan_interval
+        self.entries, self.last_full_scan = self.load()
+
+    # Function for loading the registry file. Returns the entries and the time
+    # of the last full scan (None if unknown)
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                registry_data = json.load(file)
+        except FileNotFoundError:
+            return {}, None
+        except ValueError as e:
+            logger.warning('Ignoring unreadable device registry {}: {}'.format(self.path, repr(e)))
+            return {}, None
+        if registry_data.get('version') != REGISTRY_FORMAT_VERSION:
+            return registry_data, None
+        return registry_data['devices'], registry_data.get('last_full_scan')
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(
+                {
+                    'version': REGISTRY_FORMAT_VERSION,
+                    'last_full_scan': self.last_full_scan,
+                    'devices': self.entries},
+                file,
+                cls=decawave_ble.CustomJSONEncoder,
+                indent=2)
+        os.replace(temporary_path, self.path)
+
+    def is_expired(self, entry):
+        return time.time() - entry['last_seen'] > self.ttl
+
+    def is_full_scan_due(self):
+        return (
+            self.last_full_scan is None or
+            time.time() - self.last_full_scan >= self.full_scan_interval)
+
+    def get_device_names(self):
+        return [device_name for device_name, entry in self.entries.items() if not self.is_expired(entry)]
+
+    def get_devices(self, device_names = None):
+        if device_names is None:
+            device_names = self.get_device_names()
+        decawave_devices = {}
+        for device_name in device_names:
+            entry = self.entries.get(device_name)
+            if entry is None or self.is_expired(entry):
+                continue
+            decawave_devices[device_name] = decawave_ble.DecawaveDevice.from_scan_data(entry['scan_data'])
+        return decawave_devices
+
+    def get_node_id(self, device_name):
+        entry = self.entries.get(device_name)
+        if entry is None:
+            return None
+        return entry.get('node_id')
+
+    def update_from_devices(self, decawave_devices):
+        for device_name, decawave_device in decawave_devices.items():
+            entry = self.entries.get(device_name, {})
+            scan_data = decawave_device.scan_data()
+            if entry.get('scan_data', {}).get('mac_address') != scan_data['mac_address']:
+                entry['node_id'] = None
+            entry['scan_data'] = scan_data
+            entry['last_seen'] = time.time()
+            self.entries[device_name] = entry
+
+    # Function for updating the registry after reading data from devices (the
+    # devices have been seen, and their node IDs are recorded if device info
+    # data was read)
+    def update_from_data(self, data_multiple):
+        for device_name, data in data_multiple.items():
+            entry = self.entries.get(device_name)
+            if entry is None:
+                continue
+            device_info_data = data.get('device_info_data')
+            if device_info_data is not None:
+                entry['node_id'] = device_info_data['node_id']
+        self.mark_seen(data_multiple.keys())
+
+    # Function for recording that devices have just been connected to
+    def mark_seen(self, device_names):
+        for device_name in device_names:
+            entry = self.entries.get(device_name)
+            if entry is not None:
+                entry['last_seen'] = time.time()
+
+    def remove(self, device_names):
+        for device_name in device_names:
+            self.entries.pop(device_name, None)
+
+    def remove_expired(self):
+        expired_device_names = [device_name for device_name, entry in self.entries.items() if self.is_expired(entry)]
+        self.remove(expired_device_names)
+
+# Function for finding Decawave devices using the registry. Devices in the
+# registry are returned without scanning. If device_names is specified, a
+# scan runs only for devices that are not in the registry (and stops as soon
+# as they have all been found). If device_names is not specified, all devices
+# in the registry are returned, unless the registry is empty or a full scan
+# is due (see DecawaveDeviceRegistry.is_full_scan_due), in which case the
+# devices found by a full scan are returned instead. Only the devices which
+# were scanned are marked as seen (devices taken from the registry are marked
+# once they have been connected to; see update_from_data and mark_seen). The
+# registry is updated and saved. A full scan only runs when device_names is
+# not specified, i.e., when reading data from all devices (configuration
+# always names its target devices)
+def find_decawave_devices(
+    registry,
+    device_names = None,
+    scan_timeout = 10.0):
+    registry.remove_expired()
+    if device_names is None:
+        decawave_devices = registry.get_devices()
+        if len(decawave_devices) > 0 and not registry.is_full_scan_due():
+            logger.info('Found {} Decawave devices in registry'.format(len(decawave_devices)))
+            return decawave_devices
+        if len(decawave_devices) == 0:
+            logger.info('Registry is empty. Scanning for Decawave devices')
+        else:
+            logger.info('Full scan is due. Scanning for Decawave devices')
+        decawave_devices = decawave_ble.scan_for_decawave_devices(timeout = scan_timeout)
+        registry.last_full_scan = time.time()
+        registry.update_from_devices(decawave_devices)
+    else:
+        decawave_devices = registry.get_devices(device_names)
+        missing_device_names = [device_name for device_name in device_names if device_name not in decawave_devices]
+        logger.info('Found {} of {} Decawave devices in registry'.format(
+            len(decawave_devices),
+            len(device_names)))
+        if len(missing_device_names) > 0:
+            logger.info('Scanning for {}'.format(missing_device_names))
+            scanned_decawave_devices = decawave_ble.scan_for_decawave_devices(
+                timeout = scan_timeout,
+                device_names = missing_device_names)
+            registry.update_from_devices(scanned_decawave_devices)
+            decawave_devices.update(scanned_decawave_devices)
+            decawave_devices = {device_name: decawave_devices[device_name] for device_name in device_names if device_name in decawave_devices}
+    registry.save()
+    return decawave_devices
+
+# Function for rescanning for devices (e.g., because connecting to the
+# address in the registry failed). Returns the devices that were found and
+# updates and saves the registry
+def rescan_decawave_devices(
+    registry,
+    device_names,
+    scan_timeout = 10.0):
+    logger.info('Scanning for {}'.format(list(device_names)))
+    decawave_devices = decawave_ble.scan_for_decawave_devices(
+        timeout = scan_timeout,
+        device_names = device_names)
+    registry.update_from_devices(decawave_devices)
+    registry.save()
+    return decawave_devices
+
+# Function for getting data from multiple devices using the registry. Devices
+# are found with find_decawave_devices and read (concurrently if concurrent is
+# True). Devices taken from the registry that fail are rescanned and read once
+# more. If reading concurrently, devices that still fail are left out of the
+# returned dictionary and their exceptions are added to errors (if a
+# dictionary is supplied); otherwise the first device that still fails
+# raises, as with decawave_ble.get_data_multiple_devices. If fields is
+# specified, only those fields are read (see decawave_ble.get_data)
+def get_data_multiple_devices(
+    registry,
+    device_names = None,
+    scan_timeout = 10.0,
+    max_connections_per_interface = None,
+    errors = None,
+    fields = None,
+    concurrent = False):
+    decawave_devices = find_decawave_devices(
+        registry,
+        device_names,
+        scan_timeout)
+    if not concurrent:
+        data_multiple = {}
+        for device_name, decawave_device in decawave_devices.items():
+            logger.info('Getting data for {}'.format(device_name))
+            try:
+                data_multiple[device_name] = decawave_ble.get_data(decawave_device, fields = fields)
+            except Exception:
+                rescanned_decawave_devices = rescan_decawave_devices(
+                    registry,
+                    [device_name],
+                    scan_timeout)
+                if device_name not in rescanned_decawave_devices:
+                    raise
+                logger.info('Retrying {} after rescan'.format(device_name))
+                data_multiple[device_name] = decawave_ble.get_data(
+                    rescanned_decawave_devices[device_name],
+                    fields = fields)
+        registry.update_from_data(data_multiple)
+        registry.save()
+        return data_multiple
+    device_errors = {}
+    data_multiple = decawave_ble.get_data_multiple_devices(
+        decawave_devices,
+        concurrent = True,
+        max_connections_per_interface = max_connections_per_interface,
+        errors = device_errors,
+        fields = fields)
+    if len(device_errors) > 0:
+        rescanned_decawave_devices = rescan_decawave_devices(
+            registry,
+            list(device_errors.keys()),
+            scan_timeout)
+        for device_name, decawave_device in rescanned_decawave_devices.items():
+            if device_name not in device_errors:
+                continue
+            logger.info('Retrying {} after rescan'.format(device_name))
+            try:
+                data_multiple[device_name] = decawave_ble.get_data(decawave_device, fields = fields)
+            except Exception as e:
+                device_errors[device_name] = e
+            else:
+                del device_errors[device_name]
+        data_multiple = {device_name: data_multiple[device_name] for device_name in decawave_devices.keys() if device_name in data_multiple}
+    if errors is not None:
+        errors.update(device_errors)
+    registry.update_from_data(data_multiple)
+    registry.save()
+    return data_multiple
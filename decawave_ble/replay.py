@@ -0,0 +1,95 @@
+import decawave_ble
+import decawave_ble.capture
+import decawave_ble.records
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Replay of capture files (see decawave_ble.capture). Records are read lazily
+# from the memory-mapped file and decoded with the same parse_*_bytes functions
+# used for live data, so whole captures never need to be loaded into memory.
+# Records can be paced in real time (speed = 1.0), accelerated (speed > 1.0) or
+# delivered as fast as possible (speed = None)
+
+# Function for replaying records from a capture file. Yields dictionaries
+# with keys device_name, timestamp, monotonic_time, characteristic_uuid and data
+# (parsed unless parse is False). Pacing follows the recorded UTC timestamps
+# divided by speed. If max_gap is specified, gaps between records longer than
+# max_gap seconds (of recorded time) are shortened to max_gap
+def replay_capture(
+    path,
+    speed = 1.0,
+    start_time = None,
+    end_time = None,
+    device_names = None,
+    characteristic_uuids = None,
+    parse = True,
+    max_gap = None):
+    if speed is not None and speed <= 0:
+        raise ValueError('Replay speed must be positive')
+    with decawave_ble.capture.CaptureReader(path) as capture_reader:
+        logger.info('Replaying {} records from {}'.format(capture_reader.num_records, path))
+        replay_start_time = None
+        previous_timestamp = None
+        recorded_elapsed_time = 0.0
+        for record in capture_reader.read(
+            start_time = start_time,
+            end_time = end_time,
+            device_names = device_names,
+            characteristic_uuids = characteristic_uuids,
+            parse = parse):
+            if speed is not None:
+                if replay_start_time is None:
+                    replay_start_time = time.monotonic()
+                else:
+                    gap = max(record['timestamp'] - previous_timestamp, 0.0)
+                    if max_gap is not None:
+                        gap = min(gap, max_gap)
+                    recorded_elapsed_time += gap
+                    delay = replay_start_time + recorded_elapsed_time/speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                previous_timestamp = record['timestamp']
+            yield record
+
+# Function for replaying location data from a capture file in the same form as
+# decawave_ble.stream_location_data (records with keys device_name, timestamp
+# and location_data), so that consumers of live data can be run against
+# recorded sessions. If records is True, location data is returned as
+# decawave_ble.records.LocationData
+def replay_location_data(
+    path,
+    speed = 1.0,
+    start_time = None,
+    end_time = None,
+    device_names = None,
+    records = False,
+    max_gap = None):
+    if records:
+        parse_function = decawave_ble.records.parse_location_data_record
+    else:
+        parse_function = decawave_ble.parse_location_data_bytes
+    for record in replay_capture(
+        path,
+        speed = speed,
+        start_time = start_time,
+        end_time = end_time,
+        device_names = device_names,
+        characteristic_uuids = [decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID],
+        parse = False,
+        max_gap = max_gap):
+        yield {
+            'device_name': record['device_name'],
+            'timestamp': record['timestamp'],
+            'location_data': parse_function(record['data'])}
+
+# Function for passing replayed location data records to a callback (see
+# replay_location_data)
+def subscribe_replayed_location_data(
+    path,
+    callback,
+    speed = 1.0,
+    records = False):
+    for record in replay_location_data(path, speed, records = records):
+        callback(record)
@@ -0,0 +1,261 @@
+import decawave_ble.metrics
+import random
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Kinds of failure (see RetryPolicy.classify)
+DISCONNECT = 'disconnect'
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+# Class to represent how failed BLE operations are retried. Retries happen at
+# one layer only: around a whole operation on a device (connect, then one or
+# more reads/writes), never inside it, so the number of attempts is bounded by
+# max_attempts however deeply the operation calls other functions. Failures
+# are classified (see classify):
+#
+# - disconnect: the link is dead, so the connection is dropped and a new one
+#   is opened before the operation is tried again
+# - transient: the link is still up (e.g., a GATT error), so the operation is
+#   tried again on the same connection
+# - fatal: anything else (e.g., a ValueError from checking a configuration)
+#   is raised at once
+#
+# The wait before attempt n + 1 is initial_wait*backoff**(n - 1) seconds (no
+# more than max_wait), randomized by +/- jitter (as a fraction). No attempt is
+# started after deadline seconds (if not None) from the start of the
+# operation; a TimeoutError is raised instead. If disconnect_exceptions or
+# transient_exceptions is None, the exceptions of the BLE transport in use at
+# the time of the failure are used (see decawave_ble.transport), so that
+# bluepy is only imported when a failure is classified with bluepy in use.
+# If metrics is False, the operations run are not recorded (see
+# record_metrics)
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts = 3,
+        initial_wait = 0.1,
+        backoff = 2.0,
+        max_wait = 2.0,
+        jitter = 0.1,
+        deadline = 30.0,
+        disconnect_exceptions = None,
+        transient_exceptions = None,
+        metrics = True):
+        if max_attempts < 1:
+            raise ValueError('Maximum number of attempts must be at least 1')
+        self.max_attempts = max_attempts
+        self.initial_wait = initial_wait
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.deadline = deadline
+        self.disconnect_exceptions = None if disconnect_exceptions is None else tuple(disconnect_exceptions)
+        self.transient_exceptions = None if transient_exceptions is None else tuple(transient_exceptions)
+        self.metrics = metrics
+
+    def __repr__(self):
+        return 'RetryPolicy(max_attempts={}, initial_wait={}, backoff={}, max_wait={}, jitter={}, deadline={})'.format(
+            self.max_attempts,
+            self.initial_wait,
+            self.backoff,
+            self.max_wait,
+            self.jitter,
+            self.deadline)
+
+    def classify(self, exception):
+        disconnect_exceptions = self.disconnect_exceptions
+        transient_exceptions = self.transient_exceptions
+        if disconnect_exceptions is None or transient_exceptions is None:
+            transport = decawave_ble.get_transport()
+            if disconnect_exceptions is None:
+                disconnect_exceptions = (transport.BTLEDisconnectError, BrokenPipeError)
+            if transient_exceptions is None:
+                transient_exceptions = (transport.BTLEException,)
+        if isinstance(exception, disconnect_exceptions):
+            return DISCONNECT
+        if isinstance(exception, transient_exceptions):
+            return TRANSIENT
+        return FATAL
+
+    def get_wait(self, attempt):
+        wait = min(self.initial_wait*self.backoff**(attempt - 1), self.max_wait)
+        if self.jitter > 0:
+            wait *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(wait, 0.0)
+
+    def get_deadline_time(self):
+        if self.deadline is None:
+            return None
+        return time.monotonic() + self.deadline
+
+    # Function for deciding what to do after a failed attempt. Returns the
+    # kind of failure and the number of seconds to wait, or raises if the
+    # operation should not be tried again
+    def handle_failure(
+        self,
+        exception,
+        attempt,
+        deadline_time,
+        description):
+        kind = self.classify(exception)
+        if kind == FATAL:
+            raise exception
+        if attempt >= self.max_attempts:
+            logger.warning('Giving up on {} after {} attempts: {}'.format(
+                description,
+                attempt,
+                repr(exception)))
+            raise exception
+        wait = self.get_wait(attempt)
+        if deadline_time is not None and time.monotonic() + wait >= deadline_time:
+            raise TimeoutError('Deadline of {} seconds reached for {} after {} attempts'.format(
+                self.deadline,
+                description,
+                attempt)) from exception
+        logger.warning('Attempt {} of {} for {} failed ({}): {}. Retrying in {:.2f} seconds'.format(
+            attempt,
+            self.max_attempts,
+            description,
+            kind,
+            repr(exception),
+            wait))
+        return kind, wait
+
+    # Function for running operation(connection) with retries. connect() opens
+    # a connection and is called again (after discard(connection)) whenever
+    # the link is found to be dead. Once the operation has finished (or failed
+    # for good), release(connection) is called on any live connection. If
+    # connect is None, operation is called with None and disconnects are
+    # simply retried. The duration and number of attempts are recorded (see
+    # decawave_ble.metrics)
+    def run(
+        self,
+        operation,
+        connect = None,
+        release = None,
+        discard = None,
+        description = 'operation',
+        device_name = None):
+        deadline_time = self.get_deadline_time()
+        start_time = time.perf_counter()
+        connection = None
+        attempt = 0
+        success = False
+        error = None
+        try:
+            while True:
+                attempt += 1
+                try:
+                    if connection is None and connect is not None:
+                        connection = connect()
+                    result = operation(connection)
+                    success = True
+                    return result
+                except Exception as e:
+                    error = type(e).__name__
+                    kind, wait = self.handle_failure(e, attempt, deadline_time, description)
+                    if kind == DISCONNECT and connection is not None:
+                        dead_connection = connection
+                        connection = None
+                        if discard is not None:
+                            discard_quietly(discard, dead_connection)
+                    time.sleep(wait)
+        finally:
+            if connection is not None and release is not None:
+                release(connection)
+            self.record_metrics(start_time, attempt, success, error, description, device_name)
+
+    # Coroutine version of run. operation, connect, release and discard are
+    # coroutine functions
+    async def run_async(
+        self,
+        operation,
+        connect = None,
+        release = None,
+        discard = None,
+        description = 'operation',
+        device_name = None):
+        # Imported here since asyncio is slow to import and only needed by
+        # asyncio callers (which have already imported it)
+        import asyncio
+        deadline_time = self.get_deadline_time()
+        start_time = time.perf_counter()
+        connection = None
+        attempt = 0
+        success = False
+        error = None
+        try:
+            while True:
+                attempt += 1
+                try:
+                    if connection is None and connect is not None:
+                        connection = await connect()
+                    result = await operation(connection)
+                    success = True
+                    return result
+                except Exception as e:
+                    error = type(e).__name__
+                    kind, wait = self.handle_failure(e, attempt, deadline_time, description)
+                    if kind == DISCONNECT and connection is not None:
+                        dead_connection = connection
+                        connection = None
+                        if discard is not None:
+                            try:
+                                await discard(dead_connection)
+                            except Exception as discard_exception:
+                                logger.debug('Failed to discard connection: {}'.format(repr(discard_exception)))
+                    await asyncio.sleep(wait)
+        finally:
+            if connection is not None and release is not None:
+                await release(connection)
+            self.record_metrics(start_time, attempt, success, error, description, device_name)
+
+    # Function for recording a retried operation (see decawave_ble.metrics).
+    # Operations on a device are recorded as device_operation; others (e.g.,
+    # scans) as retry: followed by their description, so that they are not
+    # counted together with the individual attempts they wrap (e.g., each
+    # scan is also recorded as scan)
+    def record_metrics(
+        self,
+        start_time,
+        attempts,
+        success,
+        error,
+        description,
+        device_name):
+        if not self.metrics or not decawave_ble.metrics.is_enabled():
+            return
+        if device_name is not None:
+            operation = 'device_operation'
+        else:
+            operation = 'retry:{}'.format(description)
+        decawave_ble.metrics.record(
+            operation,
+            time.perf_counter() - start_time,
+            device_name,
+            success = success,
+            error = None if success else error,
+            attempts = attempts)
+
+    # Function for calling a function that does not need a connection (e.g.,
+    # scanning or connecting) with retries
+    def call(self, function, *args, **kwargs):
+        return self.run(
+            lambda connection: function(*args, **kwargs),
+            description = getattr(function, '__name__', repr(function)))
+
+def discard_quietly(discard, connection):
+    try:
+        discard(connection)
+    except Exception as e:
+        logger.debug('Failed to discard connection: {}'.format(repr(e)))
+
+# Retry policy which makes a single attempt (for operations whose retries, and
+# so whose metrics, are handled elsewhere)
+no_retry_policy = RetryPolicy(
+    max_attempts = 1,
+    deadline = None,
+    metrics = False)
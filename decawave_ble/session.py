@@ -0,0 +1,198 @@
+import decawave_ble
+import collections
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Class to represent a pool of open connections to Decawave devices so that
+# several operations on the same device share one connection. Connections
+# are closed when they have been idle for idle_timeout seconds (checked
+# whenever the session is used) or when max_connections would otherwise be
+# exceeded (least recently used first). Only connections which are not in use
+# are closed this way: if every connection is in use, the pool grows beyond
+# max_connections rather than disconnecting a device from under another
+# thread. Operations are retried according to retry_policy (see
+# decawave_ble.retry; the default policy if None); a connection that turns out
+# to have been lost is dropped from the pool and reopened before the
+# operation is tried again. Pass the session to the device-level functions in
+# decawave_ble (e.g., decawave_ble.get_network_id(device, session=session)). A
+# session can be shared between threads (connections are opened outside the
+# session lock, so one slow connection does not hold up the others) but each
+# device should only be used by one thread at a time
+class DecawaveSession:
+    def __init__(
+        self,
+        max_connections = None,
+        idle_timeout = 30.0,
+        retry_policy = None):
+        if max_connections is None:
+            max_connections = decawave_ble.default_max_connections_per_interface
+        if max_connections < 1:
+            raise ValueError('Maximum number of connections must be at least 1')
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.retry_policy = retry_policy
+        self.connections = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Function for getting a connection to a device from the pool (opening one
+    # if necessary). The connection is marked as in use until it is handed
+    # back with release or dropped with disconnect
+    def get_peripheral(
+        self,
+        decawave_device,
+        interface = None):
+        key = decawave_device.mac_address
+        peripherals_to_close = []
+        with self.condition:
+            peripherals_to_close.extend(self.remove_idle_connections())
+            while True:
+                connection = self.connections.get(key)
+                if connection is None:
+                    break
+                if connection['peripheral'] is None:
+                    # Another thread is connecting to this device
+                    self.condition.wait()
+                    continue
+                if is_connected(connection['peripheral']):
+                    connection['users'] += 1
+                    connection['last_used'] = time.monotonic()
+                    self.connections.move_to_end(key)
+                    decawave_peripheral = connection['peripheral']
+                    break
+                logger.info('Connection to {} was lost. Reconnecting'.format(decawave_device.device_name))
+                del self.connections[key]
+                peripherals_to_close.append(connection['peripheral'])
+                connection = None
+                break
+            if connection is None:
+                peripherals_to_close.extend(self.remove_excess_connections(self.max_connections - 1))
+                if len(self.connections) >= self.max_connections:
+                    logger.debug('All {} connections are in use. Opening one more'.format(len(self.connections)))
+                # Reserve the entry so that other threads wait for this
+                # connection rather than opening another
+                connection = {
+                    'device_name': decawave_device.device_name,
+                    'peripheral': None,
+                    'users': 1,
+                    'last_used': time.monotonic()}
+                self.connections[key] = connection
+        for peripheral_to_close in peripherals_to_close:
+            decawave_ble.disconnect_peripheral_quietly(peripheral_to_close)
+        if connection['peripheral'] is not None:
+            return decawave_peripheral
+        try:
+            decawave_peripheral = decawave_ble.get_decawave_peripheral(decawave_device, interface)
+        except BaseException:
+            with self.condition:
+                if self.connections.get(key) is connection:
+                    del self.connections[key]
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            connection['peripheral'] = decawave_peripheral
+            connection['last_used'] = time.monotonic()
+            self.condition.notify_all()
+        return decawave_peripheral
+
+    def call(
+        self,
+        function,
+        decawave_device,
+        *args,
+        interface = None,
+        retry_policy = None,
+        **kwargs):
+        if retry_policy is None:
+            retry_policy = self.retry_policy
+        return decawave_ble.get_retry_policy(retry_policy).run(
+            lambda decawave_peripheral: function(decawave_peripheral, *args, **kwargs),
+            connect = lambda: self.get_peripheral(decawave_device, interface),
+            release = lambda decawave_peripheral: self.release(decawave_device),
+            discard = lambda decawave_peripheral: self.disconnect(decawave_device),
+            description = decawave_device.device_name,
+            device_name = decawave_device.device_name)
+
+    # Function for handing a connection back to the pool after use (closing
+    # idle connections if the pool has grown beyond max_connections)
+    def release(self, decawave_device):
+        with self.condition:
+            connection = self.connections.get(decawave_device.mac_address)
+            if connection is not None and connection['peripheral'] is not None:
+                connection['users'] = max(connection['users'] - 1, 0)
+                connection['last_used'] = time.monotonic()
+            excess_peripherals = self.remove_excess_connections(self.max_connections)
+        for excess_peripheral in excess_peripherals:
+            decawave_ble.disconnect_peripheral_quietly(excess_peripheral)
+
+    # Function for removing connections which are not in use (least recently
+    # used first) until no more than max_connections remain or all remaining
+    # connections are in use. Returns their peripherals (to be disconnected
+    # outside the lock)
+    def remove_excess_connections(self, max_connections):
+        with self.condition:
+            excess_peripherals = []
+            while len(self.connections) > max_connections:
+                idle_keys = [key for key, connection in self.connections.items() if connection['users'] == 0]
+                if len(idle_keys) == 0:
+                    break
+                connection = self.connections.pop(idle_keys[0])
+                logger.debug('Closing least recently used connection to {}'.format(connection['device_name']))
+                excess_peripherals.append(connection['peripheral'])
+            return excess_peripherals
+
+    def disconnect(self, decawave_device):
+        with self.condition:
+            connection = self.connections.get(decawave_device.mac_address)
+            if connection is None or connection['peripheral'] is None:
+                return
+            del self.connections[decawave_device.mac_address]
+            self.condition.notify_all()
+        decawave_ble.disconnect_peripheral_quietly(connection['peripheral'])
+
+    # Function for removing connections which are not in use and have been
+    # idle for more than idle_timeout seconds. Returns their peripherals (to
+    # be disconnected outside the lock)
+    def remove_idle_connections(self):
+        if self.idle_timeout is None:
+            return []
+        with self.condition:
+            now = time.monotonic()
+            idle_keys = [
+                key for key, connection in self.connections.items()
+                if connection['users'] == 0 and now - connection['last_used'] > self.idle_timeout]
+            idle_peripherals = []
+            for key in idle_keys:
+                connection = self.connections.pop(key)
+                logger.debug('Closing idle connection to {}'.format(connection['device_name']))
+                idle_peripherals.append(connection['peripheral'])
+            return idle_peripherals
+
+    def close_idle_connections(self):
+        for idle_peripheral in self.remove_idle_connections():
+            decawave_ble.disconnect_peripheral_quietly(idle_peripheral)
+
+    def close(self):
+        with self.condition:
+            connections = [connection for connection in self.connections.values() if connection['peripheral'] is not None]
+            for key in [key for key, connection in self.connections.items() if connection['peripheral'] is not None]:
+                del self.connections[key]
+            self.condition.notify_all()
+        for connection in connections:
+            decawave_ble.disconnect_peripheral_quietly(connection['peripheral'])
+
+# Function for checking whether a peripheral is still connected
+def is_connected(decawave_peripheral):
+    try:
+        return decawave_peripheral.getState() == 'conn'
+    except decawave_ble.get_transport().BTLEException:
+        return False
@@ -0,0 +1,842 @@
+import decawave_ble
+import math
+import random
+import threading
+import time
+import uuid
+import logging
+
+from decawave_ble.codecs import (
+    DEVICE_TYPE_NAMES,
+    parse_operation_mode_bytes,
+    pack_operation_mode_bytes,
+    parse_location_data_mode_bytes,
+    pack_location_data_mode_bytes,
+    pack_location_data_bytes,
+    parse_network_id_bytes,
+    pack_network_id_bytes,
+    pack_proxy_positions_bytes,
+    pack_device_info_bytes,
+    pack_anchor_list_bytes,
+    parse_update_rate_bytes,
+    pack_update_rate_bytes,
+    parse_position_bytes)
+
+logger = logging.getLogger(__name__)
+
+# In-process simulation of Decawave DWM1001 devices, so that the package can
+# be exercised (and load tested) without radios. A SimulatedNetwork holds
+# simulated nodes (anchors and tags), each of which implements the network
+# node service characteristics with the real byte layouts (built and checked
+# with the codecs used for real devices): writes are parsed and stored, and
+# location data is computed from the node positions (tags can move, and
+# report distances to the nearest anchors in their network). A
+# SimulatedTransport exposes the network through the interface of bluepy.btle
+# (Scanner, Peripheral, UUID and the BTLE exceptions, with simulated versions
+# of each so that bluepy need not be installed) with
+# configurable latency, jitter, failure rates and notification rates, e.g.,
+#
+# network = decawave_ble.simulator.create_simulated_network(num_anchors=4, num_tags=196)
+# decawave_ble.set_transport(decawave_ble.simulator.SimulatedTransport(network, latency=0.02))
+# devices = decawave_ble.scan_for_decawave_devices()
+#
+# The transport counts scans, connections, discoveries, reads, writes and
+# notifications (see SimulatedTransport.get_statistics)
+
+# Characteristics implemented by simulated nodes, with whether they can be read
+# and written
+SIMULATED_CHARACTERISTICS = [
+    (decawave_ble.OPERATION_MODE_CHARACTERISTIC_UUID, True, True),
+    (decawave_ble.NETWORK_ID_CHARACTERISTIC_UUID, True, True),
+    (decawave_ble.LOCATION_DATA_MODE_CHARACTERISTIC_UUID, True, True),
+    (decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID, True, False),
+    (decawave_ble.PROXY_POSITIONS_CHARACTERISTIC_UUID, True, False),
+    (decawave_ble.DEVICE_INFO_CHARACTERISTIC_UUID, True, False),
+    (decawave_ble.DISCONNECT_CHARACTERISTIC_UUID, False, True),
+    (decawave_ble.ANCHOR_PERSISTED_POSITION_CHARACTERISTIC_UUID, False, True),
+    (decawave_ble.ANCHOR_LIST_CHARACTERISTIC_UUID, True, False),
+    (decawave_ble.TAG_UPDATE_RATE_CHARACTERISTIC_UUID, True, True)]
+
+# Maximum number of anchors to which a tag reports distances
+MAX_TAG_DISTANCES = 4
+
+# Maximum number of anchors in an anchor list
+MAX_ANCHOR_LIST_LENGTH = 30
+
+# Class to represent a simulated Decawave device. Positions are in
+# millimeters. A tag moves around a circle of radius motion_radius (centered on
+# its position) once every motion_period seconds; position_noise and
+# distance_noise are the standard deviations (in millimeters) of the noise
+# added to reported positions and distances
+class SimulatedNode:
+    def __init__(
+        self,
+        node_id,
+        device_type_name = 'Tag',
+        network_id = 0x1234,
+        position = (0, 0, 0),
+        mac_address = None,
+        device_name = None,
+        location_data_mode = None,
+        moving_update_rate = 100,
+        stationary_update_rate = 1000,
+        motion_radius = 0,
+        motion_period = 10.0,
+        position_noise = 0.0,
+        distance_noise = 0.0):
+        if device_type_name not in DEVICE_TYPE_NAMES:
+            raise ValueError('Device type name {} not recognized (must be one of {})'.format(
+                device_type_name,
+                DEVICE_TYPE_NAMES))
+        if mac_address is None:
+            mac_address = 'de:ca:{:02x}:{:02x}:{:02x}:{:02x}'.format(
+                (node_id >> 24) & 0xff,
+                (node_id >> 16) & 0xff,
+                (node_id >> 8) & 0xff,
+                node_id & 0xff)
+        if device_name is None:
+            device_name = 'DW{:04X}'.format(node_id & 0xffff)
+        if location_data_mode is None:
+            location_data_mode = 2 if device_type_name == 'Tag' else 0
+        self.node_id = node_id
+        self.mac_address = mac_address.lower()
+        self.device_name = device_name
+        self.position = tuple(position)
+        self.position_quality = 100
+        self.motion_radius = motion_radius
+        self.motion_period = motion_period
+        self.position_noise = position_noise
+        self.distance_noise = distance_noise
+        self.network = None
+        self.lock = threading.Lock()
+        anchor = device_type_name == 'Anchor'
+        self.values = {
+            decawave_ble.OPERATION_MODE_CHARACTERISTIC_UUID: pack_operation_mode_bytes({
+                'device_type': DEVICE_TYPE_NAMES.index(device_type_name),
+                'uwb_mode': 2,
+                'fw_version': 0,
+                'accelerometer_enable': not anchor,
+                'led_enable': True,
+                'fw_update_enable': False,
+                'reserved_01': False,
+                'initiator': False,
+                'low_power_mode': False,
+                'location_engine': not anchor,
+                'reserved_02': 0}),
+            decawave_ble.NETWORK_ID_CHARACTERISTIC_UUID: pack_network_id_bytes(network_id),
+            decawave_ble.LOCATION_DATA_MODE_CHARACTERISTIC_UUID: pack_location_data_mode_bytes({
+                'location_data_mode': location_data_mode}),
+            decawave_ble.PROXY_POSITIONS_CHARACTERISTIC_UUID: pack_proxy_positions_bytes([]),
+            decawave_ble.DEVICE_INFO_CHARACTERISTIC_UUID: pack_device_info_bytes({
+                'node_id': 0xdeca000000000000 | node_id,
+                'hw_version': 0x2a,
+                'fw1_version': 0x01030000,
+                'fw2_version': 0x01030000,
+                'fw1_checksum': 0x12345678,
+                'fw2_checksum': 0x9abcdef0,
+                'bridge': False,
+                'unknown': 0}),
+            decawave_ble.TAG_UPDATE_RATE_CHARACTERISTIC_UUID: pack_update_rate_bytes({
+                'moving_update_rate': moving_update_rate,
+                'stationary_update_rate': stationary_update_rate})}
+
+    def __repr__(self):
+        return 'SimulatedNode({}, {})'.format(self.device_name, self.mac_address)
+
+    def get_operation_mode_data(self):
+        with self.lock:
+            return parse_operation_mode_bytes(self.values[decawave_ble.OPERATION_MODE_CHARACTERISTIC_UUID])
+
+    def is_anchor(self):
+        return self.get_operation_mode_data()['device_type'] == 1
+
+    def get_network_id(self):
+        with self.lock:
+            return parse_network_id_bytes(self.values[decawave_ble.NETWORK_ID_CHARACTERISTIC_UUID])
+
+    def get_update_rate_data(self):
+        with self.lock:
+            return parse_update_rate_bytes(self.values[decawave_ble.TAG_UPDATE_RATE_CHARACTERISTIC_UUID])
+
+    # Function for getting the true position of the node at a time (from
+    # time.monotonic)
+    def get_position(self, current_time = None):
+        if self.motion_radius == 0:
+            return self.position
+        if current_time is None:
+            current_time = time.monotonic()
+        angle = 2*math.pi*current_time/self.motion_period
+        return (
+            self.position[0] + self.motion_radius*math.cos(angle),
+            self.position[1] + self.motion_radius*math.sin(angle),
+            self.position[2])
+
+    def read(self, characteristic_uuid, random_generator = random):
+        if characteristic_uuid == decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID:
+            return self.get_location_data_bytes(random_generator)
+        if characteristic_uuid == decawave_ble.ANCHOR_LIST_CHARACTERISTIC_UUID:
+            return self.get_anchor_list_bytes()
+        with self.lock:
+            return self.values[characteristic_uuid]
+
+    # Function for writing a characteristic value. Values are parsed with the
+    # same codecs used for real devices, so malformed values are rejected
+    # (with a ValueError) rather than stored
+    def write(self, characteristic_uuid, value):
+        value = bytes(value)
+        if characteristic_uuid == decawave_ble.OPERATION_MODE_CHARACTERISTIC_UUID:
+            if len(value) != 2:
+                raise ValueError('Operation mode data must be 2 bytes')
+            parse_operation_mode_bytes(value)
+        elif characteristic_uuid == decawave_ble.NETWORK_ID_CHARACTERISTIC_UUID:
+            if len(value) != 2:
+                raise ValueError('Network ID must be 2 bytes')
+        elif characteristic_uuid == decawave_ble.LOCATION_DATA_MODE_CHARACTERISTIC_UUID:
+            if len(value) != 1:
+                raise ValueError('Location data mode must be 1 byte')
+            parse_location_data_mode_bytes(value)
+        elif characteristic_uuid == decawave_ble.TAG_UPDATE_RATE_CHARACTERISTIC_UUID:
+            if len(value) != 8:
+                raise ValueError('Update rate data must be 8 bytes')
+        elif characteristic_uuid == decawave_ble.ANCHOR_PERSISTED_POSITION_CHARACTERISTIC_UUID:
+            if len(value) != 13:
+                raise ValueError('Persisted position data must be 13 bytes')
+            position_data = parse_position_bytes(value)
+            with self.lock:
+                self.position = (
+                    position_data['x_position'],
+                    position_data['y_position'],
+                    position_data['z_position'])
+                self.position_quality = position_data['quality']
+            return
+        elif characteristic_uuid == decawave_ble.DISCONNECT_CHARACTERISTIC_UUID:
+            return
+        else:
+            raise ValueError('Characteristic {} cannot be written'.format(characteristic_uuid))
+        with self.lock:
+            self.values[characteristic_uuid] = value
+
+    def get_location_data_bytes(self, random_generator = random):
+        with self.lock:
+            location_data_mode = self.values[decawave_ble.LOCATION_DATA_MODE_CHARACTERISTIC_UUID][0]
+        current_time = time.monotonic()
+        position = self.get_position(current_time)
+        anchor = self.is_anchor()
+        position_data = None
+        if location_data_mode in (0, 2):
+            position_noise = 0.0 if anchor else self.position_noise
+            position_data = {
+                'x_position': round(position[0] + random_generator.gauss(0.0, position_noise)),
+                'y_position': round(position[1] + random_generator.gauss(0.0, position_noise)),
+                'z_position': round(position[2] + random_generator.gauss(0.0, position_noise)),
+                'quality': self.position_quality}
+        distance_data = None
+        if location_data_mode in (1, 2):
+            distance_data = []
+            if not anchor and self.network is not None:
+                anchors = self.network.get_nearest_anchors(
+                    position,
+                    self.get_network_id(),
+                    MAX_TAG_DISTANCES)
+                for distance, anchor_node in anchors:
+                    distance_data.append({
+                        'node_id': anchor_node.node_id & 0xffff,
+                        'distance': max(round(distance + random_generator.gauss(0.0, self.distance_noise)), 0),
+                        'quality': random_generator.randint(70, 100)})
+        return pack_location_data_bytes({
+            'location_data_content': location_data_mode,
+            'position_data': position_data,
+            'distance_data': distance_data})
+
+    def get_anchor_list_bytes(self):
+        if not self.is_anchor() or self.network is None:
+            return pack_anchor_list_bytes([])
+        network_id = self.get_network_id()
+        anchor_list_data = [
+            node.node_id & 0xffff for node in self.network.get_nodes()
+            if node is not self and node.is_anchor() and node.get_network_id() == network_id]
+        return pack_anchor_list_bytes(anchor_list_data[:MAX_ANCHOR_LIST_LENGTH])
+
+# Class to represent a set of simulated nodes (keyed by MAC address)
+class SimulatedNetwork:
+    def __init__(self, nodes = None):
+        self.nodes = {}
+        self.lock = threading.Lock()
+        if nodes is not None:
+            for node in nodes:
+                self.add_node(node)
+
+    def add_node(self, node):
+        with self.lock:
+            if node.mac_address in self.nodes:
+                raise ValueError('Network already contains a node with MAC address {}'.format(node.mac_address))
+            node.network = self
+            self.nodes[node.mac_address] = node
+        return node
+
+    def remove_node(self, node):
+        with self.lock:
+            self.nodes.pop(node.mac_address, None)
+            node.network = None
+
+    def get_node(self, mac_address):
+        return self.nodes.get(mac_address.lower())
+
+    def get_nodes(self):
+        with self.lock:
+            return list(self.nodes.values())
+
+    # Function for finding the anchors in a network nearest a position. Returns
+    # a list of (distance, node) tuples, nearest first
+    def get_nearest_anchors(
+        self,
+        position,
+        network_id,
+        max_anchors):
+        anchors = []
+        for node in self.get_nodes():
+            if not node.is_anchor() or node.get_network_id() != network_id:
+                continue
+            anchor_position = node.get_position()
+            distance = math.sqrt(
+                (anchor_position[0] - position[0])**2 +
+                (anchor_position[1] - position[1])**2 +
+                (anchor_position[2] - position[2])**2)
+            anchors.append((distance, node))
+        anchors.sort(key=lambda anchor: anchor[0])
+        return anchors[:max_anchors]
+
+# Function for creating a network of anchors on a grid (spacing millimeters
+# apart, at height anchor_height) and tags spread over the area they cover.
+# Node IDs start at first_node_id; remaining keyword arguments are passed to
+# SimulatedNode for each tag
+def create_simulated_network(
+    num_anchors = 4,
+    num_tags = 1,
+    network_id = 0x1234,
+    spacing = 5000,
+    anchor_height = 2500,
+    first_node_id = 0x1000,
+    seed = None,
+    **tag_kwargs):
+    random_generator = random.Random(seed)
+    network = SimulatedNetwork()
+    num_columns = max(int(math.ceil(math.sqrt(num_anchors))), 1)
+    node_id = first_node_id
+    for anchor_index in range(num_anchors):
+        network.add_node(SimulatedNode(
+            node_id,
+            device_type_name = 'Anchor',
+            network_id = network_id,
+            position = (
+                spacing*(anchor_index % num_columns),
+                spacing*(anchor_index // num_columns),
+                anchor_height)))
+        node_id += 1
+    width = spacing*max(num_columns - 1, 1)
+    height = spacing*max((num_anchors - 1) // num_columns, 1)
+    for tag_index in range(num_tags):
+        network.add_node(SimulatedNode(
+            node_id,
+            device_type_name = 'Tag',
+            network_id = network_id,
+            position = (
+                round(random_generator.uniform(0, width)),
+                round(random_generator.uniform(0, height)),
+                1000),
+            **tag_kwargs))
+        node_id += 1
+    return network
+
+# Exceptions raised by the simulated transport (with the hierarchy of the
+# bluepy.btle exceptions)
+class SimulatedBTLEException(Exception):
+    def __init__(
+        self,
+        message,
+        rsp = None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.rsp = rsp
+
+class SimulatedBTLEDisconnectError(SimulatedBTLEException):
+    pass
+
+class SimulatedBTLEGattError(SimulatedBTLEException):
+    pass
+
+# Class to represent a BLE UUID (with the interface of bluepy.btle.UUID).
+# Accepts 16- and 32-bit short forms (as integers or hex strings) as well as
+# full UUIDs, with or without hyphens
+class SimulatedUUID:
+    def __init__(
+        self,
+        val,
+        commonName = None):
+        if isinstance(val, SimulatedUUID):
+            val = str(val)
+        if isinstance(val, int):
+            if val < 0 or val > 0xffffffff:
+                raise ValueError('Short form UUIDs must be 16 or 32 bits')
+            val = '{:08x}'.format(val)
+        hex_string = str(val).replace('-', '')
+        if len(hex_string) <= 8:
+            hex_string = hex_string.rjust(8, '0') + '00001000800000805f9b34fb'
+        self.uuid = uuid.UUID(hex_string)
+        self.binVal = self.uuid.bytes
+        self.commonName = commonName
+
+    def __str__(self):
+        return str(self.uuid)
+
+    def __repr__(self):
+        return 'UUID(\'{}\')'.format(self)
+
+    def __eq__(self, other):
+        return str(self) == str(SimulatedUUID(other))
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def getCommonName(self):
+        return self.commonName if self.commonName is not None else str(self)
+
+# Class to represent a delegate which ignores scan entries and notifications
+# (with the interface of bluepy.btle.DefaultDelegate)
+class SimulatedDelegate:
+    def handleNotification(self, cHandle, data):
+        pass
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        pass
+
+# Class to represent a simulated BLE transport. Can be passed to
+# decawave_ble.set_transport in place of bluepy.btle. Each GATT operation
+# (service discovery, read, write) takes latency seconds (+/- jitter) and
+# connecting takes connect_latency seconds; connections on each interface are
+# established one at a time, as on a real controller, and at most
+# max_connections_per_interface (if not None) can be open at once. Any
+# operation on a connection fails with a disconnect at rate disconnect_rate
+# (after which the connection is dead), connections fail at rate
+# connect_failure_rate and reads and writes fail with a GATT error at rate
+# gatt_error_rate. Nodes are found by scanning within discovery_time seconds
+# of the start of a scan. Location data notifications are sent at the update
+# rate of each node unless notification_rate (per second) is specified
+class SimulatedTransport:
+    UUID = SimulatedUUID
+    DefaultDelegate = SimulatedDelegate
+    BTLEException = SimulatedBTLEException
+    BTLEDisconnectError = SimulatedBTLEDisconnectError
+    BTLEGattError = SimulatedBTLEGattError
+
+    def __init__(
+        self,
+        network,
+        latency = 0.0,
+        jitter = 0.0,
+        connect_latency = None,
+        disconnect_rate = 0.0,
+        connect_failure_rate = 0.0,
+        gatt_error_rate = 0.0,
+        max_connections_per_interface = None,
+        discovery_time = 0.5,
+        notification_rate = None,
+        seed = None):
+        if connect_latency is None:
+            connect_latency = latency
+        self.network = network
+        self.latency = latency
+        self.jitter = jitter
+        self.connect_latency = connect_latency
+        self.disconnect_rate = disconnect_rate
+        self.connect_failure_rate = connect_failure_rate
+        self.gatt_error_rate = gatt_error_rate
+        self.max_connections_per_interface = max_connections_per_interface
+        self.discovery_time = discovery_time
+        self.notification_rate = notification_rate
+        self.random_generator = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.connect_locks = {}
+        self.open_connections = {}
+        self.lock = threading.Lock()
+        self.reset_statistics()
+
+    # Functions with the names and signatures of the bluepy.btle constructors
+    def Scanner(self, iface = 0):
+        return SimulatedScanner(self, iface)
+
+    def Peripheral(
+        self,
+        deviceAddr = None,
+        addrType = 'public',
+        iface = None):
+        return SimulatedPeripheral(self, deviceAddr, addrType, iface)
+
+    def reset_statistics(self):
+        with self.lock:
+            self.statistics = {
+                'scans': 0,
+                'connections': 0,
+                'failed_connections': 0,
+                'discoveries': 0,
+                'reads': 0,
+                'writes': 0,
+                'notifications': 0,
+                'disconnects': 0,
+                'gatt_errors': 0,
+                'max_open_connections': 0}
+
+    def get_statistics(self):
+        with self.lock:
+            return dict(self.statistics)
+
+    def count(self, name, increment = 1):
+        with self.lock:
+            self.statistics[name] += increment
+
+    def random(self):
+        with self.random_lock:
+            return self.random_generator.random()
+
+    def get_random_generator(self):
+        with self.random_lock:
+            return random.Random(self.random_generator.random())
+
+    def get_delay(self, latency):
+        if latency <= 0:
+            return 0.0
+        if self.jitter > 0:
+            with self.random_lock:
+                latency += self.random_generator.uniform(-self.jitter, self.jitter)
+        return max(latency, 0.0)
+
+    def wait(self, latency):
+        delay = self.get_delay(latency)
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_connect_lock(self, interface):
+        with self.lock:
+            connect_lock = self.connect_locks.get(interface)
+            if connect_lock is None:
+                connect_lock = threading.Lock()
+                self.connect_locks[interface] = connect_lock
+            return connect_lock
+
+    def open_connection(self, mac_address, interface):
+        with self.get_connect_lock(interface):
+            self.wait(self.connect_latency)
+            node = self.network.get_node(mac_address)
+            if node is None or self.random() < self.connect_failure_rate:
+                self.count('failed_connections')
+                raise SimulatedBTLEDisconnectError('Failed to connect to peripheral {}, addr type: random'.format(mac_address))
+            with self.lock:
+                num_open_connections = self.open_connections.get(interface, 0)
+                if self.max_connections_per_interface is not None and num_open_connections >= self.max_connections_per_interface:
+                    self.statistics['failed_connections'] += 1
+                    raise SimulatedBTLEDisconnectError('Failed to connect to peripheral {}, addr type: random'.format(mac_address))
+                self.open_connections[interface] = num_open_connections + 1
+                self.statistics['connections'] += 1
+                self.statistics['max_open_connections'] = max(
+                    self.statistics['max_open_connections'],
+                    sum(self.open_connections.values()))
+        return node
+
+    def close_connection(self, interface):
+        with self.lock:
+            self.open_connections[interface] -= 1
+
+class SimulatedScanEntry:
+    def __init__(
+        self,
+        node,
+        iface,
+        rssi):
+        self.addr = node.mac_address
+        self.addrType = 'random'
+        self.iface = iface
+        self.rssi = rssi
+        self.connectable = True
+        self.updateCount = 1
+        self.scanData = {decawave_ble.SHORT_LOCAL_NAME_TYPE_CODE: node.device_name}
+
+    def getScanData(self):
+        return [(decawave_ble.SHORT_LOCAL_NAME_TYPE_CODE, 'Short Local Name', self.scanData[decawave_ble.SHORT_LOCAL_NAME_TYPE_CODE])]
+
+    def getValueText(self, sdid):
+        return self.scanData.get(sdid)
+
+# Class to represent a simulated scanner (with the interface of
+# bluepy.btle.Scanner)
+class SimulatedScanner:
+    def __init__(
+        self,
+        simulated_transport,
+        iface = 0):
+        self.transport = simulated_transport
+        self.iface = iface
+        self.delegate = SimulatedDelegate()
+        self.scanned = {}
+        self.pending = []
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def clear(self):
+        self.scanned = {}
+
+    def start(self, passive = False):
+        self.transport.count('scans')
+        start_time = time.monotonic()
+        random_generator = self.transport.get_random_generator()
+        self.pending = sorted(
+            [
+                (start_time + random_generator.uniform(0, self.transport.discovery_time), node.mac_address, node)
+                for node in self.transport.network.get_nodes()],
+            key=lambda pending_node: pending_node[:2],
+            reverse=True)
+
+    def process(self, timeout = 10):
+        end_time = time.monotonic() + timeout
+        while True:
+            while len(self.pending) > 0 and self.pending[-1][0] <= time.monotonic():
+                discovery_time, mac_address, node = self.pending.pop()
+                scan_entry = SimulatedScanEntry(
+                    node,
+                    self.iface,
+                    -40 - int(40*self.transport.random()))
+                self.scanned[mac_address] = scan_entry
+                self.delegate.handleDiscovery(scan_entry, True, True)
+            if len(self.pending) > 0:
+                next_time = min(self.pending[-1][0], end_time)
+            else:
+                next_time = end_time
+            remaining_time = next_time - time.monotonic()
+            if remaining_time > 0:
+                time.sleep(remaining_time)
+            if time.monotonic() >= end_time:
+                return
+
+    def stop(self):
+        self.pending = []
+
+    def getDevices(self):
+        return list(self.scanned.values())
+
+    def scan(self, timeout = 10, passive = False):
+        self.clear()
+        self.start(passive)
+        self.process(timeout)
+        self.stop()
+        return self.getDevices()
+
+# Class to represent a connection to a simulated node (with the interface of
+# bluepy.btle.Peripheral). Characteristic handles are assigned in the order of
+# SIMULATED_CHARACTERISTICS
+class SimulatedPeripheral:
+    def __init__(
+        self,
+        simulated_transport,
+        deviceAddr = None,
+        addrType = 'public',
+        iface = None):
+        self.transport = simulated_transport
+        self.delegate = SimulatedDelegate()
+        self.node = None
+        self.connected = False
+        self.notifications_enabled = False
+        self.next_notification_time = None
+        self.random_generator = simulated_transport.get_random_generator()
+        self.lock = threading.RLock()
+        if deviceAddr is not None:
+            self.connect(deviceAddr, addrType, iface)
+
+    def connect(
+        self,
+        addr,
+        addrType = 'public',
+        iface = None):
+        if isinstance(addr, SimulatedScanEntry):
+            if iface is None:
+                iface = addr.iface
+            addr = addr.addr
+        if iface is None:
+            iface = 0
+        self.iface = iface
+        self.node = self.transport.open_connection(addr, iface)
+        self.addr = self.node.mac_address
+        self.addrType = addrType
+        self.connected = True
+
+    def disconnect(self):
+        with self.lock:
+            if self.connected:
+                self.connected = False
+                self.notifications_enabled = False
+                self.transport.close_connection(self.iface)
+
+    def getState(self):
+        return 'conn' if self.connected else 'disc'
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def setDelegate(self, delegate):
+        return self.withDelegate(delegate)
+
+    def setMTU(self, mtu):
+        self.check_connection()
+        return {'mtu': [mtu]}
+
+    # Function for starting a GATT operation: waits for the simulated latency
+    # and drops the connection at the disconnect rate
+    def check_connection(self):
+        with self.lock:
+            if not self.connected:
+                raise SimulatedBTLEDisconnectError('Device disconnected')
+        self.transport.wait(self.transport.latency)
+        if self.transport.disconnect_rate > 0 and self.transport.random() < self.transport.disconnect_rate:
+            self.transport.count('disconnects')
+            self.disconnect()
+            raise SimulatedBTLEDisconnectError('Device disconnected')
+
+    def check_gatt_error(self):
+        if self.transport.gatt_error_rate > 0 and self.transport.random() < self.transport.gatt_error_rate:
+            self.transport.count('gatt_errors')
+            raise SimulatedBTLEGattError('Bluetooth command failed (code: 14, error: Unlikely Error)')
+
+    def getServiceByUUID(self, uuidVal):
+        self.check_connection()
+        self.transport.count('discoveries')
+        if SimulatedUUID(uuidVal) != SimulatedUUID(decawave_ble.NETWORK_NODE_SERVICE_UUID):
+            raise SimulatedBTLEGattError('Service {} not found'.format(uuidVal))
+        return SimulatedService(self)
+
+    def read_characteristic(self, characteristic_uuid):
+        self.check_connection()
+        self.transport.count('reads')
+        self.check_gatt_error()
+        return self.node.read(characteristic_uuid, self.random_generator)
+
+    def write_characteristic(self, characteristic_uuid, value):
+        self.check_connection()
+        self.transport.count('writes')
+        self.check_gatt_error()
+        try:
+            self.node.write(characteristic_uuid, value)
+        except ValueError as e:
+            raise SimulatedBTLEGattError('Bluetooth command failed ({})'.format(e))
+        if characteristic_uuid == decawave_ble.DISCONNECT_CHARACTERISTIC_UUID:
+            self.disconnect()
+
+    def set_notifications(self, enable):
+        self.check_connection()
+        self.transport.count('writes')
+        with self.lock:
+            self.notifications_enabled = enable
+            self.next_notification_time = time.monotonic() + self.get_notification_interval()
+
+    def get_notification_interval(self):
+        if self.transport.notification_rate is not None:
+            return 1.0/self.transport.notification_rate
+        return self.node.get_update_rate_data()['moving_update_rate']/1000.0
+
+    # Function for waiting for (and handling) a location data notification.
+    # Returns True if a notification was handled within timeout seconds
+    def waitForNotifications(self, timeout):
+        end_time = time.monotonic() + timeout
+        with self.lock:
+            if not self.connected:
+                raise SimulatedBTLEDisconnectError('Device disconnected')
+            notifications_enabled = self.notifications_enabled
+            next_notification_time = self.next_notification_time
+        if not notifications_enabled or next_notification_time > end_time:
+            remaining_time = end_time - time.monotonic()
+            if remaining_time > 0:
+                time.sleep(remaining_time)
+            return False
+        remaining_time = next_notification_time - time.monotonic()
+        if remaining_time > 0:
+            time.sleep(remaining_time)
+        if self.transport.disconnect_rate > 0 and self.transport.random() < self.transport.disconnect_rate:
+            self.transport.count('disconnects')
+            self.disconnect()
+            raise SimulatedBTLEDisconnectError('Device disconnected')
+        with self.lock:
+            self.next_notification_time = max(
+                next_notification_time + self.get_notification_interval(),
+                time.monotonic())
+        self.transport.count('notifications')
+        self.delegate.handleNotification(
+            get_characteristic_handle(decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID),
+            self.node.get_location_data_bytes(self.random_generator))
+        return True
+
+class SimulatedService:
+    def __init__(self, simulated_peripheral):
+        self.peripheral = simulated_peripheral
+        self.uuid = SimulatedUUID(decawave_ble.NETWORK_NODE_SERVICE_UUID)
+
+    def getCharacteristics(self, forUUID = None):
+        self.peripheral.check_connection()
+        characteristics = []
+        for characteristic_uuid, readable, writable in SIMULATED_CHARACTERISTICS:
+            if forUUID is not None and SimulatedUUID(forUUID) != SimulatedUUID(characteristic_uuid):
+                continue
+            characteristics.append(SimulatedCharacteristic(
+                self.peripheral,
+                characteristic_uuid,
+                readable,
+                writable))
+        return characteristics
+
+class SimulatedCharacteristic:
+    def __init__(
+        self,
+        simulated_peripheral,
+        characteristic_uuid,
+        readable,
+        writable):
+        self.peripheral = simulated_peripheral
+        self.characteristic_uuid = characteristic_uuid
+        self.uuid = SimulatedUUID(characteristic_uuid)
+        self.readable = readable
+        self.writable = writable
+
+    def read(self):
+        if not self.readable:
+            raise SimulatedBTLEGattError('Bluetooth command failed (code: 2, error: Attribute can\'t be read)')
+        return self.peripheral.read_characteristic(self.characteristic_uuid)
+
+    def write(self, val, withResponse = False):
+        if not self.writable:
+            raise SimulatedBTLEGattError('Bluetooth command failed (code: 3, error: Attribute can\'t be written)')
+        self.peripheral.write_characteristic(self.characteristic_uuid, val)
+
+    def getHandle(self):
+        return get_characteristic_handle(self.characteristic_uuid)
+
+    def getDescriptors(self, forUUID = None):
+        if self.characteristic_uuid != decawave_ble.LOCATION_DATA_CHARACTERISTIC_UUID:
+            return []
+        if forUUID is not None and SimulatedUUID(forUUID) != SimulatedUUID(decawave_ble.CLIENT_CHARACTERISTIC_CONFIGURATION_DESCRIPTOR_UUID):
+            return []
+        return [SimulatedDescriptor(self.peripheral)]
+
+# Class to represent the client characteristic configuration descriptor of
+# the location data characteristic
+class SimulatedDescriptor:
+    def __init__(self, simulated_peripheral):
+        self.peripheral = simulated_peripheral
+        self.uuid = SimulatedUUID(decawave_ble.CLIENT_CHARACTERISTIC_CONFIGURATION_DESCRIPTOR_UUID)
+
+    def write(self, val, withResponse = False):
+        self.peripheral.set_notifications(bytes(val)[:1] == b'\x01')
+
+def get_characteristic_handle(characteristic_uuid):
+    for characteristic_index, (simulated_characteristic_uuid, readable, writable) in enumerate(SIMULATED_CHARACTERISTICS):
+        if simulated_characteristic_uuid == characteristic_uuid:
+            return 0x10 + 3*characteristic_index
+    raise ValueError('Characteristic {} not simulated'.format(characteristic_uuid))
@@ -1,7 +1,9 @@
 from decawave_ble import configure_devices
 from decawave_ble.config.csv import ConfigurationDatabaseCSVLocal
+import decawave_ble.registry
 import logging
 import argparse
+import sys
 
 def main():
     parser = argparse.ArgumentParser(
@@ -12,6 +14,43 @@ def main():
         'config_data_file',
         help = 'file containing config data in CSV format (e.g., my_config_data.csv)'
     )
+    parser.add_argument(
+        '-n',
+        '--dry-run',
+        action = 'store_true',
+        help = 'compare devices with config data and report what would change without writing anything'
+    )
+    parser.add_argument(
+        '-c',
+        '--concurrent',
+        action = 'store_true',
+        help = 'configure multiple devices at once and continue past devices that fail'
+    )
+    parser.add_argument(
+        '-m',
+        '--max-connections',
+        type = int,
+        help = 'maximum number of simultaneous connections per Bluetooth interface when configuring concurrently'
+    )
+    parser.add_argument(
+        '-t',
+        '--scan-timeout',
+        type = float,
+        default = 10.0,
+        help = 'maximum number of seconds to scan for devices (default 10)'
+    )
+    parser.add_argument(
+        '-r',
+        '--registry',
+        nargs = '?',
+        const = '',
+        help = 'use (and update) a registry of known devices to avoid scanning; optionally specify the registry file (default ~/.cache/decawave_ble/device_registry.json)'
+    )
+    parser.add_argument(
+        '--registry-ttl',
+        type = float,
+        help = 'number of seconds after which devices that have not been seen are dropped from the registry'
+    )
     parser.add_argument(
         '-l',
         '--loglevel',
@@ -25,7 +64,21 @@ def main():
             raise ValueError('Invalid log level: %s'.format(loglevel))
         logging.basicConfig(level=numeric_loglevel)
     logging.info('Configuring from database')
-    configure_devices.configure_devices_from_database(ConfigurationDatabaseCSVLocal(args.config_data_file))
+    device_registry = None
+    if args.registry is not None:
+        device_registry = decawave_ble.registry.DecawaveDeviceRegistry(
+            path = args.registry or None,
+            ttl = args.registry_ttl)
+    results = configure_devices.configure_devices_from_database(
+        ConfigurationDatabaseCSVLocal(args.config_data_file),
+        dry_run = args.dry_run,
+        concurrent = args.concurrent,
+        max_connections_per_interface = args.max_connections,
+        scan_timeout = args.scan_timeout,
+        device_registry = device_registry)
+    failed_device_names = [device_name for device_name, result in results.items() if result['status'] == 'failed']
+    if len(failed_device_names) > 0:
+        sys.exit('Failed to configure devices: {}'.format(failed_device_names))
 
 if __name__ == '__main__':
     main()
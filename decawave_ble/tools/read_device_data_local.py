@@ -1,22 +1,87 @@
 import decawave_ble
+import decawave_ble.registry
 import logging
 import argparse
 
 def main():
     parser = argparse.ArgumentParser(
         description='Read data from devices and save to local text and JSON files.',
-        epilog = 'Script will attempt to write a text file (e.g., my_output.txt) and a JSON file (e.g., my_output.json)'
+        epilog = 'Script will attempt to write a text file (e.g., my_output.txt) and a JSON file (e.g., my_output.json), or a JSON Lines file (e.g., my_output.jsonl) if --json-lines is specified'
     )
     parser.add_argument(
         'output_file_stem',
         help = 'output filename without extension (e.g., output/my_output)'
     )
+    parser.add_argument(
+        '-c',
+        '--concurrent',
+        action = 'store_true',
+        help = 'read from multiple devices at once and skip devices that fail'
+    )
+    parser.add_argument(
+        '-m',
+        '--max-connections',
+        type = int,
+        help = 'maximum number of simultaneous connections per Bluetooth interface when reading concurrently'
+    )
+    parser.add_argument(
+        '-t',
+        '--scan-timeout',
+        type = float,
+        default = 10.0,
+        help = 'maximum number of seconds to scan for devices (default 10)'
+    )
+    parser.add_argument(
+        '-r',
+        '--registry',
+        nargs = '?',
+        const = '',
+        help = 'use (and update) a registry of known devices to avoid scanning; optionally specify the registry file (default ~/.cache/decawave_ble/device_registry.json)'
+    )
+    parser.add_argument(
+        '--registry-ttl',
+        type = float,
+        help = 'number of seconds after which devices that have not been seen are dropped from the registry'
+    )
+    parser.add_argument(
+        '--registry-full-scan-interval',
+        type = float,
+        help = 'number of seconds after which a full scan is run (rather than using the registry) to find new devices (default one day)'
+    )
+    parser.add_argument(
+        '-j',
+        '--json-lines',
+        action = 'store_true',
+        help = 'write each device to a JSON Lines file as soon as it has been read instead of writing a JSON file at the end'
+    )
+    parser.add_argument(
+        '--resume',
+        action = 'store_true',
+        help = 'with --json-lines, skip devices already in the JSON Lines file and append the rest'
+    )
+    parser.add_argument(
+        '-f',
+        '--fields',
+        type = lambda fields: fields.split(','),
+        help = 'comma-separated list of fields to read (default all): {}'.format(','.join(decawave_ble.DATA_FIELDS))
+    )
+    parser.add_argument(
+        '-x',
+        '--export-format',
+        choices = ['parquet', 'arrow'],
+        help = 'also export columnar tables (devices, distances, proxy positions and anchor lists) to a directory named after the output file stem (requires pyarrow)'
+    )
     parser.add_argument(
         '-l',
         '--loglevel',
         help = 'log level (e.g., debug or warning or info)'
     )
     args = parser.parse_args()
+    if args.fields is not None:
+        try:
+            decawave_ble.get_data_fields(args.fields)
+        except ValueError as e:
+            parser.error(str(e))
     loglevel = args.loglevel
     if args.loglevel is not None:
         numeric_loglevel = getattr(logging, loglevel.upper(), None)
@@ -27,20 +92,97 @@ def main():
     output_file_stem = args.output_file_stem
     text_output_file = output_file_stem + '.txt'
     json_output_file = output_file_stem + '.json'
-    # Scan for Decawave devices
-    logging.info('Scanning for Decawave devices')
-    decawave_devices = decawave_ble.scan_for_decawave_devices()
-    num_decawave_devices = len(decawave_devices)
-    logging.info('Found {} Decawave devices'.format(num_decawave_devices))
-    # Get data from Decawave devices and write files
-    logging.info('Getting data from Decawave devices')
-    decawave_device_data = decawave_ble.get_data_multiple_devices(decawave_devices)
+    json_lines_output_file = output_file_stem + '.jsonl'
+    if args.resume and not args.json_lines:
+        parser.error('--resume requires --json-lines')
+    if args.json_lines:
+        if args.registry is not None:
+            # Find Decawave devices in the registry (scanning only if necessary)
+            device_registry = decawave_ble.registry.DecawaveDeviceRegistry(
+                path = args.registry or None,
+                ttl = args.registry_ttl,
+                full_scan_interval = args.registry_full_scan_interval)
+            decawave_devices = decawave_ble.registry.find_decawave_devices(
+                device_registry,
+                scan_timeout = args.scan_timeout)
+        else:
+            # Scan for Decawave devices
+            logging.info('Scanning for Decawave devices')
+            decawave_devices = decawave_ble.scan_for_decawave_devices(timeout = args.scan_timeout)
+        logging.info('Found {} Decawave devices'.format(len(decawave_devices)))
+        # Get data from Decawave devices, writing each one as it is read
+        errors = {}
+        decawave_ble.write_data_multiple_devices_to_json_lines_local(
+            decawave_devices,
+            json_lines_output_file,
+            resume = args.resume,
+            concurrent = args.concurrent,
+            max_connections_per_interface = args.max_connections,
+            errors = errors,
+            fields = args.fields)
+        if args.registry is not None and len(errors) > 0:
+            # Rescan for devices that failed and try them once more
+            rescanned_decawave_devices = decawave_ble.registry.rescan_decawave_devices(
+                device_registry,
+                list(errors.keys()),
+                args.scan_timeout)
+            decawave_ble.write_data_multiple_devices_to_json_lines_local(
+                rescanned_decawave_devices,
+                json_lines_output_file,
+                resume = True,
+                concurrent = args.concurrent,
+                max_connections_per_interface = args.max_connections,
+                fields = args.fields)
+        decawave_ble.write_json_lines_to_text_local(
+            json_lines_output_file,
+            text_output_file)
+        if args.export_format is not None:
+            import decawave_ble.export as export
+            export.export_data_multiple_devices(
+                decawave_ble.read_data_from_json_lines_local(json_lines_output_file),
+                output_file_stem,
+                args.export_format)
+        return
+    if args.registry is not None:
+        # Get data from Decawave devices in the registry (scanning only if
+        # necessary)
+        logging.info('Getting data from Decawave devices in registry')
+        device_registry = decawave_ble.registry.DecawaveDeviceRegistry(
+            path = args.registry or None,
+            ttl = args.registry_ttl,
+            full_scan_interval = args.registry_full_scan_interval)
+        decawave_device_data = decawave_ble.registry.get_data_multiple_devices(
+            device_registry,
+            scan_timeout = args.scan_timeout,
+            max_connections_per_interface = args.max_connections,
+            fields = args.fields,
+            concurrent = args.concurrent)
+    else:
+        # Scan for Decawave devices
+        logging.info('Scanning for Decawave devices')
+        decawave_devices = decawave_ble.scan_for_decawave_devices(timeout = args.scan_timeout)
+        num_decawave_devices = len(decawave_devices)
+        logging.info('Found {} Decawave devices'.format(num_decawave_devices))
+        # Get data from Decawave devices
+        logging.info('Getting data from Decawave devices')
+        decawave_device_data = decawave_ble.get_data_multiple_devices(
+            decawave_devices,
+            concurrent = args.concurrent,
+            max_connections_per_interface = args.max_connections,
+            fields = args.fields)
+    # Write files
     decawave_ble.write_data_multiple_devices_to_json_local(
         decawave_device_data,
         json_output_file)
     decawave_ble.write_data_multiple_devices_to_text_local(
         decawave_device_data,
         text_output_file)
+    if args.export_format is not None:
+        import decawave_ble.export as export
+        export.export_data_multiple_devices(
+            decawave_device_data,
+            output_file_stem,
+            args.export_format)
 
 if __name__ == '__main__':
     main()
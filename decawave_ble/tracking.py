@@ -0,0 +1,411 @@
+import decawave_ble.multilateration
+import decawave_ble.records
+import array
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Streaming position tracking. A PositionTracker consumes location data
+# records (dictionaries with keys device_name, timestamp and location_data, as
+# yielded by decawave_ble.stream_location_data or
+# decawave_ble.replay.replay_location_data) and keeps a constant-velocity
+# Kalman filter per tag, emitting a filtered position and velocity for each
+# record.
+#
+# The motion model treats the x, y and z axes independently (white-noise
+# acceleration with spectral density process_noise in each), so the state of
+# each axis is a position, a velocity and a 2x2 covariance (three values).
+# The states of all tags are kept in flat typed arrays (STATE_SIZE doubles per
+# tag) and updated with scalar arithmetic, so each update is O(1) with no
+# per-update allocation beyond the output record.
+#
+# Tags are updated either from the position reported by the tag or (if an
+# anchor index is given, see decawave_ble.multilateration.AnchorIndex, and the
+# record includes distances to anchors in the index) from the distances to the
+# anchors, one range at a time (an extended Kalman filter
+# update which keeps the axes decoupled by dropping the cross-axis covariance
+# the update would introduce). Measurements are rejected if their quality is
+# below the minimum or if they fail an innovation gate (the normalized squared
+# innovation exceeds position_gate or distance_gate; the defaults are the 99%
+# points of the chi-squared distribution with 3 and 1 degrees of freedom).
+# Measurement variances are scaled by 100/quality. A track which rejects
+# max_consecutive_rejections measurements in a row (e.g., because the tag
+# really did jump), or which has not been updated for max_time_gap seconds, is
+# restarted from the next measurement. If none of the distances in a record
+# can be used (e.g., too few to start a track), the reported position (if any)
+# is used instead.
+#
+# Positions are in millimeters and velocities in millimeters per second
+
+# Layout of the state of each tag: the time of the last update, then for each
+# axis the position, velocity and covariance (position variance,
+# position-velocity covariance, velocity variance)
+TIME_INDEX = 0
+AXIS_OFFSETS = (1, 6, 11)
+POSITION_INDEX = 0
+VELOCITY_INDEX = 1
+POSITION_VARIANCE_INDEX = 2
+COVARIANCE_INDEX = 3
+VELOCITY_VARIANCE_INDEX = 4
+STATE_SIZE = 16
+
+# Layout of the counters of each tag
+INITIALIZED_INDEX = 0
+NUM_UPDATES_INDEX = 1
+NUM_REJECTED_INDEX = 2
+CONSECUTIVE_REJECTIONS_INDEX = 3
+COUNTERS_SIZE = 4
+
+# 99% points of the chi-squared distribution with 3 and 1 degrees of freedom
+DEFAULT_POSITION_GATE = 11.345
+DEFAULT_DISTANCE_GATE = 6.635
+
+# Class for tracking the positions of multiple tags (see above)
+class PositionTracker:
+    def __init__(
+        self,
+        anchor_index = None,
+        process_noise = 1.0e6,
+        position_noise = 100.0,
+        distance_noise = 100.0,
+        initial_velocity_noise = 1000.0,
+        min_position_quality = 1,
+        min_distance_quality = 1,
+        position_gate = DEFAULT_POSITION_GATE,
+        distance_gate = DEFAULT_DISTANCE_GATE,
+        max_consecutive_rejections = 5,
+        max_time_gap = 5.0):
+        self.anchor_index = anchor_index
+        self.process_noise = process_noise
+        self.position_variance = position_noise**2
+        self.distance_variance = distance_noise**2
+        self.initial_velocity_variance = initial_velocity_noise**2
+        self.min_position_quality = min_position_quality
+        self.min_distance_quality = min_distance_quality
+        self.position_gate = position_gate
+        self.distance_gate = distance_gate
+        self.max_consecutive_rejections = max_consecutive_rejections
+        self.max_time_gap = max_time_gap
+        self.slots = {}
+        self.states = array.array('d')
+        self.counters = array.array('q')
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get_slot(self, device_name):
+        slot = self.slots.get(device_name)
+        if slot is None:
+            slot = len(self.slots)
+            self.slots[device_name] = slot
+            self.states.extend([0.0]*STATE_SIZE)
+            self.counters.extend([0]*COUNTERS_SIZE)
+        return slot
+
+    # Function for discarding the track of a tag (it is restarted from the next
+    # measurement)
+    def reset(self, device_name):
+        slot = self.slots.get(device_name)
+        if slot is not None:
+            self.counters[slot*COUNTERS_SIZE + INITIALIZED_INDEX] = 0
+            self.counters[slot*COUNTERS_SIZE + CONSECUTIVE_REJECTIONS_INDEX] = 0
+
+    # Function for updating the track of a tag from a location data record.
+    # Returns a filtered record (see get_filtered_record), or None if the tag
+    # has no track yet (no usable measurement has been received)
+    def update(self, record):
+        device_name = record['device_name']
+        timestamp = record['timestamp']
+        location_data = record['location_data']
+        if isinstance(location_data, decawave_ble.records.Record):
+            location_data = location_data.to_dict()
+        slot = self.get_slot(device_name)
+        state_offset = slot*STATE_SIZE
+        counter_offset = slot*COUNTERS_SIZE
+        counters = self.counters
+        if counters[counter_offset + INITIALIZED_INDEX] and timestamp - self.states[state_offset + TIME_INDEX] > self.max_time_gap:
+            logger.debug('No update for {} for more than {} seconds; restarting track'.format(
+                device_name,
+                self.max_time_gap))
+            counters[counter_offset + INITIALIZED_INDEX] = 0
+        distance_data = location_data['distance_data']
+        position_data = location_data['position_data']
+        use_distances = self.has_known_anchor(distance_data)
+        if not counters[counter_offset + INITIALIZED_INDEX]:
+            initialized = False
+            if use_distances:
+                initialized = self.initialize_from_distances(state_offset, timestamp, distance_data)
+            if not initialized:
+                initialized = self.initialize_from_position(state_offset, timestamp, position_data)
+            if not initialized:
+                return None
+            counters[counter_offset + INITIALIZED_INDEX] = 1
+            counters[counter_offset + NUM_UPDATES_INDEX] += 1
+            counters[counter_offset + CONSECUTIVE_REJECTIONS_INDEX] = 0
+            return self.get_filtered_record(device_name, slot, 1, 0)
+        self.predict(state_offset, timestamp)
+        num_accepted, num_rejected = 0, 0
+        if use_distances:
+            num_accepted, num_rejected = self.update_from_distances(state_offset, distance_data)
+        if num_accepted == 0 and num_rejected == 0 and position_data is not None:
+            num_accepted, num_rejected = self.update_from_position(state_offset, position_data)
+        counters[counter_offset + NUM_REJECTED_INDEX] += num_rejected
+        if num_accepted > 0:
+            counters[counter_offset + NUM_UPDATES_INDEX] += 1
+            counters[counter_offset + CONSECUTIVE_REJECTIONS_INDEX] = 0
+        elif num_rejected > 0:
+            counters[counter_offset + CONSECUTIVE_REJECTIONS_INDEX] += 1
+            if counters[counter_offset + CONSECUTIVE_REJECTIONS_INDEX] >= self.max_consecutive_rejections:
+                logger.debug('Rejected {} measurements in a row from {}; restarting track'.format(
+                    counters[counter_offset + CONSECUTIVE_REJECTIONS_INDEX],
+                    device_name))
+                self.reset(device_name)
+        return self.get_filtered_record(device_name, slot, num_accepted, num_rejected)
+
+    # Function for checking whether any of the distances are to anchors in the
+    # anchor index (so that the distances can be used rather than the position)
+    def has_known_anchor(self, distance_data):
+        if self.anchor_index is None or distance_data is None:
+            return False
+        anchor_positions = self.anchor_index.anchor_positions
+        for distance_datum in distance_data:
+            if (distance_datum['node_id'] & 0xffff) in anchor_positions:
+                return True
+        return False
+
+    def initialize_from_position(
+        self,
+        state_offset,
+        timestamp,
+        position_data):
+        if position_data is None or position_data['quality'] < self.min_position_quality:
+            return False
+        self.initialize(
+            state_offset,
+            timestamp,
+            (position_data['x_position'], position_data['y_position'], position_data['z_position']),
+            self.position_variance*100.0/max(position_data['quality'], 1))
+        return True
+
+    # Function for starting a track from distances, by multilateration (see
+    # decawave_ble.multilateration). Needs at least three usable distances
+    def initialize_from_distances(
+        self,
+        state_offset,
+        timestamp,
+        distance_data):
+        anchor_positions = []
+        distances = []
+        weights = []
+        for distance_datum in distance_data:
+            if distance_datum['quality'] < self.min_distance_quality:
+                continue
+            anchor_position = self.anchor_index.anchor_positions.get(distance_datum['node_id'] & 0xffff)
+            if anchor_position is None:
+                continue
+            anchor_positions.append(anchor_position)
+            distances.append(distance_datum['distance'])
+            weights.append(distance_datum['quality']/100.0)
+        if len(distances) < 3:
+            return False
+        solutions, residuals = decawave_ble.multilateration.solve_positions(
+            [anchor_positions],
+            [distances],
+            weights = [weights])
+        solution = solutions[0]
+        if not solution['converged']:
+            return False
+        self.initialize(
+            state_offset,
+            timestamp,
+            (float(solution['x_position']), float(solution['y_position']), float(solution['z_position'])),
+            max(self.distance_variance, float(solution['rms_residual'])**2))
+        return True
+
+    def initialize(
+        self,
+        state_offset,
+        timestamp,
+        position,
+        position_variance):
+        states = self.states
+        states[state_offset + TIME_INDEX] = timestamp
+        for axis_offset, axis_position in zip(AXIS_OFFSETS, position):
+            axis_state_offset = state_offset + axis_offset
+            states[axis_state_offset + POSITION_INDEX] = axis_position
+            states[axis_state_offset + VELOCITY_INDEX] = 0.0
+            states[axis_state_offset + POSITION_VARIANCE_INDEX] = position_variance
+            states[axis_state_offset + COVARIANCE_INDEX] = 0.0
+            states[axis_state_offset + VELOCITY_VARIANCE_INDEX] = self.initial_velocity_variance
+
+    # Function for advancing the state of a tag to timestamp (records which
+    # arrive out of order are treated as simultaneous with the last update)
+    def predict(
+        self,
+        state_offset,
+        timestamp):
+        states = self.states
+        time_step = timestamp - states[state_offset + TIME_INDEX]
+        if time_step <= 0:
+            return
+        states[state_offset + TIME_INDEX] = timestamp
+        process_noise = self.process_noise
+        position_noise = process_noise*time_step**3/3.0
+        covariance_noise = process_noise*time_step**2/2.0
+        velocity_noise = process_noise*time_step
+        for axis_offset in AXIS_OFFSETS:
+            index = state_offset + axis_offset
+            velocity = states[index + VELOCITY_INDEX]
+            covariance = states[index + COVARIANCE_INDEX]
+            velocity_variance = states[index + VELOCITY_VARIANCE_INDEX]
+            states[index + POSITION_INDEX] += velocity*time_step
+            states[index + POSITION_VARIANCE_INDEX] += time_step*(2.0*covariance + time_step*velocity_variance) + position_noise
+            states[index + COVARIANCE_INDEX] = covariance + time_step*velocity_variance + covariance_noise
+            states[index + VELOCITY_VARIANCE_INDEX] = velocity_variance + velocity_noise
+
+    # Function for updating the state of a tag from a reported position.
+    # Returns a tuple (num_accepted, num_rejected)
+    def update_from_position(
+        self,
+        state_offset,
+        position_data):
+        if position_data['quality'] < self.min_position_quality:
+            return 0, 1
+        states = self.states
+        measurement_variance = self.position_variance*100.0/max(position_data['quality'], 1)
+        measurement = (position_data['x_position'], position_data['y_position'], position_data['z_position'])
+        innovations = []
+        innovation_variances = []
+        normalized_innovation = 0.0
+        for axis_offset, axis_measurement in zip(AXIS_OFFSETS, measurement):
+            index = state_offset + axis_offset
+            innovation = axis_measurement - states[index + POSITION_INDEX]
+            innovation_variance = states[index + POSITION_VARIANCE_INDEX] + measurement_variance
+            normalized_innovation += innovation*innovation/innovation_variance
+            innovations.append(innovation)
+            innovation_variances.append(innovation_variance)
+        if normalized_innovation > self.position_gate:
+            return 0, 1
+        for axis_offset, innovation, innovation_variance in zip(AXIS_OFFSETS, innovations, innovation_variances):
+            index = state_offset + axis_offset
+            position_variance = states[index + POSITION_VARIANCE_INDEX]
+            covariance = states[index + COVARIANCE_INDEX]
+            position_gain = position_variance/innovation_variance
+            velocity_gain = covariance/innovation_variance
+            states[index + POSITION_INDEX] += position_gain*innovation
+            states[index + VELOCITY_INDEX] += velocity_gain*innovation
+            states[index + POSITION_VARIANCE_INDEX] = (1.0 - position_gain)*position_variance
+            states[index + COVARIANCE_INDEX] = (1.0 - position_gain)*covariance
+            states[index + VELOCITY_VARIANCE_INDEX] -= velocity_gain*covariance
+        return 1, 0
+
+    # Function for updating the state of a tag from distances to anchors, one
+    # range at a time. Returns a tuple (num_accepted, num_rejected)
+    def update_from_distances(
+        self,
+        state_offset,
+        distance_data):
+        states = self.states
+        anchor_positions = self.anchor_index.anchor_positions
+        num_accepted = 0
+        num_rejected = 0
+        for distance_datum in distance_data:
+            quality = distance_datum['quality']
+            anchor_position = anchor_positions.get(distance_datum['node_id'] & 0xffff)
+            if anchor_position is None:
+                continue
+            if quality < self.min_distance_quality:
+                num_rejected += 1
+                continue
+            measurement_variance = self.distance_variance*100.0/max(quality, 1)
+            offsets = [
+                states[state_offset + axis_offset + POSITION_INDEX] - anchor_coordinate
+                for axis_offset, anchor_coordinate in zip(AXIS_OFFSETS, anchor_position)]
+            predicted_distance = math.sqrt(offsets[0]*offsets[0] + offsets[1]*offsets[1] + offsets[2]*offsets[2])
+            if predicted_distance < 1e-6:
+                continue
+            directions = [offset/predicted_distance for offset in offsets]
+            innovation = distance_datum['distance'] - predicted_distance
+            innovation_variance = measurement_variance
+            for axis_offset, direction in zip(AXIS_OFFSETS, directions):
+                innovation_variance += direction*direction*states[state_offset + axis_offset + POSITION_VARIANCE_INDEX]
+            if innovation*innovation/innovation_variance > self.distance_gate:
+                num_rejected += 1
+                continue
+            for axis_offset, direction in zip(AXIS_OFFSETS, directions):
+                index = state_offset + axis_offset
+                position_variance = states[index + POSITION_VARIANCE_INDEX]
+                covariance = states[index + COVARIANCE_INDEX]
+                position_gain = position_variance*direction/innovation_variance
+                velocity_gain = covariance*direction/innovation_variance
+                states[index + POSITION_INDEX] += position_gain*innovation
+                states[index + VELOCITY_INDEX] += velocity_gain*innovation
+                states[index + POSITION_VARIANCE_INDEX] = position_variance - position_gain*direction*position_variance
+                states[index + COVARIANCE_INDEX] = covariance - position_gain*direction*covariance
+                states[index + VELOCITY_VARIANCE_INDEX] -= velocity_gain*direction*covariance
+            num_accepted += 1
+        return num_accepted, num_rejected
+
+    # Function for building a filtered record from the state of a tag: a
+    # dictionary with keys device_name, timestamp, position_data, velocity_data,
+    # position_uncertainty (the root of the sum of the position variances),
+    # num_accepted and num_rejected (measurements from the last record)
+    def get_filtered_record(
+        self,
+        device_name,
+        slot,
+        num_accepted,
+        num_rejected):
+        states = self.states
+        state_offset = slot*STATE_SIZE
+        x_offset, y_offset, z_offset = (state_offset + axis_offset for axis_offset in AXIS_OFFSETS)
+        return {
+            'device_name': device_name,
+            'timestamp': states[state_offset + TIME_INDEX],
+            'position_data': {
+                'x_position': states[x_offset + POSITION_INDEX],
+                'y_position': states[y_offset + POSITION_INDEX],
+                'z_position': states[z_offset + POSITION_INDEX]},
+            'velocity_data': {
+                'x_velocity': states[x_offset + VELOCITY_INDEX],
+                'y_velocity': states[y_offset + VELOCITY_INDEX],
+                'z_velocity': states[z_offset + VELOCITY_INDEX]},
+            'position_uncertainty': math.sqrt(
+                states[x_offset + POSITION_VARIANCE_INDEX] +
+                states[y_offset + POSITION_VARIANCE_INDEX] +
+                states[z_offset + POSITION_VARIANCE_INDEX]),
+            'num_accepted': num_accepted,
+            'num_rejected': num_rejected}
+
+    # Function for getting the current state of a tag (as in update, without
+    # updating it), or None if the tag has no track
+    def get_state(self, device_name):
+        slot = self.slots.get(device_name)
+        if slot is None or not self.counters[slot*COUNTERS_SIZE + INITIALIZED_INDEX]:
+            return None
+        return self.get_filtered_record(device_name, slot, 0, 0)
+
+    # Function for getting the update and rejection counts for each tag
+    def get_statistics(self):
+        return {
+            device_name: {
+                'num_updates': self.counters[slot*COUNTERS_SIZE + NUM_UPDATES_INDEX],
+                'num_rejected': self.counters[slot*COUNTERS_SIZE + NUM_REJECTED_INDEX],
+                'tracking': bool(self.counters[slot*COUNTERS_SIZE + INITIALIZED_INDEX])}
+            for device_name, slot in self.slots.items()}
+
+# Function for passing location data records (e.g., from
+# decawave_ble.stream_location_data) through a tracker and yielding the
+# filtered records. Remaining keyword arguments are passed to PositionTracker
+# if no tracker is given
+def track_location_data(
+    location_data_records,
+    tracker = None,
+    **kwargs):
+    if tracker is None:
+        tracker = PositionTracker(**kwargs)
+    for record in location_data_records:
+        filtered_record = tracker.update(record)
+        if filtered_record is not None:
+            yield filtered_record
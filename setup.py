@@ -12,7 +12,6 @@ setup(
     author_email='tcquinn@wildflowerschools.org',
     install_requires=[
         'bluepy',
-        'tenacity',
         'bitstruct',
     ],
     extras_require={
@@ -23,6 +22,12 @@ setup(
         's3': [
             'boto3',
         ],
+        'numpy': [
+            'numpy',
+        ],
+        'arrow': [
+            'pyarrow',
+        ],
     },
     keywords=['bluetooth'],
     classifiers=[